@@ -1,29 +1,263 @@
-import os, argparse, datetime, requests, re
+import os, argparse, datetime, requests, re, threading, time, hashlib, random, json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from box_sdk_gen import BoxClient, BoxDeveloperTokenAuth
+from box_sdk_gen.networking.base_urls import BaseUrls
+from box_sdk_gen.box.errors import BoxSDKError, BoxAPIError
 
-def main(developer_token, folders, regex):
+def make_client(developer_token: str, base_url: str = None) -> BoxClient:
+    """
+    Create a Box client.  If base_url is given, requests go to that server instead of
+    api.box.com (e.g., the stand-in server in fake_box.py).
+    """
     auth: BoxDeveloperTokenAuth = BoxDeveloperTokenAuth(token=developer_token)
     client: BoxClient = BoxClient(auth=auth)
-    root_folder = os.getcwd()
-
-    while len(folders) > 0:
-        folder_name = folders.pop(0)
-        folder_id = folders.pop(0)
-        os.makedirs(folder_name, exist_ok=True)
-        os.chdir(folder_name)
-        for item in client.folders.get_folder_items(folder_id).entries:
-            if re.search(regex, item.name):
-                print(item.id, item.name, datetime.datetime.now().isoformat())
-                success=0
-                while success==0:
-                    try:
-                        with open(item.name, 'wb') as output_stream:
-                            client.downloads.download_file_to_output_stream(item.id, output_stream)
-                            success=1
-                    except requests.exceptions.ConnectionError:
-                        print("Received requests.exceptions.ConnectionError; trying again")
-        os.chdir(root_folder)
-    
+    if base_url is not None:
+        client = client.with_custom_base_urls(BaseUrls(base_url=base_url, upload_url=base_url, oauth_2_url=base_url))
+    return client
+
+class Progress:
+    """
+    Thread-safe per-file progress report: prints each file's progress at most
+    once every `interval` seconds, and a summary line when it is complete.
+    """
+    def __init__(self, interval: float = 10.0):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.started, self.received, self.resumed, self.last_report = {}, {}, {}, {}
+
+    def start(self, name: str, size: int, offset: int = 0):
+        with self.lock:
+            self.started[name] = self.last_report[name] = time.time()
+            self.received[name] = self.resumed[name] = offset
+            resuming = ', resuming at %.1f MB'%(offset/2**20) if offset > 0 else ''
+            print('%s started (%.1f MB%s) %s'%(name, (size or 0)/2**20, resuming, datetime.datetime.now().isoformat()))
+
+    def update(self, name: str, nbytes: int, size: int):
+        with self.lock:
+            self.received[name] += nbytes
+            now = time.time()
+            if now - self.last_report[name] >= self.interval:
+                self.last_report[name] = now
+                percent = ' (%.0f%%)'%(100*self.received[name]/size) if size else ''
+                print('%s: %.1f MB%s'%(name, self.received[name]/2**20, percent))
+
+    def finish(self, name: str):
+        with self.lock:
+            elapsed = max(time.time() - self.started[name], 1e-6)
+            nbytes = self.received[name] - self.resumed[name]
+            print('%s done: %.1f MB in %.0f s (%.1f MB/s)'%(name, nbytes/2**20, elapsed, nbytes/2**20/elapsed))
+
+def file_sha1(path: str, blocksize: int = 2**20):
+    """
+    Return a hashlib.sha1 object updated with the contents of path (empty if path does not exist).
+    """
+    hasher = hashlib.sha1()
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(blocksize), b''):
+                hasher.update(block)
+    return hasher
+
+def backoff_delay(attempt: int, backoff: float = 1.0, max_backoff: float = 60.0) -> float:
+    """
+    Delay before retry number `attempt` (1, 2, ...): backoff * 2**(attempt-1), capped at max_backoff,
+    scaled by a random factor in [0.5, 1) so that concurrent downloads do not retry in lockstep.
+    """
+    return min(max_backoff, backoff * 2**(attempt-1)) * random.uniform(0.5, 1.0)
+
+def download_item(client: BoxClient, entry: dict, dirname: str, progress: Progress, blocksize: int = 2**16,
+                  max_retries: int = 8, backoff: float = 1.0, max_backoff: float = 60.0) -> str:
+    """
+    Download one file (an entry_dict) into dirname.  The file is written to <name>.part,
+    and renamed to <name> only when it is complete.
+
+    A file that already exists with the size and SHA-1 reported by Box is skipped.
+    An existing <name>.part is resumed with an HTTP Range request.  When the connection
+    fails, the download is resumed after an exponential backoff; after max_retries
+    consecutive failures without receiving any data, the last error is raised.
+    The SHA-1 of the completed file is checked against the one reported by Box;
+    on a mismatch the file is downloaded again from the beginning.
+
+    Data buffered in the response stream is lost when the connection drops, so the stream
+    is read in small blocks, and at most one block is downloaded again on each resume.
+    """
+    path = os.path.join(dirname, entry['name'])
+    tmppath = path + '.part'
+    if os.path.exists(path) and os.path.getsize(path) == entry['size']:
+        if entry['sha1'] is None or file_sha1(path, blocksize).hexdigest() == entry['sha1']:
+            print('%s is already complete; skipping'%(path))
+            return path
+    if os.path.exists(tmppath) and entry['size'] is not None and os.path.getsize(tmppath) > entry['size']:
+        os.remove(tmppath)  # the file on Box has changed since the partial download
+    hasher = file_sha1(tmppath, blocksize)  # kept in step with the bytes in tmppath
+    failures = 0
+    while True:
+        offset = os.path.getsize(tmppath) if os.path.exists(tmppath) else 0
+        try:
+            if offset == 0 or entry['size'] is None or offset < entry['size']:
+                progress.start(path, entry['size'], offset)
+                stream = client.downloads.download_file(entry['id'], range='bytes=%d-'%(offset) if offset > 0 else None)
+                with open(tmppath, 'ab' if offset > 0 else 'wb') as output_stream:
+                    for block in iter(lambda: stream.read(blocksize), b''):
+                        output_stream.write(block)
+                        hasher.update(block)
+                        progress.update(path, len(block), entry['size'])
+            if entry['sha1'] is None or hasher.hexdigest() == entry['sha1']:
+                break
+            error = RuntimeError('SHA-1 of %s does not match Box'%(path))
+            os.remove(tmppath)
+            hasher = hashlib.sha1()
+        except BoxAPIError:
+            raise
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, BoxSDKError) as e:
+            error = e
+            if os.path.exists(tmppath) and os.path.getsize(tmppath) > offset:
+                failures = 0
+        failures += 1
+        if failures > max_retries:
+            raise error
+        delay = backoff_delay(failures, backoff, max_backoff)
+        print('%s: %s; retrying in %.1f s'%(path, error, delay))
+        time.sleep(delay)
+    os.replace(tmppath, path)
+    progress.finish(path)
+    return path
+
+LISTING_FIELDS = ['name', 'size', 'sha1', 'etag', 'modified_at']
+
+def entry_dict(item) -> dict:
+    """
+    The parts of a Box folder entry (FileFull or FolderMini) needed to download or revisit it.
+    A folder's version is its [etag, modified_at]: if neither has changed, neither has its listing.
+    """
+    data = item.to_dict()
+    entry = { 'type':data['type'], 'id':data['id'], 'name':data.get('name') }
+    if entry['type'] == 'file':
+        entry.update(size=data.get('size'), sha1=data.get('sha1'))
+    elif entry['type'] == 'folder':
+        entry.update(version=[ data.get('etag'), data.get('modified_at') ])
+    return entry
+
+def folder_version(client: BoxClient, folder_id: str) -> list:
+    """
+    [etag, modified_at] of a folder, from one small request instead of a full listing.
+    """
+    return entry_dict(client.folders.get_folder_by_id(folder_id, fields=['etag','modified_at']))['version']
+
+def list_folder(client: BoxClient, folder_id: str, limit: int = 1000):
+    """
+    Yield entry_dict() of each item in a folder, following marker-based pagination.
+    While the caller works through one page, the next page is fetched in a background thread.
+    """
+    def fetch(marker):
+        return client.folders.get_folder_items(folder_id, fields=LISTING_FIELDS, usemarker=True,
+                                               marker=marker, limit=limit)
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        future = prefetcher.submit(fetch, None)
+        while future is not None:
+            page = future.result()
+            future = prefetcher.submit(fetch, page.next_marker) if page.next_marker else None
+            for item in page.entries or []:
+                yield entry_dict(item)
+
+def crawl(client: BoxClient, folder_id: str, dirname: str, cache: dict, recursive: bool = True,
+          version: list = None, limit: int = 1000):
+    """
+    Yield (file entry, local directory) for every file in a Box folder and, if recursive,
+    in its subfolders, which are mirrored as subdirectories of dirname.
+
+    cache[folder_id] = { 'version':[etag, modified_at], 'entries':[entry_dict, ...] } is updated with
+    each folder listed.  A folder whose version matches the cache is not listed again.
+    version is the folder's current version, if already known from its parent's listing;
+    otherwise it is requested.  Subfolders are visited after the folder's own files, so that
+    only one listing is in progress at a time.
+    """
+    if version is None:
+        version = folder_version(client, folder_id)
+    cached = cache.get(folder_id)
+    fresh = cached is None or cached['version'] != version
+    if fresh:
+        entries = []
+        for entry in list_folder(client, folder_id, limit):
+            entries.append(entry)
+            if entry['type'] == 'file':
+                yield entry, dirname
+        cache[folder_id] = { 'version':version, 'entries':entries }
+    else:
+        entries = cached['entries']
+        for entry in entries:
+            if entry['type'] == 'file':
+                yield entry, dirname
+    if recursive:
+        for entry in entries:
+            if entry['type'] == 'folder':
+                yield from crawl(client, entry['id'], os.path.join(dirname, entry['name']), cache, recursive,
+                                 entry['version'] if fresh else None, limit)
+
+def load_listing_cache(cachefile: str) -> dict:
+    if cachefile is None or not os.path.exists(cachefile):
+        return {}
+    with open(cachefile) as f:
+        return json.load(f)
+
+def save_listing_cache(cachefile: str, cache: dict):
+    tmpfile = cachefile + '.tmp'
+    with open(tmpfile, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmpfile, cachefile)
+
+def download_files(developer_token, folders, regex, nworkers=4, base_url=None, max_retries=8, backoff=1.0,
+                   recursive=False, listing_cache=None):
+    """
+    Download the files matching regex from each <folder_name> <folder_id> pair in folders,
+    with up to nworkers files downloading at once.  Each failed download is resumed after
+    backoff, 2*backoff, 4*backoff... seconds, up to max_retries times in a row.
+
+    If recursive, subfolders are mirrored as subdirectories of each folder_name.  Files are
+    queued for download as soon as they are listed, so listing overlaps downloading.
+    Folder listings are saved in listing_cache, and folders that have not changed since
+    are not listed again.
+
+    This is a generator: the local path of each file is yielded as soon as its download
+    completes (or is found to be complete already), so that the caller can start working
+    on it while the other files are downloading.
+    """
+    client: BoxClient = make_client(developer_token, base_url)
+    cache = load_listing_cache(listing_cache)
+
+    # each thread has its own client, since a client's HTTP session is not meant to be shared
+    local = threading.local()
+    def download(entry, dirname):
+        if not hasattr(local, 'client'):
+            local.client = make_client(developer_token, base_url)
+        return download_item(local.client, entry, dirname, progress, max_retries=max_retries, backoff=backoff)
+
+    progress = Progress()
+    pending = set()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, nworkers)) as pool:
+            for folder_name, folder_id in zip(folders[0::2], folders[1::2]):
+                for entry, dirname in crawl(client, folder_id, folder_name, cache, recursive):
+                    if re.search(regex or '', entry['name']):
+                        os.makedirs(dirname, exist_ok=True)
+                        pending.add(pool.submit(download, entry, dirname))
+                    for future in [ x for x in pending if x.done() ]:
+                        pending.remove(future)
+                        yield future.result()
+            for future in as_completed(pending):
+                yield future.result()
+    finally:
+        if listing_cache is not None:
+            save_listing_cache(listing_cache, cache)
+
+def main(developer_token, folders, regex, nworkers=4, base_url=None, max_retries=8, backoff=1.0,
+         recursive=False, listing_cache=None):
+    """
+    Download files as described in download_files.
+    """
+    for path in download_files(developer_token, folders, regex, nworkers, base_url, max_retries, backoff,
+                               recursive, listing_cache):
+        pass
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -34,6 +268,9 @@ if __name__ == '__main__':
 
         Here's a sample from one of my runs:
         python download.py X8uuOKI6TrpjbELuvVsJkAn6uoYWtz5b Dev 338866207012 Test1 338865316557 Test2 338867286130 Train 338867617703
+
+        To mirror a whole release folder, including its subfolders, and skip unchanged folders next time:
+        python download.py -R -c listing.json <developer_token> <dirname> <release_folder_id>
         """,
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
     )
@@ -65,16 +302,64 @@ if __name__ == '__main__':
         Each folder_id is obtained from box.com, for example
         in https://uofi.app.box.com/folder/334095714757, the folder_id is 334095714757.
 
-        Each directory name will be created if it does not exist, then this program will
-        change to that directory, and download all non-subfolder content from the corresponding
-        box folder_id, then change back to the current directory.
+        Each directory name will be created if it does not exist, and all non-subfolder
+        content from the corresponding box folder_id will be downloaded into it
+        (with --recursive, subfolders too).
         """
     )
+    parser.add_argument(
+        '-j','--nworkers',
+        action='store',
+        type=int,
+        default=4,
+        help="""
+        Maximum number of files downloaded at the same time.
+        """)
+    parser.add_argument(
+        '--base_url',
+        action='store',
+        default=None,
+        help="""
+        Send requests to this server instead of https://api.box.com, e.g., the
+        stand-in server started by fake_box.py for testing.
+        """)
+    parser.add_argument(
+        '--max_retries',
+        action='store',
+        type=int,
+        default=8,
+        help="""
+        Give up on a file after this many consecutive failed attempts that received no data.
+        Partial files (<name>.part) are kept, and resumed by the next run.
+        """)
+    parser.add_argument(
+        '--backoff',
+        action='store',
+        type=float,
+        default=1.0,
+        help="""
+        Seconds to wait before the first retry; the wait doubles after each failure, up to 60 s.
+        """)
+    parser.add_argument(
+        '-R','--recursive',
+        action='store_true',
+        help="""
+        Also download the contents of subfolders, into subdirectories of the same names.
+        """)
+    parser.add_argument(
+        '-c','--listing_cache',
+        action='store',
+        default=None,
+        help="""
+        JSON file in which folder listings are kept between runs.  A folder whose etag and
+        modified_at are unchanged is not listed again.
+        """)
     args = parser.parse_args()
     if len(args.folders) % 2 != 0:
         raise RuntimeError("""
         `folders' must be an even-length list, containing <foldername> <folder_id> pairs.
         """)
     
-    main(args.developer_token, args.folders, args.regex)
+    main(args.developer_token, args.folders, args.regex, args.nworkers, args.base_url, args.max_retries, args.backoff,
+         args.recursive, args.listing_cache)
     
@@ -0,0 +1,159 @@
+import os, json, hashlib, argparse, threading, re, datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+"""
+A local stand-in for the parts of the Box API used by download.py, serving a local
+directory tree as Box folders, so that download.py can be tested without a Box account:
+
+GET /2.0/folders/<folder_id>/items   folder listing (offset or marker pagination, fields=...)
+GET /2.0/files/<file_id>/content     file contents (Range requests give 206 Partial Content)
+GET /2.0/files/<file_id>             file information (name, size, sha1)
+GET /2.0/folders/<folder_id>         folder information (name, etag, modified_at)
+
+To test resumption, server.faults[file_id] can be set to a list of byte counts: each request
+for the file's content pops the first count, and the connection is closed after sending that
+many bytes of the response body.
+
+Every directory is a folder and every file is a file; IDs are assigned in sorted path order,
+starting from folder 0 for the root directory.  A folder's modified_at is the current mtime
+of its directory.  The developer token is not checked.
+"""
+
+class Fake_Box_Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, obj, status=200):
+        body = json.dumps(obj).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def not_found(self):
+        self.send_json({ 'type':'error', 'status':404, 'code':'not_found', 'message':self.path }, 404)
+
+    def item_json(self, item_id, fields):
+        item = self.server.items[item_id]
+        entry = { 'type':item['type'], 'id':item_id, 'name':item['name'], 'etag':'0' }
+        if item['type'] == 'file':
+            entry.update(size=os.path.getsize(item['path']), sha1=item['sha1'])
+        else:
+            mtime = os.stat(item['path']).st_mtime
+            entry.update(modified_at=datetime.datetime.fromtimestamp(mtime, datetime.timezone.utc).isoformat())
+        if fields is not None:
+            entry = { k:v for k,v in entry.items() if k in fields or k in ('type','id') }
+        return entry
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = { k:v[0] for k,v in parse_qs(url.query).items() }
+        fields = query['fields'].split(',') if 'fields' in query else None
+        self.server.requests.append(url.path)
+        m = re.fullmatch(r'/2.0/folders/(\w+)/items', url.path)
+        if m and m.group(1) in self.server.folders:
+            return self.list_folder(m.group(1), query, fields)
+        m = re.fullmatch(r'/2.0/files/(\w+)/content', url.path)
+        if m and m.group(1) in self.server.items:
+            return self.send_content(m.group(1))
+        m = re.fullmatch(r'/2.0/(files|folders)/(\w+)', url.path)
+        if m and m.group(2) in self.server.items:
+            return self.send_json(self.item_json(m.group(2), fields))
+        self.not_found()
+
+    def list_folder(self, folder_id, query, fields):
+        children = self.server.folders[folder_id]
+        limit = int(query.get('limit', 100))
+        if query.get('usemarker', '').lower() == 'true':
+            start = int(query['marker']) if query.get('marker') else 0
+            page = children[start:start+limit]
+            result = { 'entries':[ self.item_json(x, fields) for x in page ], 'limit':limit,
+                       'next_marker':str(start+limit) if start+limit < len(children) else None }
+        else:
+            start = int(query.get('offset', 0))
+            page = children[start:start+limit]
+            result = { 'entries':[ self.item_json(x, fields) for x in page ], 'limit':limit,
+                       'offset':start, 'total_count':len(children), 'order':[] }
+        self.send_json(result)
+
+    def send_content(self, file_id):
+        path = self.server.items[file_id]['path']
+        size = os.path.getsize(path)
+        start, end = 0, size-1
+        m = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if m:
+            start = int(m.group(1))
+            end = min(end, int(m.group(2))) if m.group(2) else end
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d'%(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        self.send_response(206 if m else 200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end-start+1))
+        if m:
+            self.send_header('Content-Range', 'bytes %d-%d/%d'%(start, end, size))
+        self.end_headers()
+        nbytes = end-start+1
+        faults = self.server.faults.get(file_id)
+        if faults:
+            nbytes = min(nbytes, faults.pop(0))
+            self.close_connection = True
+        with open(path, 'rb') as f:
+            f.seek(start)
+            self.wfile.write(f.read(nbytes))
+
+def serve_directory(rootdir, port=0):
+    '''
+    Serve rootdir as Box folder 0 in a background thread.
+
+    @return:
+    server (ThreadingHTTPServer): server.base_url is the base URL for download.py;
+      server.folders[folder_id] = list of child item IDs; server.items[item_id] = { type, name, path, sha1 };
+      server.requests lists the paths requested; server.faults injects dropped connections
+      (see above).  Call server.shutdown() when done.
+    '''
+    folders, items, paths = {}, { '0':{ 'type':'folder', 'name':'All Files', 'path':rootdir } }, { rootdir:'0' }
+    for dirpath, dirnames, filenames in sorted(os.walk(rootdir)):
+        folder_id = paths[dirpath]
+        folders[folder_id] = []
+        for name in sorted(dirnames) + sorted(filenames):
+            path = os.path.join(dirpath, name)
+            item_id = str(len(paths))
+            paths[path] = item_id
+            if os.path.isdir(path):
+                items[item_id] = { 'type':'folder', 'name':name, 'path':path }
+            else:
+                with open(path, 'rb') as f:
+                    items[item_id] = { 'type':'file', 'name':name, 'path':path, 'sha1':hashlib.sha1(f.read()).hexdigest() }
+            folders[folder_id].append(item_id)
+    server = ThreadingHTTPServer(('127.0.0.1', port), Fake_Box_Handler)
+    server.daemon_threads = True
+    server.folders, server.items, server.requests, server.faults = folders, items, [], {}
+    server.base_url = 'http://127.0.0.1:%d'%(server.server_address[1])
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="""
+        Serve a local directory as a stand-in for the Box API, for testing download.py.
+        The root directory is folder 0; the IDs of its subfolders are printed.
+        """,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('rootdir', action='store', help='Directory to serve')
+    parser.add_argument('-p','--port', action='store', type=int, default=8000, help='Port to listen on')
+    args = parser.parse_args()
+    server = serve_directory(args.rootdir, args.port)
+    for item_id, item in server.items.items():
+        if item['type'] == 'folder' and item_id != '0':
+            print(item_id, os.path.relpath(item['path'], args.rootdir))
+    print('Serving %s at %s (folder 0); use download.py --base_url %s'%(args.rootdir, server.base_url, server.base_url))
+    threading.Event().wait()
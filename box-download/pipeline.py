@@ -0,0 +1,132 @@
+import os, sys, argparse, json, time, hashlib
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','old_split_code','src'))
+import archivers, corpuscache
+import download
+
+"""
+Download a release from Box, unpack it, and index its contributor JSON files, as a pipeline:
+each archive is unpacked as soon as its download completes, and its JSON files are handed
+to the corpus cache (old_split_code/src/corpuscache.py) while later archives are still
+downloading, so that network transfer, decompression and JSON parsing overlap.
+
+Three pools of threads are connected by futures:
+  download.download_files: nworkers concurrent downloads, yielding each file when it is complete
+  extract_archive:         nextract concurrent extractions into extractdir
+  index_jsonfiles:         one indexer, which owns the cache index, parsing each archive's
+                           JSON files with nparse processes
+
+The resulting cache is the one used by SAPsplit.py --cachedir, so SAPsplit.py does not parse
+any of the JSON files again.
+"""
+
+RECORDDIR = '.extracted'
+
+def extract_archive(path: str, extractdir: str) -> list:
+    """
+    Unpack one downloaded file into extractdir.  A downloaded .json file is used where it is;
+    files that are neither JSON nor an archive (e.g., README.txt) are ignored.
+
+    The size and mtime of each unpacked archive, and the names of its members, are recorded in
+    extractdir/.extracted/, so that an archive that has not changed is not unpacked again.
+
+    @return:
+    jsonfiles (list): absolute pathnames of the JSON files from this download
+    """
+    if path.endswith('.json'):
+        return [ os.path.abspath(path) ]
+    if not any(path.endswith(x) for x in archivers.EXTRACTORS):
+        return []
+    st = os.stat(path)
+    stamp = [ st.st_size, st.st_mtime_ns ]
+    recordfile = os.path.join(extractdir, RECORDDIR, hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:20]+'.json')
+    record = None
+    if os.path.exists(recordfile):
+        with open(recordfile) as f:
+            record = json.load(f)
+    if (record is None or record['stamp'] != stamp
+        or not all(os.path.exists(os.path.join(extractdir, x)) for x in record['names'])):
+        start = time.time()
+        record = { 'archive':os.path.abspath(path), 'stamp':stamp, 'names':archivers.extract(path, extractdir) }
+        os.makedirs(os.path.dirname(recordfile), exist_ok=True)
+        with open(recordfile+'.tmp', 'w') as f:
+            json.dump(record, f)
+        os.replace(recordfile+'.tmp', recordfile)
+        print('%s unpacked: %d files in %.0f s'%(path, len(record['names']), time.time()-start))
+    else:
+        print('%s was already unpacked'%(path))
+    return [ os.path.abspath(os.path.join(extractdir, x)) for x in record['names'] if x.endswith('.json') ]
+
+def pipeline(developer_token, folders, regex, extractdir, cachedir, nworkers=4, nextract=2, nparse=1,
+             base_url=None, recursive=False, listing_cache=None, max_retries=8, backoff=1.0):
+    """
+    Download the files in folders (see download.download_files), unpack the archives
+    into extractdir, and index their JSON files in cachedir.
+
+    @return:
+    columns (dict): as returned by corpuscache.load_columns, for all of the JSON files
+    """
+    index = corpuscache.read_index(cachedir)
+
+    def index_batch(jsonfiles):
+        start = time.time()
+        stats, nparsed = corpuscache.index_jsonfiles(cachedir, jsonfiles, index, nparse)
+        print('Indexed %d JSON files (%d parsed) in %.1f s'%(len(jsonfiles), nparsed, time.time()-start))
+        return jsonfiles
+
+    def extract_and_index(path):
+        return indexer.submit(index_batch, extract_archive(path, extractdir))
+
+    with ThreadPoolExecutor(max_workers=max(1, nextract)) as extractors, ThreadPoolExecutor(max_workers=1) as indexer:
+        extractions = [ extractors.submit(extract_and_index, path)
+                        for path in download.download_files(developer_token, folders, regex, nworkers, base_url,
+                                                            max_retries, backoff, recursive, listing_cache) ]
+        indexings = [ x.result() for x in extractions ]
+        jsonfiles = sorted(set(jsonfile for x in indexings for jsonfile in x.result()))
+    return corpuscache.load_columns(cachedir, jsonfiles, index)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="""
+        Download a release from Box, unpack each archive as soon as it arrives, and index its
+        contributor JSON files in a corpus cache while the remaining archives download.
+
+        For example, to fetch and index the JSON-only archive of a release:
+        python pipeline.py -r Only_Json <developer_token> extracted corpus_cache Release <folder_id>
+        then run SAPsplit.py on the unpacked directory with --cachedir corpus_cache.
+        """,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('developer_token', action='store', help='Box developer token (see download.py)')
+    parser.add_argument('extractdir', action='store', help='Directory into which archives are unpacked')
+    parser.add_argument('cachedir', action='store', help='Corpus cache directory (see corpuscache.py)')
+    parser.add_argument('folders', action='store', nargs='*',
+                        help='<dirname> <folder_id> pairs, as for download.py')
+    parser.add_argument('-r','--regex', action='store', help='Only download items whose filename matches the regex')
+    parser.add_argument('-j','--nworkers', action='store', type=int, default=4,
+                        help='Maximum number of files downloaded at the same time')
+    parser.add_argument('-x','--nextract', action='store', type=int, default=2,
+                        help='Maximum number of archives unpacked at the same time')
+    parser.add_argument('-p','--nparse', action='store', type=int, default=1,
+                        help='Number of processes parsing the JSON files of each archive')
+    parser.add_argument('-R','--recursive', action='store_true', help='Also download the contents of subfolders')
+    parser.add_argument('-c','--listing_cache', action='store', default=None,
+                        help='JSON file in which folder listings are kept between runs (see download.py)')
+    parser.add_argument('--base_url', action='store', default=None,
+                        help='Send requests to this server instead of https://api.box.com')
+    parser.add_argument('--max_retries', action='store', type=int, default=8,
+                        help='Give up on a file after this many consecutive failed attempts')
+    parser.add_argument('--backoff', action='store', type=float, default=1.0,
+                        help='Seconds to wait before the first retry of a failed download')
+    args = parser.parse_args()
+    if len(args.folders) % 2 != 0:
+        raise RuntimeError("""
+        `folders' must be an even-length list, containing <foldername> <folder_id> pairs.
+        """)
+
+    start = time.time()
+    columns = pipeline(args.developer_token, args.folders, args.regex, args.extractdir, args.cachedir,
+                       args.nworkers, args.nextract, args.nparse, args.base_url, args.recursive,
+                       args.listing_cache, args.max_retries, args.backoff)
+    print('Indexed %d utterances from %d contributors in %.0f s'%(
+        len(columns['filename']), len(set(columns['contributor'])), time.time()-start))
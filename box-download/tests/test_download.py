@@ -0,0 +1,126 @@
+import unittest, os, sys, tempfile, shutil
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import download, fake_box
+
+class TestConcurrentDownload(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.remote = os.path.join(self.tmpdir, 'remote')
+        for folder in ['Dev','Train']:
+            os.makedirs(os.path.join(self.remote, folder))
+            for i in range(4):
+                with open(os.path.join(self.remote, folder, '%s_%d.7z'%(folder,i)), 'wb') as f:
+                    f.write(os.urandom(100000*(i+1)))
+            with open(os.path.join(self.remote, folder, 'README.txt'), 'w') as f:
+                f.write('not an archive')
+        self.server = fake_box.serve_directory(self.remote)
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.server.shutdown()
+        shutil.rmtree(self.tmpdir)
+
+    def assertDownloaded(self, folder, names):
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tmpdir, folder))), sorted(names))
+        for name in names:
+            with open(os.path.join(self.remote, folder, name), 'rb') as f:
+                expected = f.read()
+            with open(os.path.join(self.tmpdir, folder, name), 'rb') as f:
+                self.assertEqual(f.read(), expected, msg=name)
+
+    def test_concurrent_download(self):
+        ids = { self.server.items[x]['name']:x for x in self.server.folders['0'] }
+        download.main('token', ['Dev', ids['Dev'], 'Train', ids['Train']], r'\.7z$', 3, self.server.base_url)
+        for folder in ['Dev','Train']:
+            self.assertDownloaded(folder, [ '%s_%d.7z'%(folder,i) for i in range(4) ])
+
+class TestResume(TestConcurrentDownload):
+    def ids(self, folder):
+        folder_id = [ x for x in self.server.folders['0'] if self.server.items[x]['name'] == folder ][0]
+        return folder_id, { self.server.items[x]['name']:x for x in self.server.folders[folder_id] }
+
+    def content_requests(self):
+        return sorted(self.server.items[x.split('/')[3]]['name'] for x in self.server.requests if x.endswith('/content'))
+
+    def test_dropped_connections_resume(self):
+        folder_id, ids = self.ids('Train')
+        self.server.faults[ids['Train_3.7z']] = [ 150000 ]*10   # 400000 bytes in 2**16-byte blocks: cut twice
+        download.main('token', ['Train', folder_id], r'\.7z$', 2, self.server.base_url, backoff=0.01)
+        self.assertDownloaded('Train', [ 'Train_%d.7z'%(i) for i in range(4) ])
+        self.assertEqual(len(self.server.faults[ids['Train_3.7z']]), 7)
+
+    def test_complete_files_skipped(self):
+        folder_id, ids = self.ids('Dev')
+        download.main('token', ['Dev', folder_id], r'\.7z$', 2, self.server.base_url)
+        os.remove(os.path.join(self.tmpdir, 'Dev', 'Dev_0.7z'))
+        with open(os.path.join(self.tmpdir, 'Dev', 'Dev_1.7z'), 'r+b') as f:   # same size, wrong SHA-1
+            f.write(b'corrupted')
+        os.rename(os.path.join(self.tmpdir, 'Dev', 'Dev_2.7z'), os.path.join(self.tmpdir, 'Dev', 'Dev_2.7z.part'))
+        with open(os.path.join(self.tmpdir, 'Dev', 'Dev_2.7z.part'), 'r+b') as f:
+            f.truncate(123456)
+        self.server.requests.clear()
+        download.main('token', ['Dev', folder_id], r'\.7z$', 2, self.server.base_url)
+        self.assertDownloaded('Dev', [ 'Dev_%d.7z'%(i) for i in range(4) ])
+        self.assertEqual(self.content_requests(), ['Dev_0.7z', 'Dev_1.7z', 'Dev_2.7z'])
+
+    def test_gives_up_after_max_retries(self):
+        folder_id, ids = self.ids('Dev')
+        self.server.faults[ids['Dev_0.7z']] = [ 0 ]*10
+        with self.assertRaises(download.requests.exceptions.RequestException):
+            download.main('token', ['Dev', folder_id], r'Dev_0', 1, self.server.base_url, max_retries=2, backoff=0.01)
+        self.assertEqual(len(self.server.faults[ids['Dev_0.7z']]), 7)
+
+class TestCrawler(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.remote = os.path.join(self.tmpdir, 'remote')
+        self.files = []
+        for folder in ['Dev', 'Train', os.path.join('Train','Part2')]:
+            os.makedirs(os.path.join(self.remote, folder))
+            for i in range(5):
+                self.add_file(os.path.join(folder, 'f%d.7z'%(i)))
+        self.server = fake_box.serve_directory(self.remote)
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.server.shutdown()
+        shutil.rmtree(self.tmpdir)
+
+    def add_file(self, relpath):
+        with open(os.path.join(self.remote, relpath), 'wb') as f:
+            f.write(os.urandom(1000))
+        self.files.append(relpath)
+
+    def listed_folders(self):
+        return sorted(os.path.relpath(self.server.items[x.split('/')[3]]['path'], self.remote)
+                      for x in self.server.requests if x.endswith('/items'))
+
+    def crawl(self):
+        cache = download.load_listing_cache('listing.json')
+        client = download.make_client('token', self.server.base_url)
+        found = [ os.path.join(d, e['name']) for e, d in download.crawl(client, '0', 'mirror', cache, limit=2) ]
+        download.save_listing_cache('listing.json', cache)
+        return sorted(found)
+
+    def test_recursive_paginated_crawl(self):
+        self.assertEqual(self.crawl(), sorted(os.path.join('mirror', x) for x in self.files))
+        self.assertEqual(self.listed_folders(), ['.']*1 + ['Dev']*3 + ['Train']*3 + [os.path.join('Train','Part2')]*3)
+
+    def test_unchanged_folders_not_listed_again(self):
+        self.crawl()
+        self.add_file(os.path.join('Train','Part2','f9.7z'))   # sorts last, so the other IDs are unchanged
+        self.server.shutdown()
+        self.server = fake_box.serve_directory(self.remote)
+        self.assertEqual(self.crawl(), sorted(os.path.join('mirror', x) for x in self.files))
+        self.assertEqual(self.listed_folders(), [os.path.join('Train','Part2')]*3)
+
+    def test_main_mirrors_tree(self):
+        download.main('token', ['mirror', '0'], r'\.7z$', 3, self.server.base_url, recursive=True,
+                      listing_cache='listing.json')
+        for relpath in self.files:
+            with open(os.path.join(self.remote, relpath), 'rb') as f, open(os.path.join('mirror', relpath), 'rb') as g:
+                self.assertEqual(f.read(), g.read())
@@ -0,0 +1,57 @@
+import unittest, os, sys, json, tempfile, shutil
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import pipeline, fake_box, archivers, corpuscache
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmpdir, 'source')
+        self.remote = os.path.join(self.tmpdir, 'remote', 'Release')
+        os.makedirs(self.remote)
+        for n in range(12):
+            contributor_id = 'C%04d'%(n)
+            os.makedirs(os.path.join(self.source, 'Json', contributor_id))
+            contributor = { 'Contributor ID':contributor_id, 'Etiology':'ALS',
+                            'Files':[ { 'Filename':'%s_%d.wav'%(contributor_id,i), 'Prompt':{ 'Transcript':'prompt %d'%(i) } }
+                                      for i in range(3) ] }
+            with open(os.path.join(self.source, 'Json', contributor_id, contributor_id+'.json'), 'w') as f:
+                json.dump(contributor, f)
+        for n, writer_class in enumerate([ archivers.SevenZip_Writer, archivers.TarZstd_Writer ]):
+            writer = writer_class(os.path.join(self.remote, 'Release%d%s'%(n, writer_class.extension)))
+            for contributor_id in sorted(os.listdir(os.path.join(self.source, 'Json')))[n::2]:
+                writer.add(os.path.join(self.source, 'Json', contributor_id), os.path.join('Json', contributor_id))
+            writer.close()
+        with open(os.path.join(self.remote, 'README.txt'), 'w') as f:
+            f.write('not an archive')
+        self.server = fake_box.serve_directory(os.path.dirname(self.remote))
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.server.shutdown()
+        shutil.rmtree(self.tmpdir)
+
+    def run_pipeline(self):
+        return pipeline.pipeline('token', ['downloads', '0'], None, 'extracted', 'cache', nworkers=2,
+                                 base_url=self.server.base_url, recursive=True)
+
+    def test_pipeline_indexes_all_archives(self):
+        columns = self.run_pipeline()
+        self.assertEqual(sorted(columns['filename']), [ 'C%04d_%d.wav'%(n,i) for n in range(12) for i in range(3) ])
+        self.assertEqual(sorted(os.listdir(os.path.join('extracted', 'Json'))), [ 'C%04d'%(n) for n in range(12) ])
+        # the cache is already up to date for SAPsplit.py --cachedir
+        index = corpuscache.read_index('cache')
+        jsonfiles = [ os.path.abspath(os.path.join('extracted', 'Json', 'C%04d'%(n), 'C%04d.json'%(n))) for n in range(12) ]
+        self.assertEqual(corpuscache.index_jsonfiles('cache', jsonfiles, index)[1], 0)
+
+    def test_rerun_downloads_and_unpacks_nothing(self):
+        self.run_pipeline()
+        self.server.requests.clear()
+        records = { x:os.stat(os.path.join('extracted', pipeline.RECORDDIR, x)).st_mtime_ns
+                    for x in os.listdir(os.path.join('extracted', pipeline.RECORDDIR)) }
+        columns = self.run_pipeline()
+        self.assertEqual(len(columns['filename']), 36)
+        self.assertEqual([ x for x in self.server.requests if x.endswith('/content') ], [])
+        self.assertEqual(records, { x:os.stat(os.path.join('extracted', pipeline.RECORDDIR, x)).st_mtime_ns
+                                    for x in os.listdir(os.path.join('extracted', pipeline.RECORDDIR)) })
@@ -0,0 +1,179 @@
+import heapq
+import numpy as np
+"""
+Allocate speakers of several etiologies to several subsets (e.g., train and dev),
+so that the smallest etiology in each subset is as large as possible.
+
+The allocation has two stages:
+
+1. Required speakers (who must be placed in one of the subsets) are distributed
+one etiology at a time, using a priority queue keyed by each subset's count of that
+etiology divided by the subset's target size, so that each etiology is split among
+the subsets in proportion to their target sizes.
+
+2. The pool of optional candidates of each etiology is split among the subsets in the
+same way as the required speakers, so that a scarce etiology is shared by all subsets
+instead of being used up by the first.  Each subset is then topped up to its target size
+from its own share, by water-filling: the level L is the largest count such that raising
+every etiology to min(L, base+available) does not exceed the target, and the remainder
+is given one speaker each to etiologies at level L.  The level is found by binary search
+over the per-etiology counts, so the run time depends on the number of etiologies,
+not on the number of speakers.  Candidates that a subset does not need are pooled again,
+and any subset that its share could not fill is topped up from them, in order.
+
+If each speaker is given a weight (e.g., hours of audio), counts and targets are sums
+of weights instead of numbers of speakers.  Stage 1 is unchanged; stage 2 uses a priority
+queue instead of water-filling, repeatedly adding the next candidate of the etiology whose
+total is smallest, until the subset reaches its target.
+"""
+
+def distribute_required(counts, required, targets, weight=None):
+    '''
+    Distribute speakers who must be placed in one of the subsets.
+
+    @param:
+    counts (dict): counts[subset][etiology] = speakers already in subset; updated in place
+    required (dict): required[etiology] = list of speaker IDs that must be placed
+    targets (dict): targets[subset] = target number of speakers; ties go to the earlier subset
+    weight (dict): if not None, weight[spkr_id] is added to counts instead of 1
+
+    @return:
+    allocation (dict): allocation[subset] = list of speaker IDs added to subset
+    '''
+    allocation = { subset:[] for subset in targets }
+    for etiology, speakers in required.items():
+        heap = [ (counts[subset][etiology]/targets[subset], n, subset) for n,subset in enumerate(targets) ]
+        heapq.heapify(heap)
+        for spkr_id in sorted(speakers):
+            priority, n, subset = heapq.heappop(heap)
+            allocation[subset].append(spkr_id)
+            counts[subset][etiology] += 1 if weight is None else weight[spkr_id]
+            heapq.heappush(heap, (counts[subset][etiology]/targets[subset], n, subset))
+    return allocation
+
+def waterfill(base, available, total):
+    '''
+    Max-min allocation of candidates to one subset.
+
+    @param:
+    base (array): base[e] = number of speakers of etiology e already in the subset
+    available (array): available[e] = number of candidates of etiology e
+    total (int): target number of speakers in the subset, including base
+
+    @return:
+    take (array): take[e] = number of candidates of etiology e to add
+    '''
+    base = np.asarray(base, dtype='int64')
+    available = np.asarray(available, dtype='int64')
+    k = min(max(total - int(base.sum()), 0), int(available.sum()))
+    fill = lambda level: np.clip(level - base, 0, available)
+    lo, hi = 0, int(np.max(base + available, initial=0))
+    while lo < hi:
+        mid = (lo + hi + 1)//2
+        if fill(mid).sum() <= k:
+            lo = mid
+        else:
+            hi = mid - 1
+    take = fill(lo)
+    remainder = k - int(take.sum())
+    if remainder > 0:
+        growable = np.flatnonzero((base + take == lo) & (take < available))
+        take[growable[:remainder]] += 1
+    return take
+
+def greedy_fill(base, candidates, total, weight):
+    '''
+    Weighted max-min allocation of candidates to one subset.
+
+    @param:
+    base (dict): base[etiology] = total weight of the speakers already in the subset
+    candidates (dict): candidates[etiology] = list of candidate speaker IDs, taken in order
+    total (float): target total weight of the subset, including base
+    weight (dict): weight[spkr_id] = weight of each candidate
+
+    @return:
+    take (dict): take[etiology] = number of candidates of etiology to add
+    '''
+    current = sum(base.values())
+    take = { etiology:0 for etiology in base }
+    heap = [ (base[e], n, e) for n,e in enumerate(base) if len(candidates[e]) > 0 ]
+    heapq.heapify(heap)
+    while len(heap) > 0 and current < total:
+        value, n, etiology = heapq.heappop(heap)
+        w = weight[candidates[etiology][take[etiology]]]
+        take[etiology] += 1
+        current += w
+        if take[etiology] < len(candidates[etiology]):
+            heapq.heappush(heap, (value+w, n, etiology))
+    return take
+
+def allocate(etiologies, fixed, required, pools, targets, weight=None):
+    '''
+    Allocate required speakers, then split the pools among the subsets and
+    fill each subset up to its target size from its share.
+
+    @param:
+    etiologies (list): etiology names
+    fixed (dict): fixed[subset][etiology] = number of speakers already in subset
+    required (dict): required[etiology] = list of speaker IDs that must go to one of the subsets
+    pools (dict): pools[etiology] = list of optional candidate speaker IDs, shared by all subsets;
+      candidates are taken in sorted order
+    targets (dict): targets[subset] = total size of subset; subsets that their share cannot fill
+      are topped up in this order
+    weight (dict): if not None, weight[spkr_id] of every required and candidate speaker;
+      fixed, targets and the returned counts are then sums of weights
+
+    @return:
+    allocation (dict): allocation[subset] = list of speaker IDs added to subset
+    counts (dict): counts[subset][etiology] = final number of speakers, including fixed
+    '''
+    counts = { subset:{ e:fixed.get(subset,{}).get(e,0) for e in etiologies } for subset in targets }
+    allocation = distribute_required(counts, { e:required.get(e,[]) for e in etiologies }, targets, weight)
+
+    def fill(subset, candidates):
+        # top up subset from candidates[e], taken in order; return the candidates not taken
+        if weight is None:
+            take = waterfill([ counts[subset][e] for e in etiologies ],
+                             [ len(candidates[e]) for e in etiologies ], targets[subset])
+            take = dict(zip(etiologies, take))
+        else:
+            take = greedy_fill(counts[subset], candidates, targets[subset], weight)
+        for e in etiologies:
+            added = candidates[e][:take[e]]
+            allocation[subset].extend(added)
+            counts[subset][e] += len(added) if weight is None else sum(weight[x] for x in added)
+        return { e:candidates[e][take[e]:] for e in etiologies }
+
+    speaker2etiology = { x:e for e in etiologies for x in pools.get(e,[]) }
+    shares = distribute_required({ subset:dict(c) for subset,c in counts.items() },
+                                 { e:pools.get(e,[]) for e in etiologies }, targets, weight)
+    unused = { e:[] for e in etiologies }
+    for subset in targets:
+        rest = fill(subset, { e:[ x for x in shares[subset] if speaker2etiology[x] == e ] for e in etiologies })
+        for e in etiologies:
+            unused[e].extend(rest[e])
+    unused = { e:sorted(unused[e]) for e in etiologies }
+    for subset in targets:
+        unused = fill(subset, unused)
+    return allocation, counts
+
+def weight_table(speaker2subset, speaker2etiology, weight, subsets, etiologies):
+    '''
+    Total weight (e.g., hours) of the speakers of each etiology in each subset.
+
+    @param:
+    speaker2subset (dict): speaker2subset[spkr_id] = subset
+    speaker2etiology (dict): speaker2etiology[spkr_id] = etiology
+    weight (dict): weight[spkr_id] = weight of the speaker
+    subsets, etiologies (list): rows and columns of the table; other speakers are skipped
+
+    @return:
+    table (np.ndarray): table[s,e] = total weight of speakers in subsets[s] with etiologies[e]
+    '''
+    sindex = { subset:n for n,subset in enumerate(subsets) }
+    eindex = { etiology:n for n,etiology in enumerate(etiologies) }
+    speakers = [ x for x in speaker2subset if speaker2subset[x] in sindex and speaker2etiology.get(x) in eindex ]
+    cell = np.array([ sindex[speaker2subset[x]]*len(etiologies)+eindex[speaker2etiology[x]] for x in speakers ],
+                    dtype=np.int64)
+    w = np.array([ weight[x] for x in speakers ], dtype=float)
+    return np.bincount(cell, weights=w, minlength=len(subsets)*len(etiologies)).reshape(len(subsets),len(etiologies))
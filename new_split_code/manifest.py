@@ -0,0 +1,85 @@
+import os
+import numpy as np
+"""
+Read and write manifests in the SAPC1 format:
+the first line is a root path, then one line per utterance, `path<TAB>num_samples`.
+
+The whole file is read at once and split into columns with a single bytes.split,
+then speaker IDs and utterance IDs are cut out of the paths with numpy's vectorized
+string operations, so no Python code runs per line.
+"""
+
+def read_manifest(tsvfile):
+    '''
+    @param:
+    tsvfile (str): manifest in the SAPC1 format
+
+    @return:
+    manifest (dict):
+      manifest['root'] (str): first line of the file
+      manifest['path'] (np.ndarray of str): path of each utterance
+      manifest['speaker'] (np.ndarray of str): speaker ID, the part of the basename before the first '_'
+      manifest['utterance'] (np.ndarray of str): basename of the path without its extension
+      manifest['num_samples'] (np.ndarray of int64): sample count of each utterance
+    '''
+    with open(tsvfile, 'rb') as f:
+        data = f.read()
+    if len(data) == 0:
+        raise RuntimeError(tsvfile+' is empty')
+    root, _, body = data.partition(b'\n')
+    body = body.replace(b'\r', b'').strip(b'\n')
+    fields = body.replace(b'\t', b'\n').split(b'\n') if len(body) > 0 else []
+    if len(fields) % 2 != 0:
+        raise RuntimeError(tsvfile+' has a line without path<TAB>num_samples')
+    root = root.decode('utf8').rstrip('\r')
+    if len(fields) == 0:
+        empty = np.zeros(0, dtype=str)
+        return { 'root':root, 'path':empty, 'speaker':empty, 'utterance':empty,
+                 'num_samples':np.zeros(0, dtype=np.int64) }
+    paths = np.array(fields[0::2], dtype=bytes)
+    basenames = np.char.rpartition(paths, b'/')[:,2]
+    return {
+        'root': root,
+        'path': np.char.decode(paths, 'utf8'),
+        'speaker': np.char.decode(np.char.partition(basenames, b'_')[:,0], 'utf8'),
+        'utterance': np.char.decode(np.char.rpartition(basenames, b'.')[:,0], 'utf8'),
+        'num_samples': np.array(fields[1::2], dtype=bytes).astype(np.int64)
+    }
+
+def write_manifest(tsvfile, root, paths, num_samples):
+    '''
+    Write a manifest in the SAPC1 format.  The file is written to a temporary name
+    and then renamed, so readers never see a partially written manifest.
+
+    @param:
+    tsvfile (str): output filename
+    root (str): first line of the manifest
+    paths (sequence of str): path of each utterance
+    num_samples (sequence of int): sample count of each utterance
+    '''
+    if len(paths) != len(num_samples):
+        raise RuntimeError('%d paths but %d sample counts'%(len(paths), len(num_samples)))
+    lines = [ root ] + [ '%s\t%d'%(p,n) for p,n in zip(paths, num_samples) ]
+    tmpfile = tsvfile + '.tmp'
+    with open(tmpfile, 'w') as f:
+        f.write('\n'.join(lines)+'\n')
+    os.replace(tmpfile, tsvfile)
+
+def speaker_durations(manifests, sample_rate=16000):
+    '''
+    Total audio duration of each speaker, summed over one or more manifests.
+
+    @param:
+    manifests (list): manifests as returned by read_manifest
+    sample_rate (int): samples per second
+
+    @return:
+    speakers (np.ndarray of str): sorted unique speaker IDs
+    seconds (np.ndarray of float): seconds[i] = total duration of speakers[i]
+    '''
+    if len(manifests) == 0:
+        return np.zeros(0, dtype=str), np.zeros(0)
+    speaker = np.concatenate([ m['speaker'] for m in manifests ])
+    num_samples = np.concatenate([ m['num_samples'] for m in manifests ])
+    speakers, inverse = np.unique(speaker, return_inverse=True)
+    return speakers, np.bincount(inverse, weights=num_samples, minlength=len(speakers))/sample_rate
@@ -1,4 +1,8 @@
 import os, os.path, json, glob, argparse, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','old_split_code','src'))
+import corpusloader, corpuscache, near_duplicates
+import allocate, transcript_index, manifest
+import numpy as np
 """
 This script is designed to create the train/dev/test1/test2 splits
 for the second Speech Accessibility Project Challenge
@@ -33,40 +37,102 @@ subsets = ['dev', 'test1', 'test2', 'train']
 
 
 #####################################################################################
-def main(sapc1_dir, distrib_dir, output.dir):
+def main(sapc1_dir, distrib_dir, output_dir, nworkers=1, cachedir=None, targets=None, near_threshold=None,
+         balance='speakers', duration_files=None, sample_rate=16000, max_unmeasured=0.5):
+    if balance == 'hours' and (targets is None or None in targets.values()):
+        raise RuntimeError('balance=hours requires target hours for train and dev')
+    if targets is None:
+        targets = { 'train':875, 'dev':124 }
     # First: Read all data from SAPC1, get list of speaker IDs
     sapc1_speakers = { subset:set() for subset in subsets }
+    sapc1_manifests = {}
     for subset in subsets:
-        with open(os.path.join(sapc1_dir, subset+'.tsv')) as tsvfp:
-            for line in tsvfp:
-                utt_filename = os.path.basename(line)
-                speaker_id = utt_filename[0:utt_filename.find("_")]
-                sapc1_speakers[subset].add(speaker_id)
+        tsvfile = os.path.join(sapc1_dir, subset+'.tsv')
+        if not os.path.exists(tsvfile):
+            print('WARNING: %s does not exist; no SAPC1 speakers in %s'%(tsvfile,subset))
+            continue
+        sapc1_manifests[subset] = manifest.read_manifest(tsvfile)
+        sapc1_speakers[subset].update(np.unique(sapc1_manifests[subset]['speaker']))
+
+    # Audio duration of each speaker, from the SAPC1 manifests and any other manifests given
+    duration_manifests = list(sapc1_manifests.values())
+    duration_manifests += [ manifest.read_manifest(x) for x in (duration_files or []) ]
+    speakers, seconds = manifest.speaker_durations(duration_manifests, sample_rate)
+    speaker_hours = dict(zip(speakers, seconds/3600))
     
     # Second: load necessary info from the 2025-08-31 partner distribution
+    # Each utterance is kept only as (speaker, filename, transcript key)
     distrib_speakers = { subset:{} for subset in subsets }
-    distrib_transcripts = {}
+    utt_speakers = { subset:[] for subset in subsets }
+    utt_filenames = { subset:[] for subset in subsets }
+    utt_keys = { subset:[] for subset in subsets }
+    utt_transcripts = []   # only kept if near-copies are to be found
     for subset in subsets:
         jsonpathnames = glob.glob(os.path.join(distrib_dir,subset[0].upper()+subset[1:],"*.json"))
-        for x in jsonpathnames:
-            spkr_id = os.path.splitext(os.path.basename(x))[0]
-            with open(x) as ifp:
-                data = json.load(ifp)
-                # 1. Read in the etiology of the speaker
-                if 'Etiology' not in data:
-                    raise RuntimeError(subset+'/'+spkr_id+' has no Etiology')
-                distrib_speakers[subset][spkr_id] = data['Etiology']
-
-                # 2. Read in the text transcript of each utterance
-                for wavfile in data['Files']:
-                    if 'Prompt' not in wavfile or 'Transcript' not in wavefile['Prompt']:
-                        raise RuntimeError(subset+'/'+wavfile['Filename']+' has no Transcript')
-                    distrib_transcripts[spkr_id] = wavfile['Prompt']['Transcript']
-
-    # Third: count up the number of speakers of each etiology in SAPC1,
-    # and allocate them to train and dev of the new challenge
+        spkr_ids = [ os.path.splitext(os.path.basename(x))[0] for x in jsonpathnames ]
+        if cachedir is not None:
+            # The cached columns are used directly, without rebuilding the JSON dicts
+            columns = corpuscache.update_cache(cachedir, jsonpathnames, nworkers,
+                                               fields=['filename','transcript','json_etiology'])
+            missing = np.flatnonzero(corpuscache.absent(columns['json_missing'], 'Etiology', null=False))
+            if len(missing) > 0:
+                raise RuntimeError(subset+'/'+spkr_ids[missing[0]]+' has no Etiology')
+            missing = np.flatnonzero(corpuscache.absent(columns['missing'], 'Transcript'))
+            if len(missing) > 0:
+                raise RuntimeError(subset+'/'+columns['filename'][missing[0]]+' has no Transcript')
+            etiologies_found = [ None if m else e for e, m in zip(
+                columns['json_etiology'].tolist(), corpuscache.absent(columns['json_missing'], 'Etiology').tolist()) ]
+            distrib_speakers[subset].update(zip(spkr_ids, etiologies_found))
+            utt_speakers[subset] = np.array(spkr_ids, dtype=object)[columns['utt_json']].tolist()
+            utt_filenames[subset] = columns['filename'].tolist()
+            utt_keys[subset] = transcript_index.transcript_keys(columns['transcript'])
+            if near_threshold is not None:
+                utt_transcripts += columns['transcript'].tolist()
+            continue
+        for spkr_id, data in zip(spkr_ids, corpusloader.load_jsonfiles(jsonpathnames, nworkers)):
+            # 1. Read in the etiology of the speaker
+            if 'Etiology' not in data:
+                raise RuntimeError(subset+'/'+spkr_id+' has no Etiology')
+            distrib_speakers[subset][spkr_id] = data['Etiology']
+
+            # 2. Read in the text transcript of each utterance
+            for wavfile in data['Files']:
+                if 'Prompt' not in wavfile or 'Transcript' not in wavfile['Prompt']:
+                    raise RuntimeError(subset+'/'+wavfile['Filename']+' has no Transcript')
+                utt_speakers[subset].append(spkr_id)
+                utt_filenames[subset].append(wavfile['Filename'])
+                utt_keys[subset].append(transcript_index.transcript_key(wavfile['Prompt']['Transcript']))
+                if near_threshold is not None:
+                    utt_transcripts.append(wavfile['Prompt']['Transcript'])
+    utt_distrib = np.concatenate([ np.full(len(utt_keys[s]), s, dtype=object) for s in subsets ])
+    utt_speakers = np.array([ x for s in subsets for x in utt_speakers[s] ], dtype=object)
+    utt_filenames = np.array([ x for s in subsets for x in utt_filenames[s] ], dtype=object)
+    utt_keys = np.concatenate([ np.array(utt_keys[s], dtype=np.uint64) for s in subsets ])
+
+    # If balancing by hours, each speaker is weighted by hours of audio;
+    # speakers with no manifest are assumed to have the median duration, which is only
+    # allowed for a small fraction of the candidates, since otherwise hours are really speakers
+    weight = None
+    if balance == 'hours':
+        if len(speaker_hours) == 0:
+            raise RuntimeError('balance=hours requires manifests with sample counts')
+        median = float(np.median(list(speaker_hours.values())))
+        weight = { spkr_id:speaker_hours.get(spkr_id, median) for subset in subsets for spkr_id in distrib_speakers[subset] }
+        candidates = [ x for subset in targets for x in distrib_speakers[subset] if x not in sapc1_speakers[subset] ]
+        nmissing = sum(x not in speaker_hours for x in candidates)
+        if nmissing > max_unmeasured*len(candidates):
+            raise RuntimeError('balance=hours: %d of %d candidate speakers have no duration; give their manifests with --durations'%(
+                nmissing, len(candidates)))
+        if nmissing > 0:
+            print('WARNING: %d of %d candidate speakers have no duration; assuming %.2f hours each'%(
+                nmissing, len(candidates), median))
+
+    # Third: count up the number of speakers of each etiology in SAPC1.
+    # SAPC1 train and dev speakers stay where they were; SAPC1 test1 and test2
+    # speakers must go to train or dev of the new challenge
     sapc2_speakers = { subset:set() for subset in subsets }
-    sapc2_counts = { subset:{ etiology:0 for etiology in etiologies } for subset in subsets }
+    sapc1_counts = { subset:{ etiology:0 for etiology in etiologies } for subset in targets }
+    required = { etiology:[] for etiology in etiologies }
     for subset in subsets:
         for spkr_id in sapc1_speakers[subset]:
             if spkr_id not in distrib_speakers[subset]:
@@ -74,39 +140,84 @@ def main(sapc1_dir, distrib_dir, output.dir):
             etiology = distrib_speakers[subset][spkr_id]
             if etiology not in etiologies:
                 print('WARNING: %s/%s has unknown etiology: %s'%(subset,spkr_id,etiology))
+            elif subset in targets:
+                sapc2_speakers[subset].add(spkr_id)
+                sapc1_counts[subset][etiology] += 1 if weight is None else weight[spkr_id]
             else:
-                if subset=='dev' or subset=='train':
-                    sapc2_speakers[subset].add(spkr_id)
-                    sapc2_counts[subset][etiology] += 1
-            else:
-                if sapc2_counts['train'][etiology] < 7*sapc2_counts['dev'][etiology]:
-                    sapc2_speakers['train'].append(spkr_id)
-                    sapc2_counts['train'][etiology] += 1
-                else:
-                    sapc2_speakers['dev'].append(spkr_id)
-                    sapc2_counts['dev'][etiology] += 1
+                required[etiology].append(spkr_id)
 
     # Fourth: Finish SAPC2 splits by allocating other speakers from distribution:
-    # train+dev = maximize the minimum etiology up to 875+124
+    # train+dev = maximize the minimum etiology up to the target sizes
     # test1+test2 = all test1+test2 speakers in distribution who were not part of SAPC1
-    maxcounts = { 'train':875, 'dev':124 }
+    pools = { etiology:[] for etiology in etiologies }
     for subset in subsets:
-        e2s = { etiology:[] for etiology in etiologies }
-        for spkr_id in distrib_speakers[subset]:
+        for spkr_id, etiology in distrib_speakers[subset].items():
             if spkr_id not in sapc1_speakers[subset]:
-                if subset=='test1' or subset=='test2':
-                    sapc2_speakers[subset].append(spkr_id)
-                else:
-                    e2s[distrib_speakers[spkr_id]].append(spkr_id)
-    for subset in maxcounts.keys():
-        while len(sapc2_speakers[subset]) < maxcounts[subset]:
-            nextetiology = etiologies[np.argmin([ sapc2_counts[subset][e] for e in etiologies ])]
-            spkr_id = e2s[nextetiology].pop()
-            sapc2_speakers[subset].append(spkr_id)
+                if subset not in targets:
+                    sapc2_speakers[subset].add(spkr_id)
+                elif etiology in etiologies:
+                    pools[etiology].append(spkr_id)
+    allocation, sapc2_counts = allocate.allocate(etiologies, sapc1_counts, required, pools, targets, weight)
+    for subset in targets:
+        sapc2_speakers[subset].update(allocation[subset])
+    speaker2subset = { spkr_id:subset for subset in subsets for spkr_id in sapc2_speakers[subset] }
+    speaker2etiology = { spkr_id:e for subset in subsets for spkr_id,e in distrib_speakers[subset].items() }
+    if len(speaker_hours) > 0:
+        # hours per split and etiology; speakers with no manifest count as 0 unless balancing by hours
+        hours = weight if weight is not None else { x:speaker_hours.get(x,0.0) for x in speaker2subset }
+        table = allocate.weight_table(speaker2subset, speaker2etiology, hours, subsets, etiologies)
+        print('Hours'+' '*15+''.join('%10s'%(subset) for subset in subsets))
+        for e, etiology in enumerate(etiologies):
+            print('%-20s'%(etiology)+''.join('%10.1f'%(table[s,e]) for s in range(len(subsets))))
+        print('%-20s'%('Total')+''.join('%10.1f'%(x) for x in table.sum(axis=1)))
+    print('Speakers'+' '*12+''.join('%10s'%(subset) for subset in subsets))
+    for etiology in etiologies:
+        print('%-20s'%(etiology)+''.join('%10d'%(sum(speaker2etiology[x]==etiology for x in sapc2_speakers[s]))
+                                         for s in subsets))
 
     # Fifth: Find the waveforms from each of the test speakers whose transcripts
     # don't exist for any train or dev speaker in the distribution or in the challenge
-                
+    utt_sapc2 = np.array([ speaker2subset.get(spkr_id,'') for spkr_id in utt_speakers ], dtype=object)
+    is_train = np.isin(utt_distrib, list(targets)) | np.isin(utt_sapc2, list(targets))
+    index = transcript_index.build_index(utt_keys[is_train])
+    print('%d distinct train/dev transcripts'%(len(index)))
+    leaked = transcript_index.in_index(index, utt_keys)
+    if near_threshold is not None:
+        # also sequester test utterances that are near-copies of train/dev transcripts
+        test = np.flatnonzero(~is_train & ~leaked)
+        train = np.flatnonzero(is_train)
+        matches = near_duplicates.find_near_duplicates([ utt_transcripts[n] for n in test ],
+                                                       [ utt_transcripts[n] for n in train ], near_threshold)
+        leaked[test[[ q for q,r,s in matches ]]] = True
+        print('%d test utterances are near-copies of train/dev transcripts'%(len(matches)))
+
+    # Sixth: write the SAPC2 manifests, in the SAPC1 format, relative to distrib_dir;
+    # sample counts come from the SAPC1 manifests and duration_files
+    utt_paths = np.array([ '%s/%s/%s'%(d[0].upper()+d[1:], spkr_id, filename)
+                           for d, spkr_id, filename in zip(utt_distrib, utt_speakers, utt_filenames) ], dtype=object)
+    utt2samples = { u:n for m in duration_manifests for u,n in zip(m['utterance'], m['num_samples']) }
+    utt_ids = [ os.path.splitext(x)[0] for x in utt_filenames ]
+    unmeasured = np.array([ u not in utt2samples for u in utt_ids ], dtype=bool)
+    utt_samples = np.array([ utt2samples.get(u, 0) for u in utt_ids ], dtype=np.int64)
+    os.makedirs(output_dir, exist_ok=True)
+    sequestered = np.zeros(len(utt_keys), dtype=bool)
+    outputs = []
+    for subset in subsets:
+        keep = (utt_sapc2 == subset)
+        if subset not in targets:
+            sequestered |= keep & leaked
+            keep &= ~leaked
+        outputs.append((subset, keep))
+        print('%s: %d speakers, %d utterances'%(subset,len(sapc2_speakers[subset]),int(np.sum(keep))))
+    outputs.append(('sequestered', sequestered))
+    print('sequestered: %d utterances'%(int(np.sum(sequestered))))
+    for name, keep in outputs:
+        nmissing = int(np.sum(keep & unmeasured))
+        if nmissing > 0:
+            print('WARNING: %d utterances in %s.tsv have no duration in any manifest; their num_samples is 0'%(nmissing,name))
+        manifest.write_manifest(os.path.join(output_dir, name+'.tsv'), os.path.abspath(distrib_dir),
+                                utt_paths[keep], utt_samples[keep])
+
 ########################################################################################
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -117,7 +228,9 @@ if __name__ == '__main__':
         USAGE: python %s sapc1_dir distrib_dir output_dir
 
         distribution = 
-        output_dir = directory in which to write {dev,test1,test2,train}.txt listing files
+        output_dir = directory in which to write {dev,test1,test2,train}.tsv manifests
+        (in the SAPC1 format; see manifest.py), and sequestered.tsv listing test speaker
+        utterances whose transcripts occur in train or dev
         """%(sys.argv[0]),
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
     )
@@ -135,8 +248,63 @@ if __name__ == '__main__':
     )
     parser.add_argument(
         'output_dir',action='store',
-        help="Directory in which to put {dev,test1,test2,train}.txt files"
+        help="Directory in which to put {dev,test1,test2,train}.tsv and sequestered.tsv manifests"
+    )
+    parser.add_argument(
+        '-j','--nworkers',action='store',type=int,default=1,
+        help="Number of processes used to read the distribution JSON files"
+    )
+    parser.add_argument(
+        '--cachedir',action='store',default=None,
+        help="Columnar cache of the distribution JSON files; only changed files are parsed"
+    )
+    parser.add_argument(
+        '--train_size',action='store',type=int,default=875,
+        help="Number of speakers in the SAPC2 train split"
+    )
+    parser.add_argument(
+        '--dev_size',action='store',type=int,default=124,
+        help="Number of speakers in the SAPC2 dev split"
+    )
+    parser.add_argument(
+        '--near_threshold',action='store',type=float,default=None,
+        help="""
+        If given, also sequester test utterances whose transcripts are near-copies of
+        train/dev transcripts, with at least this estimated Jaccard similarity (see near_duplicates.py)
+        """
+    )
+    parser.add_argument(
+        '--balance',action='store',choices=['speakers','hours'],default='speakers',
+        help="""
+        Fill train and dev to --train_size and --dev_size speakers, or to --train_hours
+        and --dev_hours hours of audio
+        """
+    )
+    parser.add_argument(
+        '--train_hours',action='store',type=float,default=None,
+        help="Hours of audio in the SAPC2 train split, if --balance hours"
+    )
+    parser.add_argument(
+        '--dev_hours',action='store',type=float,default=None,
+        help="Hours of audio in the SAPC2 dev split, if --balance hours"
+    )
+    parser.add_argument(
+        '--durations',action='store',nargs='*',default=[],
+        help="Manifests (path<TAB>num_samples, e.g., written by wavscan.py) of distribution utterances, in addition to the SAPC1 manifests"
+    )
+    parser.add_argument(
+        '--max_unmeasured',action='store',type=float,default=0.5,
+        help="With --balance hours, fail if more than this fraction of the train/dev candidates have no duration in any manifest"
+    )
+    parser.add_argument(
+        '--sample_rate',action='store',type=int,default=16000,
+        help="Sample rate of the audio in the manifests"
     )
     args = parser.parse_args()
-    main(args.sapc1_dir, args.distrib_dir, args.output_dir)
+    if args.balance == 'hours':
+        targets = { 'train':args.train_hours, 'dev':args.dev_hours }
+    else:
+        targets = { 'train':args.train_size, 'dev':args.dev_size }
+    main(args.sapc1_dir, args.distrib_dir, args.output_dir, args.nworkers, args.cachedir,
+         targets, args.near_threshold, args.balance, args.durations, args.sample_rate, args.max_unmeasured)
 
@@ -0,0 +1,102 @@
+import unittest, os, sys, random
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import allocate
+
+def greedy_waterfill(base, available, total):
+    '''
+    One candidate at a time, to the etiology with the smallest count that still has candidates.
+    '''
+    final, left = list(base), list(available)
+    while sum(final) < total and sum(left) > 0:
+        e = min((x for x in range(len(final)) if left[x] > 0), key=lambda x: final[x])
+        final[e] += 1
+        left[e] -= 1
+    return final
+
+class TestWaterfill(unittest.TestCase):
+    def test_matches_greedy(self):
+        rng = random.Random(0)
+        for trial in range(300):
+            n = rng.randint(1, 8)
+            base = [ rng.randint(0, 20) for e in range(n) ]
+            available = [ rng.randint(0, 20) for e in range(n) ]
+            total = rng.randint(0, 250)
+            take = allocate.waterfill(base, available, total)
+            self.assertTrue(np.all(take >= 0) and np.all(take <= available))
+            self.assertEqual(int(take.sum()), min(max(total-sum(base), 0), sum(available)))
+            self.assertEqual(sorted(np.add(base, take)), sorted(greedy_waterfill(base, available, total)))
+
+    def test_full_subset_takes_nothing(self):
+        self.assertEqual(list(allocate.waterfill([5,5], [3,3], 8)), [0,0])
+
+class TestDistributeRequired(unittest.TestCase):
+    def test_proportional_to_targets(self):
+        counts = { 'train':{ 'ALS':0 }, 'dev':{ 'ALS':0 } }
+        required = { 'ALS':[ 'S%02d'%(n) for n in range(9) ] }
+        allocation = allocate.distribute_required(counts, required, { 'train':800, 'dev':100 })
+        self.assertEqual((len(allocation['train']), len(allocation['dev'])), (8, 1))
+        self.assertEqual(sorted(allocation['train']+allocation['dev']), required['ALS'])
+        self.assertEqual(counts, { 'train':{ 'ALS':8 }, 'dev':{ 'ALS':1 } })
+
+class TestAllocate(unittest.TestCase):
+    def test_totals_and_caps(self):
+        etiologies = ['ALS','PD','Stroke']
+        fixed = { 'train':{ 'PD':30 }, 'dev':{ 'PD':3 } }
+        required = { 'ALS':[ 'R%d'%(n) for n in range(5) ] }
+        pools = { 'ALS':[ 'A%d'%(n) for n in range(4) ], 'PD':[ 'P%d'%(n) for n in range(100) ],
+                  'Stroke':[ 'S%d'%(n) for n in range(40) ] }
+        allocation, counts = allocate.allocate(etiologies, fixed, required, pools, { 'train':80, 'dev':12 })
+        speakers = allocation['train'] + allocation['dev']
+        self.assertEqual(len(speakers), len(set(speakers)))
+        self.assertTrue(set(required['ALS']) <= set(speakers))
+        for subset, target in [('train',80), ('dev',12)]:
+            self.assertEqual(sum(counts[subset].values()), target)
+        self.assertEqual(counts['train']['ALS'] + counts['dev']['ALS'], 9)   # every ALS speaker is used
+
+    def test_scarce_etiologies_are_shared(self):
+        sizes = { 'DS':40, 'CP':120, 'ALS':150, 'PD':900, 'Stroke':200 }
+        pools = { e:[ '%s%03d'%(e,n) for n in range(k) ] for e,k in sizes.items() }
+        allocation, counts = allocate.allocate(list(sizes), {}, {}, pools, { 'train':875, 'dev':124 })
+        self.assertEqual({ s:sum(c.values()) for s,c in counts.items() }, { 'train':875, 'dev':124 })
+        for e in ['DS','CP','ALS','Stroke']:   # split in proportion to the targets
+            self.assertEqual(counts['train'][e] + counts['dev'][e], sizes[e])
+            self.assertAlmostEqual(counts['dev'][e]/sizes[e], 124/999, delta=0.01)
+        self.assertEqual(len(set(allocation['train']) & set(allocation['dev'])), 0)
+
+class TestWeighted(unittest.TestCase):
+    def test_greedy_fill_raises_the_smallest_total(self):
+        weight = { 'a%d'%(n):1.0 for n in range(10) }
+        weight.update({ 'b%d'%(n):0.5 for n in range(10) })
+        take = allocate.greedy_fill({ 'A':2.0, 'B':0.0 }, { 'A':[ 'a%d'%(n) for n in range(10) ],
+                                                          'B':[ 'b%d'%(n) for n in range(10) ] }, 6.0, weight)
+        self.assertEqual(take, { 'A':1, 'B':6 })   # A: 2+1 = 3, B: 6*0.5 = 3
+
+    def test_weighted_allocate_reaches_targets(self):
+        rng = random.Random(1)
+        etiologies = ['ALS','PD','Stroke']
+        pools = { e:[ '%s%02d'%(e,n) for n in range(30) ] for e in etiologies }
+        weight = { x:rng.uniform(0.2, 2.0) for e in etiologies for x in pools[e] }
+        targets = { 'train':20.0, 'dev':5.0 }
+        allocation, counts = allocate.allocate(etiologies, {}, {}, pools, targets, weight)
+        for subset, target in targets.items():
+            total = sum(weight[x] for x in allocation[subset])
+            self.assertAlmostEqual(total, sum(counts[subset].values()))
+            self.assertGreaterEqual(total, target)
+            self.assertLess(total, target + 2.0)
+        self.assertEqual(len(set(allocation['train']) & set(allocation['dev'])), 0)
+
+    def test_scarce_etiologies_are_shared(self):
+        sizes = { 'DS':40, 'CP':120, 'ALS':150, 'PD':900, 'Stroke':200 }
+        pools = { e:[ '%s%03d'%(e,n) for n in range(k) ] for e,k in sizes.items() }
+        weight = { x:1.0 for e in pools for x in pools[e] }
+        allocation, counts = allocate.allocate(list(sizes), {}, {}, pools, { 'train':875.0, 'dev':124.0 }, weight)
+        for e in ['DS','CP','ALS','Stroke']:
+            self.assertAlmostEqual(counts['dev'][e]/sizes[e], 124/999, delta=0.01)
+        self.assertEqual(sum(counts['dev'].values()), 124.0)
+
+    def test_weight_table(self):
+        table = allocate.weight_table({ 'x':'train', 'y':'train', 'z':'dev', 'w':'other' },
+                                      { 'x':'ALS', 'y':'PD', 'z':'ALS', 'w':'ALS' },
+                                      { 'x':1.5, 'y':2.0, 'z':0.25, 'w':9.0 }, ['train','dev'], ['ALS','PD'])
+        self.assertEqual(table.tolist(), [[1.5, 2.0], [0.25, 0.0]])
@@ -0,0 +1,47 @@
+import unittest, os, sys, tempfile, shutil
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import manifest
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.tsvfile = os.path.join(self.tmpdir, 'dev.tsv')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        paths = [ 'S001/S001_0001_utt.wav', 'S001/S001_0002_utt.wav', 'S2x/S2x_0001.v2.wav' ]
+        manifest.write_manifest(self.tsvfile, '/data/SAPC1/dev', paths, [16000, 8000, 123])
+        m = manifest.read_manifest(self.tsvfile)
+        self.assertEqual(m['root'], '/data/SAPC1/dev')
+        self.assertEqual(list(m['path']), paths)
+        self.assertEqual(list(m['speaker']), ['S001', 'S001', 'S2x'])
+        self.assertEqual(list(m['utterance']), ['S001_0001_utt', 'S001_0002_utt', 'S2x_0001.v2'])
+        self.assertEqual(list(m['num_samples']), [16000, 8000, 123])
+        manifest.write_manifest(self.tsvfile+'.copy', m['root'], m['path'], m['num_samples'])
+        with open(self.tsvfile) as f, open(self.tsvfile+'.copy') as g:
+            self.assertEqual(f.read(), g.read())
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['dev.tsv', 'dev.tsv.copy'])
+
+    def test_empty_and_malformed(self):
+        manifest.write_manifest(self.tsvfile, '/root', [], [])
+        m = manifest.read_manifest(self.tsvfile)
+        self.assertEqual((m['root'], len(m['path']), len(m['num_samples'])), ('/root', 0, 0))
+        with open(self.tsvfile, 'w') as f:
+            f.write('/root\na.wav\t10\nb.wav\n')
+        with self.assertRaises(RuntimeError):
+            manifest.read_manifest(self.tsvfile)
+        with self.assertRaises(RuntimeError):
+            manifest.write_manifest(self.tsvfile, '/root', ['a.wav'], [])
+
+    def test_speaker_durations(self):
+        manifest.write_manifest(self.tsvfile, '/a', ['B_1.wav', 'A_1.wav', 'B_2.wav'], [16000, 8000, 32000])
+        manifest.write_manifest(self.tsvfile+'.2', '/b', ['C_1.wav', 'A_2.wav'], [1600, 24000])
+        speakers, seconds = manifest.speaker_durations([ manifest.read_manifest(self.tsvfile),
+                                                         manifest.read_manifest(self.tsvfile+'.2') ])
+        self.assertEqual(list(speakers), ['A', 'B', 'C'])
+        self.assertEqual(list(seconds), [2.0, 3.0, 0.1])
+        speakers, seconds = manifest.speaker_durations([], 8000)
+        self.assertEqual((len(speakers), len(seconds)), (0, 0))
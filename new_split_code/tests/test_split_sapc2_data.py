@@ -0,0 +1,97 @@
+import unittest, os, sys, json, tempfile, shutil, io, contextlib
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import split_sapc2_data, manifest
+
+class TestHoursBalance(unittest.TestCase):
+    '''
+    A small distribution: 24 train, 8 dev, 4 test1 and 4 test2 speakers, of whom the first
+    6, 2, 1 and 1 were in SAPC1.  Speaker n has 3 utterances of (n%4+1)*400 seconds each.
+    Every test speaker says one transcript that is also said in train.
+    '''
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.sapc1_dir = os.path.join(self.tmpdir, 'sapc1')
+        self.distrib_dir = os.path.join(self.tmpdir, 'distrib')
+        self.output_dir = os.path.join(self.tmpdir, 'output')
+        os.makedirs(self.sapc1_dir)
+        self.hours, self.sapc1 = {}, {}
+        rows = []
+        for subset, nspeakers, nsapc1 in [('train',24,6), ('dev',8,2), ('test1',4,1), ('test2',4,1)]:
+            os.makedirs(os.path.join(self.distrib_dir, subset[0].upper()+subset[1:]))
+            speakers = [ '%s%02d'%(subset.upper(), n) for n in range(nspeakers) ]
+            self.sapc1[subset] = speakers[:nsapc1]
+            sapc1_rows = []
+            for n, spkr_id in enumerate(speakers):
+                seconds = (n % 4 + 1)*400
+                self.hours[spkr_id] = 3*seconds/3600
+                files = []
+                for i in range(3):
+                    transcript = 'shared prompt' if i == 0 else 'prompt %s %d'%(spkr_id, i)
+                    files.append({ 'Filename':'%s_%d.wav'%(spkr_id,i), 'Prompt':{ 'Transcript':transcript } })
+                    row = ('%s/%s_%d.wav'%(spkr_id,spkr_id,i), seconds*16000)
+                    (sapc1_rows if spkr_id in self.sapc1[subset] else rows).append(row)
+                with open(os.path.join(self.distrib_dir, subset[0].upper()+subset[1:], spkr_id+'.json'), 'w') as f:
+                    json.dump({ 'Etiology':['ALS','Stroke'][n % 2], 'Files':files }, f)
+            manifest.write_manifest(os.path.join(self.sapc1_dir, subset+'.tsv'), '/sapc1/'+subset,
+                                    [ r[0] for r in sapc1_rows ], [ r[1] for r in sapc1_rows ])
+        self.durations = os.path.join(self.tmpdir, 'durations.tsv')
+        manifest.write_manifest(self.durations, '/distrib', [ r[0] for r in rows ], [ r[1] for r in rows ])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_output(self, name):
+        m = manifest.read_manifest(os.path.join(self.output_dir, name+'.tsv'))
+        self.assertEqual(m['root'], os.path.abspath(self.distrib_dir))
+        return [ os.path.basename(x) for x in m['path'] ]
+
+    def test_hours_targets(self):
+        targets = { 'train':10.0, 'dev':3.0 }
+        with contextlib.redirect_stdout(io.StringIO()):
+            split_sapc2_data.main(self.sapc1_dir, self.distrib_dir, self.output_dir, targets=targets,
+                                  balance='hours', duration_files=[self.durations])
+        speakers = { s:set(x.split('_')[0] for x in self.read_output(s)) for s in split_sapc2_data.subsets }
+        for subset, target in targets.items():
+            total = sum(self.hours[x] for x in speakers[subset])
+            self.assertGreaterEqual(total, target - 1e-9)
+            self.assertLessEqual(total, target + max(self.hours.values()) + 1e-9)
+        # SAPC1 speakers: train and dev stay; test1 and test2 move to train or dev
+        self.assertTrue(set(self.sapc1['train']) <= speakers['train'])
+        self.assertTrue(set(self.sapc1['dev']) <= speakers['dev'])
+        for x in self.sapc1['test1'] + self.sapc1['test2']:
+            self.assertIn(x, speakers['train'] | speakers['dev'])
+        # test utterances of the shared transcript are sequestered
+        sequestered = self.read_output('sequestered')
+        for subset in ['test1','test2']:
+            self.assertEqual(len(speakers[subset]), 3)
+            for x in speakers[subset]:
+                self.assertIn(x+'_0.wav', sequestered)
+                self.assertNotIn(x+'_0.wav', self.read_output(subset))
+                self.assertIn(x+'_1.wav', self.read_output(subset))
+        # sample counts of the distribution utterances come from the duration manifest
+        m = manifest.read_manifest(os.path.join(self.output_dir, 'test1.tsv'))
+        for path, num_samples in zip(m['path'], m['num_samples']):
+            spkr_id = os.path.basename(path).split('_')[0]
+            self.assertEqual(path, 'Test1/%s/%s'%(spkr_id, os.path.basename(path)))
+            self.assertEqual(num_samples, self.hours[spkr_id]*3600/3*16000)
+
+    def test_cache_gives_the_same_split(self):
+        with open(os.path.join(self.distrib_dir, 'Train', 'SILENT.json'), 'w') as f:
+            json.dump({ 'Etiology':'ALS', 'Files':[] }, f)
+        outputs = []
+        for cachedir in [ None, os.path.join(self.tmpdir, 'cache') ]:
+            with contextlib.redirect_stdout(io.StringIO()):
+                split_sapc2_data.main(self.sapc1_dir, self.distrib_dir, self.output_dir, cachedir=cachedir,
+                                      targets={ 'train':20, 'dev':6 })
+            outputs.append({ x:self.read_output(x[:-4]) for x in os.listdir(self.output_dir) })
+            shutil.rmtree(self.output_dir)
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_hours_requires_durations(self):
+        with self.assertRaises(RuntimeError):
+            split_sapc2_data.main(self.sapc1_dir, self.distrib_dir, self.output_dir, targets={ 'train':10.0, 'dev':3.0 },
+                                  balance='hours')
+
+    def test_hours_requires_targets(self):
+        with self.assertRaises(RuntimeError):
+            split_sapc2_data.main(self.sapc1_dir, self.distrib_dir, self.output_dir, balance='hours')
@@ -0,0 +1,22 @@
+import unittest, os, sys
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import transcript_index
+
+class TestTranscriptIndex(unittest.TestCase):
+    def test_hits_and_misses(self):
+        index = transcript_index.build_index(transcript_index.transcript_keys(
+            ['Turn on the lights.', 'What time is it?', 'turn on the lights']))
+        self.assertEqual(len(index), 2)
+        found = transcript_index.in_index(index, transcript_index.transcript_keys(
+            ['TURN ON  the lights', "What time is it", 'Turn off the lights', 'Whats the time', '']))
+        self.assertEqual(list(found), [True, True, False, False, False])
+
+    def test_keys_beyond_the_ends_of_the_index(self):
+        index = transcript_index.build_index(np.array([10, 20, 30], dtype=np.uint64))
+        keys = np.array([0, 10, 25, 30, 2**64-1], dtype=np.uint64)
+        self.assertEqual(list(transcript_index.in_index(index, keys)), [False, True, False, True, False])
+
+    def test_empty_index(self):
+        found = transcript_index.in_index(transcript_index.build_index([]), transcript_index.transcript_keys(['a']))
+        self.assertEqual(list(found), [False])
@@ -0,0 +1,106 @@
+import unittest, os, sys, json, struct, tempfile, shutil, io, contextlib, wave
+from unittest import mock
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import wavscan
+
+def write_wav(path, num_samples, sample_rate=16000, channels=1):
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(b'\0\0'*channels*num_samples)
+
+class TestReadWavHeader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.wavfile = os.path.join(self.tmpdir, 'a.wav')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_valid(self):
+        write_wav(self.wavfile, 1234, 22050, 2)
+        self.assertEqual(wavscan.read_wav_header(self.wavfile),
+                         { 'num_samples':1234, 'sample_rate':22050, 'channels':2, 'bits_per_sample':16 })
+
+    def test_chunk_before_fmt(self):
+        fmt = struct.pack('<4sIHHIIHH', b'fmt ', 16, 1, 1, 16000, 32000, 2, 16)
+        info = b'LIST' + struct.pack('<I', 1001) + b'x'*1001 + b'\0'   # odd size, padded
+        data = b'data' + struct.pack('<I', 200) + b'\0'*200
+        body = b'WAVE' + info + fmt + data
+        with open(self.wavfile, 'wb') as f:
+            f.write(b'RIFF' + struct.pack('<I', len(body)) + body)
+        self.assertEqual(wavscan.read_wav_header(self.wavfile)['num_samples'], 100)
+
+    def test_truncated(self):
+        write_wav(self.wavfile, 1000)
+        with open(self.wavfile, 'rb') as f:
+            content = f.read()
+        with open(self.wavfile, 'wb') as f:
+            f.write(content[:1044])
+        self.assertEqual(wavscan.read_wav_header(self.wavfile)['num_samples'], 500)
+        with open(self.wavfile, 'wb') as f:
+            f.write(content[:30])
+        with self.assertRaises(RuntimeError):
+            wavscan.read_wav_header(self.wavfile)
+
+    def test_not_riff(self):
+        with open(self.wavfile, 'wb') as f:
+            f.write(b'ID3\x03' + b'\0'*100)
+        with self.assertRaises(RuntimeError):
+            wavscan.read_wav_header(self.wavfile)
+        with open(self.wavfile, 'wb') as f:
+            f.write(b'RI')
+        with self.assertRaises(RuntimeError):
+            wavscan.read_wav_header(self.wavfile)
+
+class TestScan(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.wavdir = os.path.join(self.tmpdir, 'wav')
+        self.cachefile = os.path.join(self.tmpdir, 'cache.json')
+        for n in range(3):
+            os.makedirs(os.path.join(self.wavdir, 'S%d'%(n)))
+            for i in range(2):
+                write_wav(os.path.join(self.wavdir, 'S%d'%(n), 'S%d_%d.wav'%(n,i)), 100*(n+1)+i)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def scan(self):
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            entries = wavscan.scan(self.wavdir, self.cachefile, nworkers=2)
+        return entries, out.getvalue()
+
+    def test_bad_file_is_skipped(self):
+        with open(os.path.join(self.wavdir, 'S1', 'S1_9.wav'), 'wb') as f:
+            f.write(b'not a wav file')
+        entries, out = self.scan()
+        self.assertEqual(len(entries), 6)
+        self.assertNotIn(os.path.join(self.wavdir, 'S1', 'S1_9.wav'), entries)
+        self.assertIn('WARNING', out)
+        self.assertIn('S1_9.wav', out)
+
+    def test_cache_is_reused(self):
+        self.scan()
+        entries, out = self.scan()
+        self.assertEqual(len(entries), 6)
+        self.assertIn('0 headers read, 6 from cache', out)
+
+    def test_cache_is_saved_when_interrupted(self):
+        self.scan()
+        write_wav(os.path.join(self.wavdir, 'S0', 'S0_2.wav'), 50)
+        read_wav_header = wavscan.read_wav_header
+        def fail_in_S2(path, size=None):
+            if os.path.basename(os.path.dirname(path)) == 'S2':
+                raise KeyboardInterrupt
+            return read_wav_header(path, size)
+        os.utime(os.path.join(self.wavdir, 'S2', 'S2_0.wav'), ns=(0, 0))
+        with mock.patch.object(wavscan, 'read_wav_header', fail_in_S2):
+            with self.assertRaises(KeyboardInterrupt):
+                self.scan()
+        with open(self.cachefile) as f:
+            cache = json.load(f)
+        # the new file read before the interruption, and the old entries that were not reached, are kept
+        self.assertEqual(len(cache), 7)
+        self.assertEqual(cache[os.path.join(self.wavdir, 'S0', 'S0_2.wav')][2]['num_samples'], 50)
@@ -0,0 +1,59 @@
+import hashlib, re, unicodedata
+import numpy as np
+"""
+Index of utterance transcripts, used to find test utterances whose transcript
+was also spoken by some train or dev speaker.
+
+Each transcript is normalized (Unicode NFKC, lowercase, punctuation removed,
+whitespace collapsed), then hashed with blake2b to a 64-bit key, so the transcripts
+themselves need not be kept in memory while the distribution is scanned.
+The index is a sorted array of unique keys; membership of any number of
+keys is tested in one pass with np.searchsorted.
+"""
+
+def normalize_transcript(transcript):
+    '''
+    Normalize a transcript so that differences of case, punctuation or spacing are ignored.
+    '''
+    text = unicodedata.normalize('NFKC', transcript).lower()
+    return ' '.join(re.sub(r"[^\w\s']|_", ' ', text).replace("'",'').split())
+
+def transcript_key(transcript):
+    '''
+    64-bit key of the normalized transcript.
+    '''
+    digest = hashlib.blake2b(normalize_transcript(transcript).encode('utf8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+def transcript_keys(transcripts):
+    '''
+    @param:
+    transcripts (iterable of str)
+    @return:
+    keys (np.ndarray of uint64): one key per transcript
+    '''
+    transcripts = list(transcripts)
+    return np.fromiter((transcript_key(t) for t in transcripts), dtype=np.uint64, count=len(transcripts))
+
+def build_index(keys):
+    '''
+    @param:
+    keys (array of uint64): transcript keys of the utterances to be indexed
+    @return:
+    index (np.ndarray of uint64): sorted unique keys
+    '''
+    return np.unique(np.asarray(keys, dtype=np.uint64))
+
+def in_index(index, keys):
+    '''
+    @param:
+    index (np.ndarray of uint64): output of build_index
+    keys (array of uint64): transcript keys to look up
+    @return:
+    found (np.ndarray of bool): found[i] is True if keys[i] is in the index
+    '''
+    keys = np.asarray(keys, dtype=np.uint64)
+    if len(index) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    pos = np.minimum(np.searchsorted(index, keys), len(index)-1)
+    return index[pos] == keys
@@ -0,0 +1,183 @@
+import os, json, struct, argparse, sys, fnmatch
+from concurrent.futures import ThreadPoolExecutor
+import manifest
+"""
+Build path<TAB>num_samples manifests (the SAPC1 format; see manifest.py)
+by reading only the RIFF header of each WAV file.
+
+The first HEADER_BYTES of each file are read with os.pread; chunks are walked
+until the 'data' chunk, whose size divided by the block alignment of the 'fmt ' chunk
+is the number of samples.  No audio is decoded.  Contributor directories are scanned
+by a thread pool, since the work is dominated by file system latency.
+
+Results are kept in a JSON cache keyed by path, with the file's size and mtime,
+so a rerun only reads the headers of new or modified files.
+"""
+
+HEADER_BYTES = 512
+
+def read_wav_header(path, size=None):
+    '''
+    @param:
+    path (str): WAV file
+    size (int): size of the file in bytes, if already known from a directory scan
+
+    @return:
+    header (dict): num_samples, sample_rate, channels, bits_per_sample
+    '''
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if size is None:
+            size = os.fstat(fd).st_size
+        buf, base = os.pread(fd, HEADER_BYTES, 0), 0
+        def read(offset, n):
+            # bytes [offset, offset+n) of the file; re-read only if they are outside the buffer
+            nonlocal buf, base
+            if offset < base or offset + n > base + len(buf):
+                buf, base = os.pread(fd, max(HEADER_BYTES, n), offset), offset
+            if offset + n > base + len(buf):
+                raise RuntimeError(path+' is truncated')
+            return buf[offset-base:offset-base+n]
+        if read(0, 4) != b'RIFF' or read(8, 4) != b'WAVE':
+            raise RuntimeError(path+' is not a RIFF WAVE file')
+        header, offset = {}, 12
+        while offset + 8 <= size:
+            chunk_id, chunk_size = struct.unpack('<4sI', read(offset, 8))
+            if chunk_id == b'fmt ':
+                channels, sample_rate, byte_rate, block_align, bits = struct.unpack('<HIIHH', read(offset+10, 14))
+                header.update(sample_rate=sample_rate, channels=channels, bits_per_sample=bits,
+                              block_align=block_align)
+            elif chunk_id == b'data':
+                if 'block_align' not in header or header['block_align'] == 0:
+                    raise RuntimeError(path+' has no valid fmt chunk before its data chunk')
+                # streamed files may have a placeholder size; truncated files may be shorter than stated
+                data_size = min(chunk_size, size - offset - 8)
+                header['num_samples'] = data_size // header.pop('block_align')
+                return header
+            offset += 8 + chunk_size + (chunk_size % 2)
+        raise RuntimeError(path+' has no data chunk')
+    finally:
+        os.close(fd)
+
+def load_cache(cachefile):
+    '''
+    @return:
+    cache (dict): cache[path] = [size, mtime_ns, header]; empty if cachefile is None or does not exist
+    '''
+    if cachefile is None or not os.path.exists(cachefile):
+        return {}
+    with open(cachefile) as f:
+        return json.load(f)
+
+def save_cache(cachefile, cache):
+    tmpfile = cachefile + '.tmp'
+    with open(tmpfile, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmpfile, cachefile)
+
+def scan_directory(directory, cache, pattern='*.wav', recursive=True):
+    '''
+    Read the headers of all files in directory matching pattern,
+    except those whose size and mtime match the cache.
+    Files whose header cannot be read are skipped with a warning.
+
+    @return:
+    entries (dict): entries[path] = [size, mtime_ns, header]
+    nread (int): number of headers actually read
+    '''
+    entries, nread, stack = {}, 0, [directory]
+    while len(stack) > 0:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        stack.append(entry.path)
+                elif fnmatch.fnmatch(entry.name, pattern):
+                    st = entry.stat()
+                    cached = cache.get(entry.path)
+                    if cached != None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+                        entries[entry.path] = cached
+                    else:
+                        try:
+                            header = read_wav_header(entry.path, st.st_size)
+                        except (RuntimeError, OSError) as e:
+                            print('WARNING: skipping %s: %s'%(entry.path, e))
+                            continue
+                        entries[entry.path] = [ st.st_size, st.st_mtime_ns, header ]
+                        nread += 1
+    return entries, nread
+
+def scan(wavdir, cachefile=None, nworkers=8, pattern='*.wav'):
+    '''
+    Scan every contributor directory of wavdir in a thread pool.
+
+    @param:
+    wavdir (str): directory containing one subdirectory per contributor (and/or WAV files)
+    cachefile (str): JSON cache of previously read headers; rewritten if not None,
+      even if the scan is interrupted, so that headers already read are not read again
+    nworkers (int): number of threads
+    pattern (str): filename pattern of the audio files
+
+    @return:
+    entries (dict): entries[path] = [size, mtime_ns, header], for every WAV file currently in wavdir
+    '''
+    cache = load_cache(cachefile)
+    entries, completed = {}, False
+    try:
+        entries, nread = scan_directory(wavdir, cache, pattern, recursive=False)
+        with os.scandir(wavdir) as it:
+            subdirs = sorted(entry.path for entry in it if entry.is_dir(follow_symlinks=False))
+        with ThreadPoolExecutor(max_workers=max(1,nworkers)) as pool:
+            for subentries, n in pool.map(lambda d: scan_directory(d, cache, pattern), subdirs):
+                entries.update(subentries)
+                nread += n
+        completed = True
+    finally:
+        if cachefile is not None:
+            # after an interruption, keep the old entries of directories that were not reached
+            save_cache(cachefile, entries if completed else { **cache, **entries })
+    print('%d WAV files, %d headers read, %d from cache'%(len(entries), nread, len(entries)-nread))
+    return entries
+
+def main(wavdir, outputfile, cachefile=None, nworkers=8, pattern='*.wav'):
+    entries = scan(wavdir, cachefile, nworkers, pattern)
+    paths = sorted(entries.keys())
+    rates = set(entries[p][2]['sample_rate'] for p in paths)
+    if len(rates) > 1:
+        print('WARNING: %s contains several sample rates: %s'%(wavdir, sorted(rates)))
+    manifest.write_manifest(outputfile, os.path.abspath(wavdir), paths,
+                            [ entries[p][2]['num_samples'] for p in paths ])
+
+########################################################################################
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="""
+        Write a path<TAB>num_samples manifest for all WAV files under a directory,
+        reading only their RIFF headers.
+
+        USAGE: python %s wavdir outputfile
+        """%(sys.argv[0]),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        'wavdir',action='store',
+        help='Directory containing one subdirectory of WAV files per contributor'
+    )
+    parser.add_argument(
+        'outputfile',action='store',
+        help='Manifest to write, in the SAPC1 format'
+    )
+    parser.add_argument(
+        '--cache',action='store',default=None,
+        help='JSON cache of WAV headers keyed by path, size and mtime; only new or changed files are read'
+    )
+    parser.add_argument(
+        '-j','--nworkers',action='store',type=int,default=8,
+        help='Number of threads reading WAV headers'
+    )
+    parser.add_argument(
+        '--pattern',action='store',default='*.wav',
+        help='Filename pattern of the audio files'
+    )
+    args = parser.parse_args()
+    main(args.wavdir, args.outputfile, args.cache, args.nworkers, args.pattern)
@@ -1,5 +1,5 @@
 import argparse, json, copy, os.path, glob, collections, random, logging, pandas
-import promptfiles
+import promptfiles, corpusloader, corpuscache, test_overlaps
 
 '''
 Read in JSON files from a Speech Accessibility Project corpus, and generate a train/dev/test split.
@@ -29,6 +29,7 @@ Originally written 2023 Aug 12, re-using a little code from update_train_test_sp
 Revised 2023 Aug 23
 Revised 2024 Jan 16 to use the listfiles
 Revised 2024 May 11 to expect all input JSONS in toplevel datadir
+Revised to add an incremental mode (update), which reuses the previous month's split
 '''
 
 def create_subset2contributors(listfile):
@@ -83,22 +84,24 @@ def create_subset2prompts(prompts):
                         subset2prompts[subset].add(prompts[listnum][block][ind][2])
     return subset2prompts
 
-def load_corpus(datadir):
+def load_corpus(datadir, nworkers=1, chunksize=64, cachedir=None):
     '''
     @param:
     datadir (str): directory containing the corpus
+    nworkers (int): number of processes used to parse the JSON files (see corpusloader)
+    chunksize (int): number of JSON files parsed by each process in each task
+    cachedir (str): if not None, only parse JSON files that changed since they were
+      stored in this columnar cache (see corpuscache)
 
     @return:
     corpus (dict): corpus[contributor_id] is content of one JSON file
+      (only the fields stored in the cache, if cachedir is not None)
     '''
-    corpus = {}
-    jsonfiles = glob.glob(os.path.join(datadir, '*/*.json'))
-    print('Found',len(jsonfiles),'matching',os.path.join(datadir, '*/*.json'))
-    for jsonfile in jsonfiles:
-        with open(jsonfile) as f:
-            contributor = json.load(f)
-            corpus[contributor['Contributor ID']] = contributor
-    return corpus
+    if cachedir is None:
+        return corpusloader.load_corpus(datadir, nworkers, chunksize)
+    jsonfiles = corpusloader.find_jsonfiles(datadir)
+    columns = corpuscache.update_cache(cachedir, jsonfiles, nworkers, chunksize)
+    return corpuscache.columns_to_corpus(columns)
 
 def assign_contributors(subset2prompts, corpus):
     '''
@@ -171,13 +174,14 @@ def assign_wavfiles(subset2contributors, corpus):
             
     return subset2wavfiles, wavfile2prompt
 
-def determine_sharing(subset2wavfiles, wavfile2prompt):
+def determine_sharing(subset2wavfiles, wavfile2prompt, trainprompts=None):
     '''
     Divide dev, test1 and test2 subsets into shared and unshared portions.
 
     @param:
     subset2wavfiles (dict): map subset to a list of wavfiles
     wavfile2prompt (dict): map wavefile to [category, subcategory, prompt text]
+    trainprompts (set): prompt texts of the train subset; if None, computed from subset2wavfiles['train']
 
     @return:
     subset2files (dict):
@@ -190,7 +194,8 @@ def determine_sharing(subset2wavfiles, wavfile2prompt):
     subset2files['train'] = {}
     for w in subset2wavfiles['train']:
         subset2files['train'][w] = [ wavfile2prompt[w][2], wavfile2prompt[w][3] ]
-    trainprompts = set(p[0] for p in subset2files['train'].values())
+    if trainprompts is None:
+        trainprompts = set(p[0] for p in subset2files['train'].values())
     
     for subset in ['dev','test1','test2']:
         subset2files[subset] = { 'shared':{}, 'unshared':{} }
@@ -203,19 +208,174 @@ def determine_sharing(subset2wavfiles, wavfile2prompt):
     return subset2files
 
 ####################################################################################
-def main(datadir, listfile=None):
+# Incremental update of a previous split
+
+def load_previous_split(splitfile, contributorfile):
+    '''
+    @param:
+    splitfile (str): JSON file written by a previous run, in the format returned by determine_sharing
+    contributorfile (str): JSON file written by a previous run, mapping subset to contributor IDs
+
+    @return:
+    prev_files (dict): as returned by determine_sharing
+    prev_contributors (dict): map subset to a set of contributor_ids
+    '''
+    with open(splitfile) as f:
+        prev_files = json.load(f)
+    with open(contributorfile) as f:
+        prev_contributors = { s:set(L) for s,L in json.load(f).items() }
+    return prev_files, prev_contributors
+
+def label_wavfiles(subset2files):
+    '''
+    @param:
+    subset2files (dict): as returned by determine_sharing
+
+    @return:
+    wavfile2label (dict): map wavfile to 'train', or to subset:pset, e.g., 'dev:shared'
+    wavfile2entry (dict): map wavfile to its [prompt, transcript]
+    '''
+    wavfile2label = {}
+    wavfile2entry = {}
+    for subset, files in subset2files.items():
+        if subset == 'train':
+            groups = { 'train':files }
+        else:
+            groups = { subset+':'+pset:files[pset] for pset in files }
+        for label, group in groups.items():
+            for w, entry in group.items():
+                wavfile2label[w] = label
+                wavfile2entry[w] = entry
+    return wavfile2label, wavfile2entry
+
+def find_changed_contributors(corpus, prev_contributors, wavfile2label, wavfile2entry):
+    '''
+    A contributor is unchanged if they were assigned to a subset in the previous split,
+    and every one of their files was in that subset of the previous split, with the same
+    prompt text and transcript.  Files that were deleted do not make a contributor changed;
+    they are simply missing from the new split.
+
+    @param:
+    corpus (dict): map contributor_id to the dict stored in their json file
+    prev_contributors (dict): map subset to a set of contributor_ids
+    wavfile2label, wavfile2entry (dict): as returned by label_wavfiles for the previous split
+
+    @return:
+    unchanged (dict): map each unchanged contributor_id to their previous subset
+    changed (list): contributor_ids that are new, or whose files changed
+    '''
+    contributor2subset = { c:s for s,L in prev_contributors.items() for c in L }
+    unchanged = {}
+    changed = []
+    for contributor_id, data in corpus.items():
+        subset = contributor2subset.get(contributor_id, contributor2subset.get(contributor_id.lower()))
+        same = subset is not None
+        for u in data['Files']:
+            if not same:
+                break
+            w = u['Filename']
+            same = (w in wavfile2label and wavfile2label[w].split(':')[0] == subset and
+                    wavfile2entry[w] == [ u['Prompt']['Prompt Text'], u['Prompt']['Transcript'] ])
+        if same:
+            unchanged[contributor_id] = subset
+        else:
+            changed.append(contributor_id)
+    return unchanged, changed
+
+def update(corpus, prev_files, prev_contributors, listfile=None):
+    '''
+    Update a previous split to include the current corpus.
+    Unchanged contributors (see find_changed_contributors) keep their previous subset,
+    and their files keep their previous shared/unshared label, unless the set of train prompts
+    has changed in a way that changes the label.  Only new and changed contributors are
+    passed to assign_contributors, assign_wavfiles, and determine_sharing.
+
+    @param:
+    corpus (dict): map contributor_id to the dict stored in their json file
+    prev_files (dict): previous split, as returned by determine_sharing
+    prev_contributors (dict): previous split, map subset to a set of contributor_ids
+    listfile (str): XLSX mapping contributors to lists, or None to assign by prompts
+
+    @return:
+    subset2contributors (dict): map subset to contributor_id
+    subset2files (dict): as returned by determine_sharing
+    delta (dict): delta['INSERTED'][label], delta['DELETED'][label] = lists of wavfiles;
+      delta['SUBSTITUTED'][old_label][new_label] = list of wavfiles,
+      where label is 'train' or subset:pset, e.g., 'dev:shared'.
+    '''
+    prev_labels, prev_entries = label_wavfiles(prev_files)
+    unchanged, changed = find_changed_contributors(corpus, prev_contributors, prev_labels, prev_entries)
+    logging.info('%d unchanged contributors, %d new or changed'%(len(unchanged),len(changed)))
+
+    # Assign only the new and changed contributors
+    subcorpus = { c:corpus[c] for c in changed }
+    if listfile==None:
+        prompts = promptfiles.load_prompts('PromptsAnnotationGuidelines')
+        new_contributors = assign_contributors(create_subset2prompts(prompts), subcorpus)
+    else:
+        changed_keys = set(changed) | set(c.lower() for c in changed)
+        new_contributors = { s:set(c for c in L if c in changed_keys)
+                             for s,L in create_subset2contributors(listfile).items() }
+    subset2contributors = { s:set(L) for s,L in new_contributors.items() }
+    for c, subset in unchanged.items():
+        subset2contributors[subset].add(c)
+    subset2wavfiles, wavfile2prompt = assign_wavfiles(new_contributors, subcorpus)
+
+    # Train prompts of the new split = prompts of unchanged and new train contributors
+    prev_trainprompts = set(p[0] for p in prev_files['train'].values())
+    trainprompts = set(wavfile2prompt[w][2] for w in subset2wavfiles['train'])
+    for c, subset in unchanged.items():
+        if subset == 'train':
+            trainprompts.update(u['Prompt']['Prompt Text'] for u in corpus[c]['Files'])
+    flipped = trainprompts.symmetric_difference(prev_trainprompts)
+    subset2files = determine_sharing(subset2wavfiles, wavfile2prompt, trainprompts)
+
+    # Copy the files of unchanged contributors from the previous split.  Only files whose
+    # prompt entered or left the train prompts need their shared/unshared label recomputed.
+    for c, subset in unchanged.items():
+        for u in corpus[c]['Files']:
+            w = u['Filename']
+            if subset == 'train':
+                subset2files['train'][w] = prev_entries[w]
+                continue
+            pset = prev_labels[w].split(':')[1]
+            if prev_entries[w][0] in flipped:
+                shared = (prev_entries[w][0] in trainprompts and
+                          u['Prompt']['Category Description'] != "Spontaneous Speech Prompts")
+                pset = 'shared' if shared else 'unshared'
+            subset2files[subset][pset][w] = prev_entries[w]
+
+    # Compute the delta directly from the labels of the two splits
+    labels, entries = label_wavfiles(subset2files)
+    delta = { 'INSERTED':collections.defaultdict(list), 'DELETED':collections.defaultdict(list),
+              'SUBSTITUTED':collections.defaultdict(lambda: collections.defaultdict(list)) }
+    for w, label in labels.items():
+        if w not in prev_labels:
+            delta['INSERTED'][label].append(w)
+        elif prev_labels[w] != label:
+            delta['SUBSTITUTED'][prev_labels[w]][label].append(w)
+    for w, label in prev_labels.items():
+        if w not in labels:
+            delta['DELETED'][label].append(w)
+    return subset2contributors, subset2files, delta
+
+####################################################################################
+def main(datadir, listfile=None, nworkers=1, cachedir=None):
     '''
     Create and return a new train/dev/test split based on which list each speaker reads,
     and based on shared vs. unshared prompt texts.
 
     @param:
     datadir (str): directory containing data
+    listfile (str): XLSX mapping contributors to lists, or None to assign by prompts
+    nworkers (int): number of processes used to load the corpus
+    cachedir (str): columnar cache of the corpus, or None to parse every JSON file
 
     @return:
     subset2contributors (dict): map subset to contributor_id
     subset2files (dict): as returned by determine_sharing
     '''
-    corpus = load_corpus(datadir)
+    corpus = load_corpus(datadir, nworkers, cachedir=cachedir)
 
     if listfile==None:
         prompts = promptfiles.load_prompts('PromptsAnnotationGuidelines')
@@ -241,7 +401,9 @@ if __name__ == "__main__":
         by downloading relevant information from the contributor app.
 
         (2) The file SpeechAccessibility_2024-04-30_Only_Json.7z should be copied from the distribution,
-        and unpacked in a directory that will be called datadir.
+        and unpacked in a directory that will be called datadir.  Alternatively,
+        box-download/pipeline.py downloads, unpacks and indexes it in one pass; then give
+        this program the same --cachedir, and none of the JSON files are parsed again.
 
         (3) Run this program as:
         python SAPSplit.py datadir ../test_outputs/SpeechAccessibility_$(current)_Split.json -c ../test_outputs/SpeechAccessibility_$(current)_Split_by_Contributors.json -L ../lists/contributor_lists_$(current).xlsx -l logs/SpeechAccessibility_$(current)_Split.log
@@ -254,6 +416,18 @@ if __name__ == "__main__":
     parser.add_argument('-L','--listfile',help='XLS mapping each contributor to one or more lists')
     parser.add_argument('-l','--logfile', default=None,
                         help = 'Where to send debug outputs (instead of stdout)')
+    parser.add_argument('-j','--nworkers', type=int, default=1,
+                        help = 'Number of processes used to load the contributor JSON files')
+    parser.add_argument('--cachedir', default=None,
+                        help = 'Columnar cache of the corpus; only changed JSON files are parsed')
+    parser.add_argument('-p','--prevsplit', default=None,
+                        help='''Split file from the previous month.  If given, together with -P,
+                        only new and changed contributors are assigned, and others keep their subset''')
+    parser.add_argument('-P','--prevcontributorsplit', default=None,
+                        help='''Split listed by contributors, from the previous month''')
+    parser.add_argument('-d','--deltafile', default=None,
+                        help='''With -p and -P: where to write the insertions, deletions and
+                        substitutions relative to the previous split, as test_overlaps.py would''')
 
     args   = parser.parse_args()
     logging.basicConfig(level=logging.DEBUG)
@@ -261,7 +435,18 @@ if __name__ == "__main__":
         logging.basicConfig(filename=args.logfile,filemode='w')
 
         
-    subset2contributors, subset2files = main(args.datadir, args.listfile)
+    if args.prevsplit == None:
+        subset2contributors, subset2files = main(args.datadir, args.listfile, args.nworkers, args.cachedir)
+    else:
+        if args.prevcontributorsplit == None:
+            raise RuntimeError('-p/--prevsplit requires -P/--prevcontributorsplit')
+        prev_files, prev_contributors = load_previous_split(args.prevsplit, args.prevcontributorsplit)
+        corpus = load_corpus(args.datadir, args.nworkers, cachedir=args.cachedir)
+        subset2contributors, subset2files, delta = update(corpus, prev_files, prev_contributors,
+                                                          args.listfile)
+        if args.deltafile != None:
+            test_overlaps.report_delta(delta['INSERTED'], delta['DELETED'], delta['SUBSTITUTED'],
+                                       args.deltafile)
 
     logging.info('%s %d'%('train', len(subset2files['train'])))
     for s in ['dev','test1','test2']:
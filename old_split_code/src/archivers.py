@@ -0,0 +1,142 @@
+import os, tarfile
+"""
+Archive writers used by make_zipfiles.py.
+
+Each writer is opened on a (temporary) path, has contributor directories added
+to it one at a time, and is closed.  Symbolic links are followed, so that a release
+staged with arrange_files.py --mode symlink is archived with the files' contents.  add() returns the state needed to reopen
+a partially written archive after the last contributor that was fully added;
+writers with resumable=False must be restarted from the beginning.
+
+SevenZip_Writer:  7z archives through py7zr (single-threaded, not resumable).
+TarZstd_Writer:   a tar stream compressed by multi-threaded zstd.  Each contributor ends a
+  zstd frame, so a partial archive can be truncated to the end of the last complete frame
+  and appended to.  Concatenated frames decompress as one stream (zstd -d, tar --zstd).
+
+extract(path, outdir) unpacks an archive of either kind, chosen by its extension.
+"""
+
+class SevenZip_Writer:
+    extension = '.7z'
+    resumable = False
+
+    def __init__(self, path, threads=None, level=None, state=None):
+        '''
+        @param:
+        path (str): archive to write
+        threads, level: ignored; py7zr uses its default LZMA2 settings
+        state: must be None; 7z archives cannot be resumed
+        '''
+        import py7zr
+        if state is not None:
+            raise RuntimeError('7z archives cannot be resumed')
+        self.archive = py7zr.SevenZipFile(path, 'w', dereference=True)
+
+    def add(self, idpath, arcname):
+        self.archive.writeall(idpath, arcname)
+        return None
+
+    def close(self):
+        self.archive.close()
+
+class _Counting_Stream:
+    '''
+    Write-only file object that counts the bytes written, so that tarfile can call tell().
+    '''
+    def __init__(self, fileobj, offset=0):
+        self.fileobj = fileobj
+        self.offset = offset
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+class TarZstd_Writer:
+    extension = '.tar.zst'
+    resumable = True
+
+    def __init__(self, path, threads=-1, level=3, state=None):
+        '''
+        @param:
+        path (str): archive to write
+        threads (int): number of zstd compression threads; -1 = one per CPU
+        level (int): zstd compression level
+        state (dict): if not None, returned by add(); the archive at path is truncated to
+          the end of that contributor and appended to
+        '''
+        import zstandard
+        self.zstandard = zstandard
+        if state is None:
+            self.file = open(path, 'wb')
+            tar_offset = 0
+        else:
+            self.file = open(path, 'r+b')
+            self.file.truncate(state['offset'])
+            self.file.seek(state['offset'])
+            tar_offset = state['tar_offset']
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level,
+                                             threads=-1 if threads is None else threads)
+        self.writer = compressor.stream_writer(self.file, closefd=False)
+        self.stream = _Counting_Stream(self.writer, tar_offset)
+        self.tar = tarfile.TarFile(fileobj=self.stream, mode='w', format=tarfile.PAX_FORMAT, dereference=True)
+
+    def add(self, idpath, arcname):
+        self.tar.add(idpath, arcname)
+        self.writer.flush(self.zstandard.FLUSH_FRAME)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return { 'offset':self.file.tell(), 'tar_offset':self.stream.offset }
+
+    def close(self):
+        self.tar.close()
+        self.writer.flush(self.zstandard.FLUSH_FRAME)
+        self.writer.close()
+        self.file.close()
+
+BACKENDS = { '7z':SevenZip_Writer, 'tar.zst':TarZstd_Writer }
+
+def extract_7z(path, outdir):
+    import py7zr
+    with py7zr.SevenZipFile(path, 'r') as archive:
+        names = [ x.filename for x in archive.list() if not x.is_directory ]
+        archive.extractall(outdir)
+    return names
+
+def extract_tar_zst(path, outdir):
+    '''
+    Members are extracted one at a time as the stream is decompressed, without seeking,
+    so the archive is read only once.
+    '''
+    import zstandard
+    names = []
+    with open(path, 'rb') as f:
+        reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        with tarfile.open(fileobj=reader, mode='r|') as tar:
+            for member in tar:
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extract(member, outdir, filter='data')
+                else:
+                    tar.extract(member, outdir)
+                if member.isfile():
+                    names.append(member.name)
+    return names
+
+EXTRACTORS = { '.7z':extract_7z, '.tar.zst':extract_tar_zst }
+
+def extract(path, outdir):
+    '''
+    @param:
+    path (str): a .7z or .tar.zst archive
+    outdir (str): directory into which to unpack it
+
+    @return:
+    names (list): the files in the archive, relative to outdir
+    '''
+    for extension, extractor in EXTRACTORS.items():
+        if path.endswith(extension):
+            return extractor(path, outdir)
+    raise ValueError('%s is not a %s archive'%(path, ' or '.join(EXTRACTORS)))
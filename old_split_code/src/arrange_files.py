@@ -1,21 +1,167 @@
-import json,os,argparse,glob,shutil
+import json,os,argparse,glob,shutil,errno,hashlib,threading
+from concurrent.futures import ThreadPoolExecutor
 
-def copy_contributors(contributors, src, tgt, transcriptfile):
+FICLONE = 0x40049409   # Linux ioctl that makes dst share src's blocks (btrfs, xfs, ...)
+
+def reflink(src, dst):
+    '''
+    Copy src to dst as a reflink (copy-on-write clone), if the filesystem supports it;
+    otherwise make an ordinary copy.
+    '''
+    try:
+        import fcntl
+        with open(src,'rb') as s, open(dst,'wb') as t:
+            fcntl.ioctl(t.fileno(), FICLONE, s.fileno())
+        shutil.copystat(src, dst)
+    except (ImportError, OSError) as e:
+        if isinstance(e, OSError) and e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                                                      errno.EINVAL, errno.ENOSYS):
+            raise
+        shutil.copy2(src, dst)
+
+def symlink(src, dst):
+    os.symlink(os.path.abspath(src), dst)
+
+def sha1(path, blocksize=2**20):
+    h = hashlib.sha1()
+    with open(path,'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def copy_sha1(src, dst, blocksize=2**20):
+    '''
+    Copy src to dst, with its permissions and times (like shutil.copy2),
+    computing the sha1 of the data as it is copied, so that src is read only once.
+
+    @return:
+    digest (str): sha1 of the data written to dst
+    '''
+    h = hashlib.sha1()
+    with open(src,'rb') as s, open(dst,'wb') as t:
+        for block in iter(lambda: s.read(blocksize), b''):
+            h.update(block)
+            t.write(block)
+    shutil.copystat(src, dst)
+    return h.hexdigest()
+
+# copy_function for each --mode; each returns the sha1 of the data it copied, or None if it did not read the data
+COPY_FUNCTIONS = {
+    'copy': copy_sha1,
+    'hardlink': os.link,
+    'symlink': symlink,
+    'reflink': reflink
+}
+
+def read_transfer_manifest(manifestfile):
+    '''
+    @return:
+    transferred (dict): transferred[contributor] = { relpath:[size, sha1 or None] } for each
+      contributor whose copy finished; a line cut short by a crash is ignored
+    '''
+    transferred = {}
+    if os.path.exists(manifestfile):
+        with open(manifestfile) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                transferred[entry['contributor']] = entry['files']
+    return transferred
+
+def copy_contributor(s, t, copy_function, previous=None, verify='size'):
+    '''
+    Copy the files of directory s to t, skipping files that are already there.
+    Files are hashed only while they are copied (by copy_sha1), or to verify a file that is kept.
+
+    @param:
+    copy_function (function): a value of COPY_FUNCTIONS
+    previous (dict): previous[relpath] = [size, sha1 or None], as recorded by an earlier copy
+    verify (str): a file already in t is kept if its size matches the source ('size'),
+      or if its size and sha1 match ('hash')
+
+    @return:
+    files (dict): files[relpath] = [size, sha1 or None] for every file copied or kept
+    ncopied (int): number of files copied
+    '''
+    previous = previous or {}
+    files, ncopied = {}, 0
+    for dirpath, dirnames, filenames in os.walk(s):
+        rel = os.path.relpath(dirpath, s)
+        os.makedirs(os.path.normpath(os.path.join(t,rel)), exist_ok=True)
+        for filename in sorted(filenames):
+            relpath = os.path.normpath(os.path.join(rel,filename))
+            src, dst = os.path.join(s,relpath), os.path.join(t,relpath)
+            size = os.stat(src).st_size
+            digest = previous[relpath][1] if relpath in previous and previous[relpath][0] == size else None
+            keep = os.path.exists(dst) and os.stat(dst).st_size == size
+            if keep and verify == 'hash':
+                digest = digest or sha1(src)
+                keep = sha1(dst) == digest
+            if not keep:
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                digest = copy_function(src, dst)
+                ncopied += 1
+            files[relpath] = [size, digest]
+    return files, ncopied
+
+def copy_contributors(contributors, src, tgt, transcriptfile, mode='copy', nworkers=8, verify='size'):
     '''
     Copy contributors from src to tgt
+
+    A transfer manifest, tgt/transfer_manifest.jsonl, gets one line per contributor
+    whose copy finished, listing the size and sha1 of each file (sha1 only in copy mode;
+    links share the source's data).  On a rerun, finished contributors are verified against
+    the source, and contributors whose copy did not finish are resumed file by file.
+
+    @param:
+    mode (str): 'copy', 'hardlink', 'symlink' (to the absolute path of each source file), or
+      'reflink' (copy-on-write clone, falling back to copy if the filesystem has no reflinks).
+      Directories are always created; only files are linked.
+    nworkers (int): number of contributors copied or verified concurrently
+    verify (str): 'size' or 'hash'; see copy_contributor
     '''
     os.makedirs(tgt,exist_ok=True)
+    manifestfile = os.path.join(tgt, 'transfer_manifest.jsonl')
+    transferred = read_transfer_manifest(manifestfile)
+    if os.path.exists(manifestfile) and os.path.getsize(manifestfile) > 0:
+        with open(manifestfile,'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':   # end a line cut short by a crash
+                f.write(b'\n')
+    lock = threading.Lock()
+    copy_function = COPY_FUNCTIONS[mode]
+
+    def transfer(contributor, s, t):
+        files, ncopied = copy_contributor(s, t, copy_function, transferred.get(contributor), verify)
+        with lock:
+            if contributor not in transferred or ncopied > 0 or files != transferred[contributor]:
+                with open(manifestfile,'a') as f:
+                    f.write(json.dumps({ 'contributor':contributor, 'files':files }, sort_keys=True)+'\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+            if ncopied == 0 and len(files) > 0:
+                print(t+' already exists; not copying')
+            elif contributor in transferred:
+                print(t+' failed verification; copied %d files'%(ncopied))
+            elif ncopied < len(files):
+                print(t+' was incomplete; copied the remaining %d files'%(ncopied))
+
     # Copy the contributor directories to tgt
-    for contributor in contributors:
-        s = os.path.join(src,contributor)
-        t = os.path.join(tgt,contributor)
-        if os.path.exists(t):
-            print(t+' already exists; not copying')
-        elif not os.path.exists(s):
-            print(s+' does not exist; not copying')
-        else:
-            shutil.copytree(s,t)
-            
+    with ThreadPoolExecutor(max_workers=max(1,nworkers)) as pool:
+        futures = []
+        for contributor in contributors:
+            s = os.path.join(src,contributor)
+            t = os.path.join(tgt,contributor)
+            if not os.path.exists(s):
+                print(s+' does not exist; not copying')
+            else:
+                futures.append(pool.submit(transfer, contributor, s, t))
+        for future in futures:
+            future.result()
+
     # Create a new transcript listing JSON in tgt
     with open(os.path.join(tgt, transcriptfile),'w') as f:
         json.dump(contributors,f,indent=1,sort_keys=True)
@@ -34,6 +180,12 @@ if __name__ == "__main__":
     parser.add_argument('datadir',help = 'Directory containing unsplit dataset and JSON file')
     parser.add_argument('traindevdir',help = 'Directory into which to write train and dev splits')
     parser.add_argument('testdir',help = 'Directory into which to write test split')
+    parser.add_argument('-m','--mode',default='copy',choices=sorted(COPY_FUNCTIONS.keys()),
+                        help = 'How to place each file in the new directories; hardlink, symlink and reflink take no space')
+    parser.add_argument('-j','--nworkers',type=int,default=8,
+                        help = 'Number of contributors copied concurrently')
+    parser.add_argument('--verify',default='size',choices=['size','hash'],
+                        help = 'How files left by an earlier run are checked before they are kept')
 
     args   = parser.parse_args()
 
@@ -54,8 +206,10 @@ if __name__ == "__main__":
 
     for split in ['train','dev']:
         tgt = os.path.join(args.traindevdir,split)
-        copy_contributors(split2contributors[split], args.datadir, tgt, splitfilename+'_'+split+'.json')
+        copy_contributors(split2contributors[split], args.datadir, tgt, splitfilename+'_'+split+'.json',
+                          args.mode, args.nworkers, args.verify)
         
     if 'testdir' in args:
         tgt = os.path.join(args.testdir,'test')
-        copy_contributors(split2contributors['test'], args.datadir, tgt, splitfilename+'_test.json')
+        copy_contributors(split2contributors['test'], args.datadir, tgt, splitfilename+'_test.json',
+                          args.mode, args.nworkers, args.verify)
@@ -0,0 +1,80 @@
+import os, argparse, time, tempfile, shutil, struct, math
+import numpy as np
+import archivers
+
+def write_wav(path, num_samples, rng, sample_rate=16000):
+    '''
+    Write a 16-bit mono WAV file of a few random tones plus noise, which compresses
+    roughly like speech.
+    '''
+    t = np.arange(num_samples)/sample_rate
+    x = sum(rng.uniform(0.05,0.2)*np.sin(2*math.pi*rng.uniform(100,1000)*t) for i in range(3))
+    x = x + rng.normal(0, 0.01, num_samples)
+    data = (np.clip(x,-1,1)*32767).astype('<i2').tobytes()
+    with open(path, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<I', 36+len(data)) + b'WAVE')
+        f.write(b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 1, sample_rate, 2*sample_rate, 2, 16))
+        f.write(b'data' + struct.pack('<I', len(data)) + data)
+
+def synthetic_corpus(datadir, ncontributors, nfiles, seconds, seed=0):
+    '''
+    @return:
+    idpaths (list): contributor directories datadir/Train/C*/, each containing nfiles WAV files
+    '''
+    rng = np.random.default_rng(seed)
+    idpaths = []
+    for n in range(ncontributors):
+        idpath = os.path.join(datadir, 'Train', 'C%04d'%(n))
+        os.makedirs(idpath, exist_ok=True)
+        for i in range(nfiles):
+            write_wav(os.path.join(idpath, 'c%04d_%d.wav'%(n,i)), int(seconds*16000*rng.uniform(0.5,1.5)), rng)
+        idpaths.append(idpath)
+    return idpaths
+
+def benchmark(datadir, idpaths, backend, threads=None, level=None):
+    '''
+    @return:
+    insize (int): total size of the input files, in bytes
+    seconds (float): time to write the archive
+    ratio (float): archive size / input size
+    '''
+    insize = sum(os.path.getsize(os.path.join(p,f)) for p in idpaths for f in os.listdir(p))
+    writer_class = archivers.BACKENDS[backend]
+    path = os.path.join(datadir, 'benchmark'+writer_class.extension)
+    start = time.time()
+    writer = writer_class(path, threads, level)
+    for idpath in idpaths:
+        writer.add(idpath, os.path.relpath(idpath, datadir))
+    writer.close()
+    elapsed = time.time() - start
+    ratio = os.path.getsize(path)/insize
+    os.remove(path)
+    return insize, elapsed, ratio
+
+################################################################################################
+# Command line arguments
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description     = 'Compare the throughput and compression ratio of the archive backends on a synthetic corpus',
+        formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-n','--ncontributors',type=int,default=20,help = 'Number of synthetic contributors')
+    parser.add_argument('-f','--nfiles',type=int,default=20,help = 'WAV files per contributor')
+    parser.add_argument('-s','--seconds',type=float,default=4.0,help = 'Mean duration of each WAV file')
+    parser.add_argument('-b','--backends',nargs='*',default=sorted(archivers.BACKENDS.keys()),
+                        help = 'Backends to compare')
+    parser.add_argument('--compress_threads',type=int,nargs='*',default=[1,-1],
+                        help = 'Compression thread counts to try, for backends that use threads')
+
+    args   = parser.parse_args()
+    datadir = tempfile.mkdtemp()
+    try:
+        idpaths = synthetic_corpus(datadir, args.ncontributors, args.nfiles, args.seconds)
+        print('%-10s %8s %10s %10s %8s'%('backend','threads','MB','MB/s','ratio'))
+        for backend in args.backends:
+            for threads in (args.compress_threads if backend == 'tar.zst' else [None]):
+                insize, elapsed, ratio = benchmark(datadir, idpaths, backend, threads)
+                print('%-10s %8s %10.1f %10.1f %8.3f'%(backend, threads, insize/2**20, insize/2**20/elapsed, ratio))
+    finally:
+        shutil.rmtree(datadir)
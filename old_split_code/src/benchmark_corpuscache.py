@@ -0,0 +1,81 @@
+import os, argparse, time, tempfile, shutil, json, io, contextlib
+import numpy as np
+import corpusloader, corpuscache
+
+def synthetic_jsonfiles(datadir, ncontributors, nfiles, seed=0):
+    '''
+    @return:
+    jsonfiles (list): contributor JSON files datadir/C*/C*.json, each with nfiles utterances of 3 ratings
+    '''
+    rng = np.random.default_rng(seed)
+    jsonfiles = []
+    for n in range(ncontributors):
+        contributor_id = 'C%04d'%(n)
+        os.makedirs(os.path.join(datadir, contributor_id), exist_ok=True)
+        files = []
+        for i in range(nfiles):
+            words = ' '.join('word%d'%(x) for x in rng.integers(0, 5000, rng.integers(3, 15)))
+            files.append({ 'Filename':'%s_%d.wav'%(contributor_id.lower(), i),
+                           'Prompt':{ 'Prompt Text':words, 'Transcript':words.capitalize()+'.',
+                                      'Category Description':'Novel Sentences', 'Sub Category Description':'' },
+                           'Ratings':[ { 'Level':str(rng.integers(1,8)), 'Dimension Description':d }
+                                       for d in ['Intelligibility','Naturalness','Harsh voice'] ] })
+        jsonfile = os.path.join(datadir, contributor_id, contributor_id+'.json')
+        with open(jsonfile, 'w') as f:
+            json.dump({ 'Contributor ID':contributor_id, 'Etiology':['ALS','Parkinson\'s Disease'][n % 2],
+                        'Files':files }, f, indent=2)
+        jsonfiles.append(jsonfile)
+    return jsonfiles
+
+def timed(function, *args, **kwargs):
+    '''
+    @return:
+    seconds (float): time taken by function(*args, **kwargs), with its printed output discarded
+    '''
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function(*args, **kwargs)
+    return time.time() - start
+
+def benchmark(cachedir, jsonfiles, nworkers=1, fields=['filename','transcript','json_etiology']):
+    '''
+    @return:
+    seconds (dict): seconds[method] = time taken to load the corpus by each method
+    '''
+    if os.path.exists(cachedir):
+        shutil.rmtree(cachedir)
+    seconds = {}
+    seconds['json.load'] = timed(corpusloader.load_jsonfiles, jsonfiles, nworkers)
+    seconds['cold cache'] = timed(corpuscache.update_cache, cachedir, jsonfiles, nworkers)
+    seconds['warm cache'] = timed(corpuscache.update_cache, cachedir, jsonfiles, nworkers)
+    seconds['warm cache, %d fields'%(len(fields))] = timed(corpuscache.update_cache, cachedir, jsonfiles, nworkers,
+                                                           fields=fields)
+    seconds['warm cache + columns_to_corpus'] = timed(
+        lambda: corpuscache.columns_to_corpus(corpuscache.update_cache(cachedir, jsonfiles, nworkers)))
+    return seconds
+
+################################################################################################
+# Command line arguments
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description     = 'Compare loading a synthetic distribution from its JSON files and from the corpus cache',
+        formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-n','--ncontributors',type=int,default=300,help = 'Number of synthetic contributors')
+    parser.add_argument('-f','--nfiles',type=int,default=400,help = 'Utterances per contributor')
+    parser.add_argument('-j','--nworkers',type=int,default=1,help = 'Number of processes parsing JSON files')
+    parser.add_argument('-r','--repeats',type=int,default=3,help = 'Runs of each method; the fastest is reported')
+
+    args   = parser.parse_args()
+    datadir = tempfile.mkdtemp()
+    try:
+        jsonfiles = synthetic_jsonfiles(os.path.join(datadir, 'json'), args.ncontributors, args.nfiles)
+        runs = [ benchmark(os.path.join(datadir, 'cache'), jsonfiles, args.nworkers) for r in range(args.repeats) ]
+        baseline = min(r['json.load'] for r in runs)
+        print('%-36s %8s %8s'%('method','seconds','speedup'))
+        for method in runs[0]:
+            seconds = min(r[method] for r in runs)
+            print('%-36s %8.3f %8.2f'%(method, seconds, baseline/seconds))
+    finally:
+        shutil.rmtree(datadir)
@@ -0,0 +1,430 @@
+import argparse, json, os, os.path, shutil, time
+import numpy as np
+import corpusloader
+
+'''
+Persistent columnar cache of the contributor JSON files in a distribution.
+
+Each contributor JSON file is converted to one row per utterance, with columns
+  filename, category, subcategory, prompt, transcript, missing, utt_json
+its ratings are converted to one row per rating, with columns
+  rating_utterance (index of the utterance row), rating_dimension, rating_level
+and the file itself to one row, with columns
+  json_path, json_contributor, json_etiology, json_missing, json_mtime, json_size,
+  json_utterances, json_ratings
+so that a contributor with no utterances is not lost.  The missing columns record which
+fields were absent from the JSON file, or null, so that columns_to_corpus returns exactly
+the fields that SAPsplit.py and split_sapc2_data.py read from the JSON files.
+
+The rows of all JSON files are kept together in one store, cachedir/store<n>/, with one .npy
+file per column, which is opened with np.load(mmap_mode='r'); a string column is stored as its
+UTF-8 text and the character offset of each entry, and is decoded with one bytes.decode.
+The utterances and ratings of each JSON file are contiguous, in the order of the json rows.
+cachedir/index.json names the current store.  When the cache is updated, only JSON files whose
+mtime or size has changed, or that are not in the store, are parsed; the rows of the other files
+are copied from the old store into a new one, and index.json is then switched to the new store.
+
+Usage:
+  columns = update_cache(cachedir, jsonfiles, nworkers)
+  corpus = columns_to_corpus(columns)   # same format as SAPsplit.load_corpus
+Callers that only need some fields should use the columns directly, which is much faster.
+'''
+
+COLUMNS = ['contributor','filename','category','subcategory','prompt','transcript','etiology']
+RATING_COLUMNS = ['rating_utterance','rating_dimension','rating_level']
+JSON_COLUMNS = ['json_path','json_contributor','json_etiology','json_missing','json_mtime','json_size',
+                'json_utterances','json_ratings']
+UTTERANCE_COLUMNS = ['filename','category','subcategory','prompt','transcript','missing','utt_json']
+STORE_COLUMNS = UTTERANCE_COLUMNS + RATING_COLUMNS + JSON_COLUMNS
+INTEGER_COLUMNS = ['missing','utt_json','rating_utterance','json_missing','json_mtime','json_size',
+                   'json_utterances','json_ratings']
+INDEXFILE = 'index.json'
+VERSION = 3   # caches written by an older version of this module are rebuilt
+
+# Bit 2*n of a missing column is set if the n'th field is absent, bit 2*n+1 if it is null
+PROMPT_FIELDS = [ ('category','Category Description'), ('subcategory','Sub Category Description'),
+                  ('prompt','Prompt Text'), ('transcript','Transcript') ]
+JSON_FIELDS = [ ('json_contributor','Contributor ID'), ('json_etiology','Etiology') ]
+NO_PROMPT = 1 << 2*len(PROMPT_FIELDS)   # the utterance has no Prompt at all
+
+def _str(x):
+    return '' if x is None else str(x)
+
+def _get(d, key, n):
+    '''
+    @return:
+    value (str): d[key] as a str, or '' if it is absent or null
+    missing (int): missing bits of the n'th field
+    '''
+    if key not in d:
+        return '', 1 << 2*n
+    if d[key] is None:
+        return '', 1 << 2*n+1
+    return str(d[key]), 0
+
+def _put(d, key, value, missing, n):
+    '''
+    Inverse of _get: set d[key] unless the n'th field was absent.
+    '''
+    if not missing & (1 << 2*n):
+        d[key] = None if missing & (1 << 2*n+1) else value
+
+def absent(missing, field, null=True):
+    '''
+    @param:
+    missing (array): the missing column (for a field of PROMPT_FIELDS) or json_missing column (JSON_FIELDS)
+    field (str): name of the field in the JSON file, e.g., 'Transcript' or 'Etiology'
+    null (bool): count a null field as absent
+
+    @return:
+    absent (np.ndarray of bool): True where the field was absent (or null)
+    '''
+    names = [ key for c, key in PROMPT_FIELDS ]
+    if field not in names:
+        names = [ key for c, key in JSON_FIELDS ]
+    return (np.asarray(missing) & ((3 if null else 1) << 2*names.index(field))) != 0
+
+def contributor_columns(data):
+    '''
+    Convert the content of one contributor JSON file to columns.
+    This is applied inside the corpusloader worker processes.
+
+    @param:
+    data (dict): content of one contributor JSON file
+
+    @return:
+    columns (dict): columns[c] is a list with one entry per utterance, for c in UTTERANCE_COLUMNS[:-1],
+      one entry per rating, for c in RATING_COLUMNS, or one entry, for json_contributor, json_etiology
+      and json_missing
+    '''
+    columns = { c:[] for c in UTTERANCE_COLUMNS[:-1]+RATING_COLUMNS+['json_contributor','json_etiology','json_missing'] }
+    json_missing = 0
+    for n, (c, key) in enumerate(JSON_FIELDS):
+        value, missing = _get(data, key, n)
+        columns[c].append(value)
+        json_missing |= missing
+    columns['json_missing'].append(json_missing)
+    for n, u in enumerate(data['Files']):
+        columns['filename'].append(_str(u['Filename']))
+        missing = 0 if 'Prompt' in u else NO_PROMPT
+        for k, (c, key) in enumerate(PROMPT_FIELDS):
+            value, m = _get(u.get('Prompt', {}), key, k)
+            columns[c].append(value)
+            missing |= m
+        columns['missing'].append(missing)
+        for rating in u.get('Ratings', []):
+            columns['rating_utterance'].append(n)
+            columns['rating_dimension'].append(_str(rating['Dimension Description']))
+            columns['rating_level'].append(_str(rating['Level']))
+    return columns
+
+def _stat(jsonfile):
+    st = os.stat(jsonfile)
+    return [ st.st_mtime_ns, st.st_size ]
+
+def _save_strings(pathname, strings):
+    strings = list(strings)
+    offsets = np.zeros(len(strings)+1, dtype=np.int64)
+    np.cumsum([ len(x) for x in strings ], out=offsets[1:])
+    np.save(pathname+'.offsets.npy', offsets)
+    np.save(pathname+'.text.npy', np.frombuffer(''.join(strings).encode('utf8'), dtype=np.uint8))
+
+def _load_strings(pathname):
+    '''
+    @return:
+    strings (np.ndarray of object): the strings saved by _save_strings
+    '''
+    offsets = np.load(pathname+'.offsets.npy', mmap_mode='r').tolist()
+    text = bytes(np.load(pathname+'.text.npy', mmap_mode='r')).decode('utf8')
+    strings = np.empty(len(offsets)-1, dtype=object)
+    strings[:] = [ text[a:b] for a, b in zip(offsets[:-1], offsets[1:]) ]
+    return strings
+
+def read_index(cachedir, fields=None):
+    '''
+    Open the current store of the cache.
+
+    @param:
+    fields (list): string columns to decode; None for all.  Integer columns are always memory-mapped.
+
+    @return:
+    index (dict): index['store'] = name of the store directory, or None if the cache is empty;
+      index['columns'][c] = array of each column c in STORE_COLUMNS;
+      index['row'][jsonfile] = json row of each JSON file in the store
+    '''
+    pathname = os.path.join(cachedir, INDEXFILE)
+    state = {}
+    if os.path.exists(pathname):
+        with open(pathname) as f:
+            state = json.load(f)
+    if state.get('version') != VERSION or state.get('store') is None:
+        return { 'store':None, 'columns':_empty_columns(), 'row':{} }
+    storedir = os.path.join(cachedir, state['store'])
+    columns = {}
+    for c in STORE_COLUMNS:
+        if c in INTEGER_COLUMNS:
+            columns[c] = np.load(os.path.join(storedir, c+'.npy'), mmap_mode='r')
+        elif fields is None or c in fields or c == 'json_path':
+            columns[c] = _load_strings(os.path.join(storedir, c))
+    return { 'store':state['store'], 'columns':columns,
+             'row':{ x:n for n, x in enumerate(columns['json_path'].tolist()) } }
+
+def _empty_columns():
+    return { c:np.zeros(0, dtype=np.int64 if c in INTEGER_COLUMNS else object) for c in STORE_COLUMNS }
+
+def _starts(counts):
+    return np.cumsum(counts) - counts
+
+def _gather(starts, counts):
+    '''
+    @return:
+    rows (np.ndarray of int64): concatenation of arange(starts[i], starts[i]+counts[i])
+    '''
+    counts = np.asarray(counts, dtype=np.int64)
+    return np.repeat(np.asarray(starts, dtype=np.int64) - _starts(counts), counts) + np.arange(int(counts.sum()))
+
+def select_rows(columns, rows):
+    '''
+    @param:
+    columns (dict): store columns, e.g., index['columns']
+    rows (array of int): json rows to keep, in the order in which they are wanted
+
+    @return:
+    selected (dict): the same columns, for those JSON files only, with utt_json and rating_utterance renumbered
+    '''
+    rows = np.asarray(rows, dtype=np.int64)
+    nutts, nratings = np.asarray(columns['json_utterances']), np.asarray(columns['json_ratings'])
+    uidx = _gather(_starts(nutts)[rows], nutts[rows])
+    ridx = _gather(_starts(nratings)[rows], nratings[rows])
+    selected = {}
+    for c in columns:
+        if c.startswith('json_'):
+            selected[c] = np.asarray(columns[c])[rows]
+        elif c.startswith('rating_'):
+            selected[c] = np.asarray(columns[c])[ridx]
+        else:
+            selected[c] = np.asarray(columns[c])[uidx]
+    selected['utt_json'] = np.repeat(np.arange(len(rows), dtype=np.int64), nutts[rows])
+    # each rating moves with its utterance: shift it by the change of its file's first utterance row
+    shift = _starts(nutts[rows]) - _starts(nutts)[rows]
+    selected['rating_utterance'] = selected['rating_utterance'] + np.repeat(shift, nratings[rows])
+    return selected
+
+def _parsed_columns(jsonfiles, stats, results):
+    '''
+    Store columns of newly parsed JSON files.
+    '''
+    columns = {}
+    for c in UTTERANCE_COLUMNS[:-1]+RATING_COLUMNS[1:]+['json_contributor','json_etiology','json_missing']:
+        columns[c] = [ x for r in results for x in r[c] ]
+    nutts = np.array([ len(r['filename']) for r in results ], dtype=np.int64)
+    nratings = np.array([ len(r['rating_utterance']) for r in results ], dtype=np.int64)
+    columns['utt_json'] = np.repeat(np.arange(len(results), dtype=np.int64), nutts)
+    columns['rating_utterance'] = (np.array([ x for r in results for x in r['rating_utterance'] ], dtype=np.int64)
+                                   + np.repeat(_starts(nutts), nratings))
+    columns['json_path'] = list(jsonfiles)
+    columns['json_mtime'] = [ stats[x][0] for x in jsonfiles ]
+    columns['json_size'] = [ stats[x][1] for x in jsonfiles ]
+    columns['json_utterances'], columns['json_ratings'] = nutts, nratings
+    return columns
+
+def _write_store(cachedir, index, parts):
+    '''
+    Write the concatenation of parts (dicts of store columns) as a new store, switch
+    index.json to it, delete the old store, and update index in place.
+    '''
+    number = 0 if index['store'] is None else int(index['store'][len('store'):]) + 1
+    store = 'store%d'%(number)
+    storedir = os.path.join(cachedir, store)
+    for d in [ storedir, storedir+'.tmp' ]:
+        if os.path.exists(d):
+            shutil.rmtree(d)
+    os.makedirs(storedir+'.tmp')
+    nutts, njson = 0, 0
+    for c in STORE_COLUMNS:
+        if c in ['utt_json','rating_utterance']:
+            # renumber each part after the rows of the parts before it
+            offsets = np.cumsum([0]+[ len(p['json_path'] if c=='utt_json' else p['filename']) for p in parts ])
+            column = np.concatenate([ np.asarray(p[c], dtype=np.int64) + offsets[n] for n, p in enumerate(parts) ])
+        elif c in INTEGER_COLUMNS:
+            column = np.concatenate([ np.asarray(p[c], dtype=np.int64) for p in parts ])
+        else:
+            _save_strings(os.path.join(storedir+'.tmp', c), [ x for p in parts for x in p[c] ])
+            continue
+        np.save(os.path.join(storedir+'.tmp', c+'.npy'), column)
+    os.replace(storedir+'.tmp', storedir)
+    pathname = os.path.join(cachedir, INDEXFILE)
+    with open(pathname+'.tmp','w') as f:
+        json.dump({ 'version':VERSION, 'store':store }, f)
+    os.replace(pathname+'.tmp', pathname)
+    # remove the old store, and shards of older versions of this module
+    for name in os.listdir(cachedir):
+        if (name.startswith('store') and name != store) or name.endswith('.npz'):
+            if os.path.isdir(os.path.join(cachedir, name)):
+                shutil.rmtree(os.path.join(cachedir, name))
+            else:
+                os.remove(os.path.join(cachedir, name))
+    index.clear()
+    index.update(read_index(cachedir))
+
+def index_jsonfiles(cachedir, jsonfiles, index, nworkers=1, chunksize=64):
+    '''
+    Parse the JSON files that are not in the store, or whose rows are out of date,
+    and write a new store containing them and all of the other files already in the store.
+    This can be called repeatedly, on batches of JSON files, as they become available.
+
+    @param:
+    cachedir (str): directory containing the cache; created if it does not exist
+    jsonfiles (list): absolute contributor JSON pathnames
+    index (dict): as returned by read_index(cachedir); updated in place
+    nworkers (int): number of processes used to parse changed JSON files
+    chunksize (int): number of JSON files parsed by each process in each task
+
+    @return:
+    stats (dict): stats[jsonfile] = [ mtime, size ] of each of jsonfiles
+    nparsed (int): number of JSON files that were parsed
+    '''
+    os.makedirs(cachedir, exist_ok=True)
+    columns = index['columns']
+    stale, stats = [], {}
+    for jsonfile in jsonfiles:
+        stats[jsonfile] = _stat(jsonfile)
+        row = index['row'].get(jsonfile)
+        if row is None or [ int(columns['json_mtime'][row]), int(columns['json_size'][row]) ] != stats[jsonfile]:
+            stale.append(jsonfile)
+    if len(stale) > 0:
+        results = corpusloader.load_jsonfiles(stale, nworkers, chunksize, extract=contributor_columns)
+        stale_set = set(stale)
+        if any(c not in columns for c in STORE_COLUMNS):   # index was read with only some fields
+            columns = read_index(cachedir)['columns']
+        keep = [ n for n, x in enumerate(columns['json_path']) if x not in stale_set ]
+        _write_store(cachedir, index, [ select_rows(columns, keep), _parsed_columns(stale, stats, results) ])
+    return stats, len(stale)
+
+def update_cache(cachedir, jsonfiles, nworkers=1, chunksize=64, fields=None):
+    '''
+    Bring the cache up to date for the given JSON files, then load their columns.
+
+    @param:
+    cachedir (str): directory containing the cache; created if it does not exist
+    jsonfiles (list): contributor JSON pathnames
+    nworkers (int): number of processes used to parse changed JSON files
+    chunksize (int): number of JSON files parsed by each process in each task
+    fields (list): string columns to load (see load_columns); None for all
+
+    @return:
+    columns (dict): as returned by load_columns
+    '''
+    jsonfiles = [ os.path.abspath(x) for x in jsonfiles ]
+    index = read_index(cachedir, fields)
+    stats, nparsed = index_jsonfiles(cachedir, jsonfiles, index, nworkers, chunksize)
+    print('Cache %s: parsed %d of %d JSON files'%(cachedir, nparsed, len(jsonfiles)))
+
+    # Forget JSON files that have been deleted from the distribution
+    deleted = set(x for x in index['row'] if x not in stats and not os.path.exists(x))
+    if len(deleted) > 0:
+        keep = [ n for n, x in enumerate(index['columns']['json_path']) if x not in deleted ]
+        columns = index['columns'] if all(c in index['columns'] for c in STORE_COLUMNS) else read_index(cachedir)['columns']
+        _write_store(cachedir, index, [ select_rows(columns, keep) ])
+
+    if (nparsed > 0 or len(deleted) > 0) and fields is not None:
+        index = read_index(cachedir, fields)
+    return load_columns(cachedir, jsonfiles, index)
+
+def load_columns(cachedir, jsonfiles=None, index=None, fields=None):
+    '''
+    Columns of a list of JSON files.
+
+    @param:
+    cachedir (str): directory containing the cache
+    jsonfiles (list): JSON pathnames to load, or None to load everything in the cache
+    index (dict): as returned by read_index, or None to read it from cachedir
+    fields (list): string columns to load, if index is None; None for all.  The
+      contributor and etiology columns need json_contributor and json_etiology.
+
+    @return:
+    columns (dict): columns[c] is an array with one entry per utterance for c in COLUMNS+['missing','utt_json'],
+      and for c=='jsonfile', which is the JSON file that each utterance came from;
+      columns['utt_json'] is an index into the json rows.
+      columns[c] has one entry per rating for c in RATING_COLUMNS;
+      columns['rating_utterance'] is an index into the utterance rows.
+      columns[c] has one entry per JSON file, in the order of jsonfiles, for c in JSON_COLUMNS.
+      String columns are object arrays of str; integer columns may be read-only memory maps.
+    '''
+    if index is None:
+        index = read_index(cachedir, fields)
+    columns = index['columns']
+    if jsonfiles is not None:
+        rows = [ index['row'][os.path.abspath(x)] for x in jsonfiles ]
+        if rows != list(range(len(columns['json_path']))):
+            columns = select_rows(columns, rows)
+    columns = dict(columns)
+    for c, json_c in [ ('contributor','json_contributor'), ('etiology','json_etiology'), ('jsonfile','json_path') ]:
+        if json_c in columns:
+            columns[c] = columns[json_c][columns['utt_json']]
+    return columns
+
+def columns_to_corpus(columns, key='contributor'):
+    '''
+    Convert columns back into nested dicts in the format of the contributor JSON files.
+    Every JSON file has an entry, even if it has no utterances.
+
+    @param:
+    columns (dict): as returned by load_columns, with every field
+    key (str): 'contributor' to key the result by Contributor ID, 'jsonfile' to key by JSON pathname
+
+    @return:
+    corpus (dict): corpus[key] = { 'Contributor ID', 'Etiology', 'Files' }, where
+      'Contributor ID', 'Etiology' and the fields of each 'Prompt' are present only if they were in the JSON file
+    '''
+    contributors = []
+    for contributor, etiology, missing in zip(columns['json_contributor'].tolist(), columns['json_etiology'].tolist(),
+                                              np.asarray(columns['json_missing']).tolist()):
+        data = {}
+        if missing == 0:
+            data['Contributor ID'], data['Etiology'] = contributor, etiology
+        else:
+            for k, (c, field) in enumerate(JSON_FIELDS):
+                _put(data, field, [contributor, etiology][k], missing, k)
+        data['Files'] = []
+        contributors.append(data)
+    files = []
+    values = [ columns[c].tolist() for c, field in PROMPT_FIELDS ]
+    for filename, category, subcategory, prompt, transcript, missing in zip(
+            columns['filename'].tolist(), *values, np.asarray(columns['missing']).tolist()):
+        if missing == 0:   # the usual case: every field is present
+            u = { 'Filename':filename, 'Prompt':{ 'Category Description':category, 'Sub Category Description':subcategory,
+                                                  'Prompt Text':prompt, 'Transcript':transcript } }
+        else:
+            u = { 'Filename':filename }
+            if not missing & NO_PROMPT:
+                u['Prompt'] = {}
+                for k, (c, field) in enumerate(PROMPT_FIELDS):
+                    _put(u['Prompt'], field, [category, subcategory, prompt, transcript][k], missing, k)
+        files.append(u)
+    for u, n in zip(files, np.asarray(columns['utt_json']).tolist()):
+        contributors[n]['Files'].append(u)
+    for n, dimension, level in zip(np.asarray(columns['rating_utterance']).tolist(), columns['rating_dimension'].tolist(),
+                                   columns['rating_level'].tolist()):
+        files[n].setdefault('Ratings', []).append({'Dimension Description':dimension, 'Level':level})
+    keys = columns['json_contributor'] if key == 'contributor' else columns['json_path']
+    return dict(zip(keys.tolist(), contributors))
+
+################################################################################################
+# Command line arguments
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description     = 'Update the columnar cache of a distribution',
+        formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('datadir',help = 'Directory containing unsplit dataset JSON files')
+    parser.add_argument('cachedir',help = 'Directory containing the cache')
+    parser.add_argument('-j','--nworkers', type=int, default=1,
+                        help = 'Number of processes used to parse changed JSON files')
+
+    args   = parser.parse_args()
+    start = time.time()
+    columns = update_cache(args.cachedir, corpusloader.find_jsonfiles(args.datadir), args.nworkers)
+    print('Loaded %d utterances and %d ratings in %.2f seconds'%(
+        len(columns['filename']), len(columns['rating_level']), time.time()-start))
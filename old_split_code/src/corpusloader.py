@@ -0,0 +1,106 @@
+import argparse, json, os.path, glob, multiprocessing, time
+
+'''
+Load the contributor JSON files of a Speech Accessibility Project distribution.
+
+The serial loader opens each JSON file in turn.  With nworkers > 1, the list of files
+is cut into chunks of chunksize files, and each chunk is parsed by one process of a
+multiprocessing.Pool.  Chunks are returned in order, so the parallel loader returns
+exactly the same result as the serial loader.
+
+An optional extract function can be applied to each parsed JSON file inside the
+worker process, so that only the fields that the caller needs are sent back
+to the parent process.  extract must be a module-level function, so that it can be pickled.
+'''
+
+def find_jsonfiles(datadir, pattern='*/*.json'):
+    '''
+    @param:
+    datadir (str): directory containing the corpus
+    pattern (str): glob pattern, relative to datadir, that matches the contributor JSON files
+
+    @return:
+    jsonfiles (list): sorted list of matching JSON pathnames
+    '''
+    jsonfiles = sorted(glob.glob(os.path.join(datadir, pattern)))
+    print('Found',len(jsonfiles),'matching',os.path.join(datadir, pattern))
+    return jsonfiles
+
+def load_chunk(jsonfiles, extract=None):
+    '''
+    Load a list of JSON files.  This is the unit of work done by each worker process.
+
+    @param:
+    jsonfiles (list): JSON pathnames
+    extract (function): if not None, return extract(data) instead of data
+
+    @return:
+    results (list): one entry per jsonfile, in the same order
+    '''
+    results = []
+    for jsonfile in jsonfiles:
+        with open(jsonfile) as f:
+            data = json.load(f)
+        results.append(data if extract is None else extract(data))
+    return results
+
+def _load_chunk_star(args):
+    return load_chunk(*args)
+
+def load_jsonfiles(jsonfiles, nworkers=1, chunksize=64, extract=None):
+    '''
+    Load a list of JSON files, optionally in parallel.
+
+    @param:
+    jsonfiles (list): JSON pathnames
+    nworkers (int): number of worker processes; 1 means load serially in this process
+    chunksize (int): number of files parsed by a worker in each task
+    extract (function): if not None, each entry of the result is extract(data) instead of data
+
+    @return:
+    results (list): one entry per jsonfile, in the same order as jsonfiles
+    '''
+    if nworkers <= 1 or len(jsonfiles) <= chunksize:
+        return load_chunk(jsonfiles, extract)
+    chunks = [ (jsonfiles[i:i+chunksize], extract) for i in range(0, len(jsonfiles), chunksize) ]
+    results = []
+    with multiprocessing.Pool(min(nworkers, len(chunks))) as pool:
+        for chunk_results in pool.imap(_load_chunk_star, chunks):
+            results.extend(chunk_results)
+    return results
+
+def load_corpus(datadir, nworkers=1, chunksize=64, pattern='*/*.json'):
+    '''
+    @param:
+    datadir (str): directory containing the corpus
+    nworkers (int): number of worker processes
+    chunksize (int): number of files parsed by a worker in each task
+    pattern (str): glob pattern, relative to datadir, that matches the contributor JSON files
+
+    @return:
+    corpus (dict): corpus[contributor_id] is content of one JSON file
+    '''
+    jsonfiles = find_jsonfiles(datadir, pattern)
+    corpus = {}
+    for contributor in load_jsonfiles(jsonfiles, nworkers, chunksize):
+        corpus[contributor['Contributor ID']] = contributor
+    return corpus
+
+################################################################################################
+# Command line arguments
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description     = 'Load a corpus, and report how long it took',
+        formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('datadir',help = 'Directory containing unsplit dataset JSON files')
+    parser.add_argument('-j','--nworkers', type=int, default=1,
+                        help = 'Number of worker processes used to parse JSON files')
+    parser.add_argument('--chunksize', type=int, default=64,
+                        help = 'Number of JSON files parsed by a worker in each task')
+
+    args   = parser.parse_args()
+    start = time.time()
+    corpus = load_corpus(args.datadir, args.nworkers, args.chunksize)
+    print('Loaded %d contributors in %.2f seconds'%(len(corpus), time.time()-start))
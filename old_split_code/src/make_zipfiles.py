@@ -1,56 +1,220 @@
-import os,py7zr
+import os, argparse, multiprocessing, math, json
+import sizeindex, archivers
 
 MAX_SIZE = 20 * 1024 * 1024 * 1024 # 20G
 
+def contributor_sizes(datadir, cachefile=None, nthreads=8):
+    '''
+    @param:
+    datadir (str): directory containing split subdirectories (e.g., Train, Dev), each containing
+      one subdirectory per contributor
+    cachefile (str): size index cache (see sizeindex.py); only directories whose mtime changed are walked
+    nthreads (int): number of threads walking contributor directories
+
+    @return:
+    idpath2size (dict): idpath2size[idpath] = total size in bytes of the files in idpath
+    '''
+    index = sizeindex.update_size_index(datadir, cachefile, nthreads)
+    return { idpath:entry['bytes'] for idpath, entry in index.items() }
+
+def first_fit_decreasing(idpath2size, max_size=MAX_SIZE, ziplists=None):
+    '''
+    Pack contributor directories into as few archives as possible:
+    take directories from largest to smallest, and put each into the first archive with room for it.
+    First-fit-decreasing never uses more than 11/9 of the optimal number of archives (plus one).
+
+    @param:
+    idpath2size (dict): idpath2size[idpath] = size in bytes
+    max_size (int): maximum total size of the directories in one archive
+    ziplists (list): partly filled archives, which are filled first (in place); default none
+
+    @return:
+    ziplists (list): ziplists[n] = [ total size, [ idpaths ] ] for the n'th archive
+    '''
+    ziplists = [] if ziplists is None else ziplists
+    for idpath in sorted(idpath2size, key=lambda x: (-idpath2size[x], x)):
+        size = idpath2size[idpath]
+        if size > max_size:
+            print('WARNING: %s (%d bytes) is larger than an archive; it gets an archive of its own'%(idpath,size))
+        for ziplist in ziplists:
+            if ziplist[0] + size <= max_size or len(ziplist[1]) == 0:
+                ziplist[0] += size
+                ziplist[1].append(idpath)
+                break
+        else:
+            ziplists.append([ size, [ idpath ] ])
+    return ziplists
+
+def packing_report(ziplists, max_size=MAX_SIZE):
+    '''
+    Print the fill ratio of each archive, and compare the number of archives to the lower bound.
+    '''
+    total = sum(z[0] for z in ziplists)
+    for n, ziplist in enumerate(ziplists):
+        print('archive %d: %d contributors, %.2f GB, %.1f%% full'%(
+            n, len(ziplist[1]), ziplist[0]/2**30, 100*ziplist[0]/max_size))
+    if len(ziplists) > 0:
+        print('%d archives (lower bound %d), %.1f%% mean fill'%(
+            len(ziplists), math.ceil(total/max_size), 100*total/(len(ziplists)*max_size)))
+
+def write_json_atomically(filename, obj):
+    tmpfile = filename + '.tmp'
+    with open(tmpfile, 'w') as f:
+        json.dump(obj, f, indent=1)
+    os.replace(tmpfile, filename)
+
+def plan_archives(idpath2size, max_size, planfile, backend, zippattern=None):
+    '''
+    Reuse the packing recorded in planfile by a previous run with the same backend and max_size,
+    packing any new contributors into additional archives; otherwise pack from scratch.
+    The plan is (re)written to planfile.
+
+    Archives that are already written (zippattern%n exists) are kept as they are.  In the others,
+    contributors that no longer exist are dropped and sizes are brought up to date; an archive
+    that has grown beyond max_size is emptied, and its contributors are packed again with the new ones,
+    filling emptied archives first so that the numbering of the written archives does not change.
+
+    @param:
+    zippattern (str): pathname of the n'th archive, with %d for n; if None, no archive is written yet
+
+    @return:
+    ziplists (list): as returned by first_fit_decreasing; an archive may be empty
+    '''
+    ziplists = []
+    if os.path.exists(planfile):
+        with open(planfile) as f:
+            plan = json.load(f)
+        if plan['backend'] == backend and plan['max_size'] == max_size:
+            ziplists = plan['archives']
+        else:
+            print('WARNING: %s was made with different settings; packing from scratch'%(planfile))
+    planned = set(idpath for ziplist in ziplists for idpath in ziplist[1])
+    unplanned = { x:n for x,n in idpath2size.items() if x not in planned }
+    unwritten = [ n for n in range(len(ziplists)) if zippattern is None or not os.path.exists(zippattern%(n)) ]
+    for n in unwritten:
+        idpaths = [ x for x in ziplists[n][1] if x in idpath2size ]
+        total = sum(idpath2size[x] for x in idpaths)
+        if total > max_size and len(idpaths) > 1:
+            print('WARNING: archive %d has grown to %d bytes; its contributors are packed again'%(n,total))
+            unplanned.update({ x:idpath2size[x] for x in idpaths })
+            idpaths, total = [], 0
+        ziplists[n] = [ total, idpaths ]
+    repacked = first_fit_decreasing(unplanned, max_size, [ ziplists[n] for n in unwritten ])
+    ziplists = ziplists + repacked[len(unwritten):]
+    while len(ziplists) > 0 and len(ziplists[-1][1]) == 0 and len(ziplists)-1 in unwritten:
+        ziplists.pop()
+    write_json_atomically(planfile, { 'backend':backend, 'max_size':max_size, 'archives':ziplists })
+    return ziplists
+
+def write_archive(zipfilepath, idpaths, datadir, backend='7z', threads=None, level=None):
+    '''
+    Write one archive containing idpaths, stored under their paths relative to datadir.
+    The archive is written to a temporary name and renamed when complete; an archive
+    that already exists is complete, and is skipped.
+
+    If the backend is resumable, the contributors fully committed to the temporary archive
+    are recorded in zipfilepath.progress.json, and a rerun continues after the last of them.
+
+    @return:
+    zipfilepath (str)
+    ncommitted (int): number of contributors written by this call
+    '''
+    if os.path.exists(zipfilepath):
+        return zipfilepath, 0
+    writer_class = archivers.BACKENDS[backend]
+    tmpfile, progressfile = zipfilepath + '.tmp', zipfilepath + '.progress.json'
+    progress = { 'committed':[], 'state':None }
+    if writer_class.resumable and os.path.exists(tmpfile) and os.path.exists(progressfile):
+        with open(progressfile) as f:
+            progress = json.load(f)
+    writer = writer_class(tmpfile, threads, level, progress['state'])
+    ncommitted = 0
+    for idpath in idpaths[len(progress['committed']):]:
+        progress['state'] = writer.add(idpath, os.path.relpath(idpath, datadir))
+        progress['committed'].append(idpath)
+        ncommitted += 1
+        if writer_class.resumable:
+            write_json_atomically(progressfile, progress)
+    writer.close()
+    os.replace(tmpfile, zipfilepath)
+    if os.path.exists(progressfile):
+        os.remove(progressfile)
+    return zipfilepath, ncommitted
+
+def threads_per_archive(nprocesses, compress_threads=None):
+    '''
+    @return:
+    compress_threads (int): compress_threads if given; otherwise, when several archives are
+      compressed at once, the CPUs divided among them, so that together they do not oversubscribe
+      the machine; otherwise None (the backend's default)
+    '''
+    if compress_threads is not None or nprocesses <= 1:
+        return compress_threads
+    return max(1, (os.cpu_count() or 1)//nprocesses)
+
+def _write_archive_star(args):
+    return write_archive(*args)
+
+def make_zipfiles(datadir, outputdir, max_size=MAX_SIZE, nworkers=1, size_cache=None, nthreads=8,
+                  backend='7z', compress_threads=None, level=None):
+    '''
+    Pack the contributor directories of datadir into archives of at most max_size bytes
+    (before compression), and write them to outputdir.  The packing is recorded in
+    outputdir/<datadir name>_archives.json, so that a rerun resumes at the first incomplete archive.
+
+    @param:
+    nworkers (int): number of archives compressed concurrently, each in its own process
+    size_cache (str): size index cache (see sizeindex.py)
+    nthreads (int): number of threads computing directory sizes
+    backend (str): key of archivers.BACKENDS
+    compress_threads (int): compression threads per archive, if the backend supports it;
+      by default, the CPUs are divided among the nworkers archives compressed concurrently
+    level (int): compression level, if the backend supports it
+    '''
+    idpath2size = contributor_sizes(datadir, size_cache, nthreads)
+    datadirname = os.path.basename(os.path.normpath(datadir)) # Call them all this name + number
+    zippattern = os.path.join(outputdir, datadirname.replace('%','%%')+'%d'+archivers.BACKENDS[backend].extension)
+    ziplists = plan_archives(idpath2size, max_size, os.path.join(outputdir, datadirname+'_archives.json'),
+                             backend, zippattern)
+    packing_report(ziplists, max_size)
+    todo = [ n for n, ziplist in enumerate(ziplists) if len(ziplist[1]) > 0 and not os.path.exists(zippattern%(n)) ]
+    nprocesses = min(nworkers, len(todo))
+    compress_threads = threads_per_archive(nprocesses, compress_threads)
+    jobs = [ (zippattern%(n), ziplists[n][1], datadir, backend, compress_threads, level) for n in todo ]
+    print('%d archives to write'%(len(jobs)))
+    if nprocesses <= 1:
+        for job in jobs:
+            print('Wrote %s (%d contributors in this run)'%_write_archive_star(job))
+    else:
+        with multiprocessing.Pool(nprocesses) as pool:
+            for result in pool.imap_unordered(_write_archive_star, jobs):
+                print('Wrote %s (%d contributors in this run)'%result)
+
 ################################################################################################
 # Command line arguments
 #
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
-        description     = 'Find a way to zip up all of the directories in 20G 7z zipfiles',
+        description     = 'Find a way to zip up all of the directories in 20G zipfiles (7z or tar.zst)',
         formatter_class = argparse.ArgumentDefaultsHelpFormatter)
 
     parser.add_argument('datadir',help = 'Directory containing dev and train subdirs')
     parser.add_argument('outputdir',help = 'Directory into which to write the zipfiles')
-    
-    args   = parser.parse_args()
+    parser.add_argument('-m','--max_size',type=float,default=MAX_SIZE/2**30,
+                        help = 'Maximum size of the files in one zipfile, in GB (2**30 bytes)')
+    parser.add_argument('-j','--nworkers',type=int,default=1,
+                        help = 'Number of zipfiles compressed concurrently')
+    parser.add_argument('-c','--size_cache',default=None,
+                        help = 'JSON size index of the contributor directories (see sizeindex.py)')
+    parser.add_argument('-t','--nthreads',type=int,default=8,
+                        help = 'Number of threads computing contributor directory sizes')
+    parser.add_argument('-b','--backend',default='7z',choices=sorted(archivers.BACKENDS.keys()),
+                        help = 'Archive format')
+    parser.add_argument('--compress_threads',type=int,default=None,
+                        help = 'Compression threads per zipfile (tar.zst only; default the CPUs divided among --nworkers)')
+    parser.add_argument('--level',type=int,default=None,
+                        help = 'Compression level (tar.zst only; default 3)')
 
-    # Find the size in bytes of each contributor directory
-    idpath2size = {}
-    for split in os.listdir(args.datadir):
-        splitpath = os.path.join(args.datadir,subdir)
-        if os.path.isdir(splitpath):
-            for id in os.listdir(path):
-                idpath = os.path.join(splitpath,iddir)
-                if os.path.isdir(idpath):
-                    idpath2size[id] = 0
-                    for filename in os.listdir(idpath):
-                        filepath = os.path.join(idpath,filename)
-                        idpath2size[idpath] += os.stat(filepath).st_size
-                    
-
-                        
-                        
-    # Greedy assign them to zipfile lists
-    ziplists = {}
-    for idpath in idpath2size.keys():
-        done = False
-        for z in ziplists.keys():
-            if ziplists[z][0]+idpath2size[idpath] < MAX_SIZE and done == False:
-                ziplists[z][0] += idpath2size[idpath]
-                ziplists[z][1].append(idpath)
-                done = True
-        if done == False:
-            zipkey = len(zipfiles)
-            ziplists[zipkey] = [ idpath2size[idpath], [ idpath ] ]
-
-    # Create the zipfiles
-    datadirname = os.path.basename(os.path.normpath(args.datadir)) # Call them all this name + number
-    for zipkey in zipfiles.keys():
-        zipfilepath = os.path.join(args.outputdir,'%s%d.7z'%(datadirname,zipkey))
-        with py7zr.SevenZipFile(zipfilepath, 'w') as archive:
-            for idpath in zipfiles[zipkey][1]:
-                archive.write(idpath)
-
-        
-            
+    args   = parser.parse_args()
+    make_zipfiles(args.datadir, args.outputdir, int(args.max_size*2**30), args.nworkers,
+                  args.size_cache, args.nthreads, args.backend, args.compress_threads, args.level)
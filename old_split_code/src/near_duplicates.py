@@ -0,0 +1,232 @@
+import argparse, json, zlib, sys, os
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','..','new_split_code'))
+from transcript_index import normalize_transcript
+"""
+Find dev and test utterances whose transcripts are near-copies of train transcripts
+(differing only by a word, punctuation or casing), using MinHash signatures and
+LSH banding.
+
+Transcripts are normalized with transcript_index.normalize_transcript, the same
+normalization used to find exact copies, and deduplicated first, so a prompt read by many
+contributors is hashed once.  Each distinct transcript is represented by its set of
+character k-shingles; its MinHash signature is the minimum, over shingles, of num_perm
+universal hash functions, so that the fraction of equal signature entries estimates the
+Jaccard similarity of two shingle sets.  Signatures are cut into bands; two transcripts
+are candidates only if all rows of some band agree, so the number of comparisons grows
+with the number of near-duplicates rather than with the product of the subset sizes.
+Candidates are kept if their estimated similarity is at least the threshold.
+"""
+
+PRIME = 4294967291   # largest prime below 2**32, so hash values fit in uint32
+
+def unique_texts(texts):
+    '''
+    @param:
+    texts (iterable of str)
+    @return:
+    unique (list): distinct normalized texts, in order of first occurrence
+    inverse (np.ndarray of int64): texts[i] normalizes to unique[inverse[i]]
+    '''
+    index = {}
+    inverse = [ index.setdefault(normalize_transcript(t), len(index)) for t in texts ]
+    return list(index.keys()), np.array(inverse, dtype=np.int64)
+
+def shingle_hashes(text, k=5):
+    '''
+    @param:
+    text (str): normalized text
+    k (int): shingle length in characters; texts shorter than k are one shingle
+    @return:
+    hashes (np.ndarray of uint64): sorted unique crc32 hashes of the shingles
+    '''
+    grams = [ text[i:i+k] for i in range(max(1, len(text)-k+1)) ]
+    return np.unique(np.fromiter((zlib.crc32(g.encode('utf8')) for g in grams), dtype=np.uint64, count=len(grams)))
+
+def hash_parameters(num_perm, seed):
+    '''
+    Coefficients of the hash functions h(x) = (a*x + b) mod PRIME.
+    a < 2**31 so that a*x + b cannot overflow uint64.
+    '''
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2**31, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, PRIME, size=num_perm, dtype=np.uint64)
+    return a, b
+
+def minhash_signatures(texts, num_perm=128, k=5, seed=1, chunk_elements=2**22):
+    '''
+    @param:
+    texts (list of str): normalized texts
+    num_perm (int): number of hash functions
+    k (int): shingle length
+    seed (int): seed of the hash functions; signatures are comparable only if computed with the same seed
+    chunk_elements (int): maximum size of the (shingles, num_perm) array computed at one time
+
+    @return:
+    signatures (np.ndarray of uint32): shape (len(texts), num_perm)
+    '''
+    a, b = hash_parameters(num_perm, seed)
+    shingles = [ shingle_hashes(t, k) for t in texts ]
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    start = 0
+    while start < len(texts):
+        stop, size = start+1, len(shingles[start])
+        while stop < len(texts) and (size+len(shingles[stop]))*num_perm <= chunk_elements:
+            size += len(shingles[stop])
+            stop += 1
+        lengths = [ len(s) for s in shingles[start:stop] ]
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        x = np.concatenate(shingles[start:stop])
+        h = (x[:,np.newaxis]*a[np.newaxis,:] + b[np.newaxis,:]) % np.uint64(PRIME)
+        signatures[start:stop] = np.minimum.reduceat(h, offsets, axis=0)
+        start = stop
+    return signatures
+
+def band_keys(signatures, bands):
+    '''
+    @return:
+    keys (np.ndarray of uint64): shape (len(signatures), bands), one 64-bit FNV-1a hash per band
+    '''
+    rows = signatures.shape[1] // bands
+    if rows == 0:
+        raise RuntimeError('bands=%d cannot exceed num_perm=%d'%(bands, signatures.shape[1]))
+    keys = np.full((len(signatures), bands), 14695981039346656037, dtype=np.uint64)
+    for band in range(bands):
+        for row in range(band*rows, (band+1)*rows):
+            keys[:,band] = (keys[:,band] ^ signatures[:,row].astype(np.uint64)) * np.uint64(1099511628211)
+    return keys
+
+def lsh_candidates(query_signatures, reference_signatures, bands):
+    '''
+    @return:
+    qi, ri (np.ndarray of int64): query_signatures[qi[n]] and reference_signatures[ri[n]]
+      agree on every row of at least one band; each pair is listed once
+    '''
+    qkeys, rkeys = band_keys(query_signatures, bands), band_keys(reference_signatures, bands)
+    nref = len(reference_signatures)
+    codes = []
+    for band in range(bands):
+        order = np.argsort(rkeys[:,band], kind='stable')
+        sorted_keys = rkeys[order,band]
+        lo = np.searchsorted(sorted_keys, qkeys[:,band], 'left')
+        counts = np.searchsorted(sorted_keys, qkeys[:,band], 'right') - lo
+        qi = np.repeat(np.arange(len(qkeys), dtype=np.int64), counts)
+        within = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts)-counts, counts)
+        ri = order[np.repeat(lo, counts) + within]
+        codes.append(qi*nref + ri)
+    codes = np.unique(np.concatenate(codes)) if len(codes) > 0 else np.zeros(0, dtype=np.int64)
+    return codes // max(nref,1), codes % max(nref,1)
+
+def find_near_duplicates(queries, references, threshold=0.5, num_perm=128, bands=32, k=5, seed=1):
+    '''
+    Find the most similar reference for each query that has one above threshold.
+
+    @param:
+    queries (list of str): e.g., dev or test transcripts
+    references (list of str): e.g., train transcripts
+    threshold (float): minimum estimated Jaccard similarity of the shingle sets
+    num_perm (int): MinHash signature length
+    bands (int): number of LSH bands; num_perm//bands rows per band.  Pairs with similarity s
+      are candidates with probability 1-(1-s**rows)**bands.
+    k (int): shingle length in characters
+    seed (int): seed of the hash functions
+
+    @return:
+    matches (list): (query_index, reference_index, similarity) for each query with a near-duplicate,
+      sorted by query_index; reference_index is the first reference with the matching normalized text
+    '''
+    uq, qinv = unique_texts(queries)
+    ur, rinv = unique_texts(references)
+    if len(uq) == 0 or len(ur) == 0:
+        return []
+    qsig = minhash_signatures(uq, num_perm, k, seed)
+    rsig = minhash_signatures(ur, num_perm, k, seed)
+    qi, ri = lsh_candidates(qsig, rsig, bands)
+    similarity = np.empty(len(qi))
+    step = max(1, 2**22 // num_perm)
+    for start in range(0, len(qi), step):
+        stop = start+step
+        similarity[start:stop] = np.mean(qsig[qi[start:stop]] == rsig[ri[start:stop]], axis=1)
+    keep = similarity >= threshold
+    qi, ri, similarity = qi[keep], ri[keep], similarity[keep]
+    order = np.lexsort((-similarity, qi))
+    qi, ri, similarity = qi[order], ri[order], similarity[order]
+    first = np.concatenate(([True], qi[1:] != qi[:-1])) if len(qi) > 0 else np.zeros(0, dtype=bool)
+    best = { int(q):(int(r),float(s)) for q,r,s in zip(qi[first], ri[first], similarity[first]) }
+    first_reference = np.unique(rinv, return_index=True)[1]
+    return [ (n, int(first_reference[best[q][0]]), best[q][1]) for n,q in enumerate(qinv) if int(q) in best ]
+
+####################################################################################
+def main(splitfile, outputfile, threshold=0.5, num_perm=128, bands=32, k=5, include_shared=False):
+    '''
+    Report dev and test utterances of a split (written by SAPsplit.py) whose transcripts
+    are near-copies of train transcripts.
+
+    @param:
+    splitfile (str): JSON file written by SAPsplit.py
+    outputfile (str): JSON file in which to write
+      near[subset][wavfile] = { 'transcript', 'train_wavfile', 'train_transcript', 'similarity' }
+    include_shared (bool): if False, only check the unshared portions of dev and test,
+      since the shared portions intentionally share prompts with train
+    '''
+    with open(splitfile) as f:
+        subset2files = json.load(f)
+    trainfiles = list(subset2files['train'].keys())
+    references = [ subset2files['train'][w][1] for w in trainfiles ]
+    near = {}
+    for subset in subset2files:
+        if subset == 'train':
+            continue
+        portions = ['shared','unshared'] if include_shared else ['unshared']
+        wavfiles = [ w for p in portions for w in subset2files[subset].get(p,{}) ]
+        transcripts = [ subset2files[subset][p][w][1] for p in portions for w in subset2files[subset].get(p,{}) ]
+        matches = find_near_duplicates(transcripts, references, threshold, num_perm, bands, k)
+        near[subset] = { wavfiles[q]:{ 'transcript':transcripts[q], 'train_wavfile':trainfiles[r],
+                                       'train_transcript':references[r], 'similarity':s }
+                         for q,r,s in matches }
+        print('%s: %d of %d utterances are near-copies of train transcripts'%(subset,len(matches),len(wavfiles)))
+    with open(outputfile,'w') as f:
+        json.dump(near, f, indent=1, sort_keys=True)
+
+####################################################################################
+# Command line arguments
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="""
+        Find dev and test utterances whose transcripts are near-copies of train transcripts.
+
+        USAGE: python %s splitfile outputfile
+        """%(sys.argv[0]),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        'splitfile',action='store',
+        help='JSON file written by SAPsplit.py'
+    )
+    parser.add_argument(
+        'outputfile',action='store',
+        help='JSON file in which to write the near-copies'
+    )
+    parser.add_argument(
+        '-t','--threshold',action='store',type=float,default=0.5,
+        help='Minimum estimated Jaccard similarity of character shingles'
+    )
+    parser.add_argument(
+        '--num_perm',action='store',type=int,default=128,
+        help='MinHash signature length'
+    )
+    parser.add_argument(
+        '--bands',action='store',type=int,default=32,
+        help='Number of LSH bands'
+    )
+    parser.add_argument(
+        '-k','--shingle',action='store',type=int,default=5,
+        help='Shingle length in characters'
+    )
+    parser.add_argument(
+        '--include_shared',action='store_true',
+        help='Also check the shared portions of dev and test'
+    )
+    args = parser.parse_args()
+    main(args.splitfile, args.outputfile, args.threshold, args.num_perm, args.bands, args.shingle,
+         args.include_shared)
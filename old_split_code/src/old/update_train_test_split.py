@@ -12,12 +12,19 @@ Written: Mark Hasegawa-Johnson
 Revision History: 
 Original release: 2023 July 17
 Modified cost to be average Wasserstein rather than sum: 2023 July 18
+Added Histogram_Score_Cache, which scores each swap in O(levels) time,
+  using integer contributor indices and label arrays
+Added simulated annealing and tabu search, with a time or evaluation budget
+Added checkpoint and resume of search_with_restarts
 
 License: MIT License
 '''
 
-import argparse, json, copy, os.path, glob, collections, random, openpyxl
+import argparse, json, copy, os.path, glob, collections, random, openpyxl, sys, multiprocessing
+import math, time, hashlib
 import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import corpusloader, corpuscache
 
 TRAIN_DEV_TEST_FRACTIONS = np.array([ 0.80, 0.05, 0.15])
 
@@ -37,8 +44,91 @@ TRAIN_DEV_TEST_FRACTIONS = np.array([ 0.80, 0.05, 0.15])
 # ]
 #
 
+class Search_Budget():
+    def __init__(self, max_seconds=None, max_evaluations=None):
+        '''
+        Wall-clock and/or evaluation budget of one search.
+        The search ends when either budget is used up.
+        @param:
+        max_seconds (real): wall-clock budget in seconds, or None
+        max_evaluations (int): maximum number of assignments scored, or None
+        '''
+        if max_seconds == None and max_evaluations == None:
+            raise RuntimeError('A budgeted search needs max_seconds, max_evaluations, or both')
+        self.max_seconds = max_seconds
+        self.max_evaluations = max_evaluations
+        self.start = time.time()
+        self.evaluations = 0
+
+    def spend(self, n=1):
+        self.evaluations += n
+
+    def fraction(self):
+        '''
+        @return: fraction of the budget used so far (the larger of time and evaluations)
+        '''
+        f = 0
+        if self.max_seconds != None:
+            f = max(f, (time.time()-self.start)/self.max_seconds)
+        if self.max_evaluations != None:
+            f = max(f, self.evaluations/self.max_evaluations)
+        return f
+
+    def exhausted(self):
+        return self.fraction() >= 1
+
+class LRU_Cache():
+    def __init__(self, capacity):
+        '''
+        A size-bounded map from assignment keys to scores.
+        When more than capacity entries are stored, the least recently used entry is evicted.
+        Hits, misses and evictions are counted, so that capacity can be tuned.
+        @param:
+        capacity (int): maximum number of stored entries; 0 disables caching
+        '''
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def get(self, key):
+        '''
+        @return: the stored value, or None if key is not in the cache
+        '''
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        if self.capacity <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def report(self):
+        '''
+        @return: a one-line summary of the cache statistics since the last reset_stats()
+        '''
+        lookups = max(self.hits+self.misses, 1)
+        return '%d hits, %d misses (hit rate %.3f), %d evictions, %d/%d entries'%(
+            self.hits, self.misses, self.hits/lookups, self.evictions, len(self.entries), self.capacity)
+
 class Score_Cache():
-    def __init__(self, feature, num_new, prev, unassigned):
+    def __init__(self, feature, num_new, prev, unassigned, cache_size=100000):
         '''
         A score cache stores scores calculated for previous assignments.
         Each new call of score_assignment checks the cache first,
@@ -48,31 +138,46 @@ class Score_Cache():
         num_new (dict): num_new['train'] is the number of new train contributors to assign, 'dev','test'
         prev (dict): prev['train'] is the list of previously assigned train contributors, 'dev','test'
         unassigned (list): a list of the contributor IDs in feature but not in prev
+        cache_size (int): maximum number of scores stored in the LRU_Cache
         '''
         self.feature = {f:{c:[x for x in feature[f][c]] for c in feature[f]} for f in feature}
         self.num = {s:n for (s,n) in num_new.items()}
         self.prev = tuple(tuple(c for c in prev[s]) for s in ['train','dev','test'])
-        self.assigned = [c for s in ['train','dev','test'] for c in prev[s]]
+        self.assigned = set(c for s in ['train','dev','test'] for c in prev[s])
         self.unassigned = [c for c in unassigned]
-        self.cache = {}
+        self.cache = LRU_Cache(cache_size)
 
-    def randomly_assign(self):
+    def randomly_assign(self, rng=random):
         '''
         Generate a random assignment matching known target number and previous split.
+        The shuffle always starts from the same order of unassigned contributors,
+        so the result depends only on the state of rng.
+        @param:
+        rng (random.Random): random number generator; default is the random module
         @return:
         assignment (tuple of tuples): assignment[n]==tuple of contributor_ids, n in 0,1,2
         '''
         assignment = [ list(split) for split in self.prev ]
-        random.shuffle(self.unassigned)
-        assignment[0].extend(self.unassigned[:self.num['train']])
-        assignment[1].extend(self.unassigned[self.num['train']:self.num['train']+self.num['dev']])
-        assignment[2].extend(self.unassigned[self.num['train']+self.num['dev']:])
+        order = list(self.unassigned)
+        rng.shuffle(order)
+        assignment[0].extend(order[:self.num['train']])
+        assignment[1].extend(order[self.num['train']:self.num['train']+self.num['dev']])
+        assignment[2].extend(order[self.num['train']+self.num['dev']:])
         #print(self.num, assignment)
         #print('randomly_assign:',assignment['train'][0],assignment['dev'][0],assignment['test'][0])
         return (tuple(sorted(assignment[0])),
                 tuple(sorted(assignment[1])),
                 tuple(sorted(assignment[2])))
 
+    def same_assignment(self, a1, a2):
+        return a1 == a2
+
+    def to_tuples(self, assignment):
+        return assignment
+
+    def from_tuples(self, assignment):
+        return tuple(tuple(split) for split in assignment)
+
     def neighbors(self,inp):
         '''
         Returns a generator that generates all neighboring assignments
@@ -115,8 +220,9 @@ class Score_Cache():
         assignment (tuple): assignment[0,1,2] are sorted train, dev, test tuples of contributor IDs
         self.feature[feature][contributor] = list of numbers, can use += to concatenate
         '''
-        if assignment in self.cache:
-            return self.cache[assignment]
+        score = self.cache.get(assignment)
+        if score is not None:
+            return score
         score = 0
         for fkey,fval in self.feature.items():
             tr = np.array(sorted([ val for c in assignment[0] if c in fval for val in fval[c] ]))
@@ -133,7 +239,7 @@ class Score_Cache():
                         i0 = np.arange(len(s0))
                         i1 = np.floor(i0*len(s1)/len(s0)).astype('int')
                         score += np.sum(np.abs(s0[i0]-s1[i1]))/denominator
-        self.cache[assignment] = score
+        self.cache.put(assignment, score)
         return score
 
     def print_differences(self, a1, a2):
@@ -214,11 +320,569 @@ class Score_Cache():
         return outputdict
                        
 
+class Histogram_Score_Cache():
+    def __init__(self, feature, num_new, prev, unassigned):
+        '''
+        A score cache that represents the ratings of each split as a histogram over rating levels.
+        Ratings are small non-negative integers, so the L1 Wasserstein distance between two splits
+        is the sum over levels of the absolute difference between their CDFs.
+        Swapping two contributors changes the histograms of two splits by the histograms of the
+        two contributors, so each neighbor is scored in O(levels) time per feature dimension,
+        instead of re-sorting the concatenated ratings of every split.
+
+        The score is the exact L1 Wasserstein distance; Score_Cache.score_assignment
+        approximates the same quantity by quantizing probability mass in units of 1/len(s0).
+
+        Contributor IDs are interned to integers 0..N-1 (in sorted order of their IDs).
+        An assignment is a numpy int8 array of N split labels (0=train, 1=dev, 2=test),
+        The ratings of contributor n are stored as self.counts[n,feature,level],
+        the number of ratings at each level.
+
+        There is no score cache (self.cache is None): the searches score each neighbor by
+        updating the split histograms in place, which is cheaper than building a cache key,
+        and they never score the same assignment twice.
+
+        @param: same as Score_Cache, which also has cache_size
+        '''
+        self.fkeys = list(feature.keys())
+        self.num = {s:n for (s,n) in num_new.items()}
+        self.ids = sorted(set(unassigned).union(*[ set(prev[s]) for s in ['train','dev','test'] ]))
+        self.index = { c:n for n,c in enumerate(self.ids) }
+        self.levels = 1 + max([ v for f in feature.values() for vals in f.values() for v in vals ],
+                              default=0)
+        self.counts = np.zeros((len(self.ids), len(self.fkeys), self.levels), dtype='int32')
+        for i, f in enumerate(self.fkeys):
+            for c, vals in feature[f].items():
+                if c in self.index:
+                    self.counts[self.index[c],i] = np.bincount(vals, minlength=self.levels)
+        self.prev = np.full(len(self.ids), -1, dtype='int8')
+        for n, s in enumerate(['train','dev','test']):
+            self.prev[[ self.index[c] for c in prev[s] ]] = n
+        self.movable = (self.prev < 0)
+        self.unassigned = [ int(n) for n in np.flatnonzero(self.movable) ]
+        self.cache = None
+
+    def randomly_assign(self, rng=random):
+        '''
+        Generate a random assignment matching known target number and previous split.
+        The shuffle always starts from the same order of unassigned contributors,
+        so the result depends only on the state of rng.
+        @param:
+        rng (random.Random): random number generator; default is the random module
+        @return:
+        assignment (array): assignment[n] is the split (0,1,2) of contributor n
+        '''
+        assignment = self.prev.copy()
+        order = list(self.unassigned)
+        rng.shuffle(order)
+        ntrain, ndev = self.num['train'], self.num['dev']
+        assignment[order[:ntrain]] = 0
+        assignment[order[ntrain:ntrain+ndev]] = 1
+        assignment[order[ntrain+ndev:]] = 2
+        return assignment
+
+    def to_tuples(self, assignment):
+        '''
+        @return:
+        assignment (tuple): train, dev, test tuples of contributor IDs, as used by Score_Cache
+        '''
+        return tuple(tuple(self.ids[n] for n in np.flatnonzero(assignment==s)) for s in range(3))
+
+    def from_tuples(self, assignment):
+        '''
+        @param:
+        assignment (tuple): train, dev, test tuples of contributor IDs, as used by Score_Cache
+        '''
+        labels = np.full(len(self.ids), -1, dtype='int8')
+        for s in range(3):
+            labels[[ self.index[c] for c in assignment[s] ]] = s
+        return labels
+
+    def same_assignment(self, a1, a2):
+        return a1 is not None and a2 is not None and np.array_equal(a1, a2)
+
+    def neighbors(self, assignment):
+        '''
+        Generate all assignments in which one pair of movable contributors has been swapped
+        from train to dev, from train to test, or from test to dev.
+        '''
+        for (s0,s1) in [(0,1),(0,2),(2,1)]:
+            for n0 in np.flatnonzero((assignment==s0) & self.movable):
+                for n1 in np.flatnonzero((assignment==s1) & self.movable):
+                    neighbor = assignment.copy()
+                    neighbor[n0], neighbor[n1] = s1, s0
+                    yield neighbor
+
+    def split_histograms(self, assignment):
+        '''
+        @param:
+        assignment (array): assignment[n] is the split of contributor n
+        @return:
+        H (array): H[split, feature, level] is the number of ratings at that level
+        '''
+        return np.stack([ self.counts[assignment==s].sum(axis=0, dtype='int64') for s in range(3) ])
+
+    def histogram_score(self, H):
+        '''
+        Score = average over pairs (train,dev), (train,test), (test,dev)
+          of average over feature dimensions
+          of the L1 Wasserstein distance between the two splits,
+          which is the sum over levels of the absolute difference of their CDFs.
+          A split with no ratings in some feature has all of its probability mass at 0,
+          i.e., its CDF is 1 at every level.
+        @param:
+        H (array): H[split, feature, level] as returned by split_histograms
+        @return:
+        score (real)
+        '''
+        C = np.cumsum(H, axis=2)
+        n = C[:,:,-1:]
+        cdf = np.where(n > 0, C / np.maximum(n,1), 1.0)
+        score = 0
+        for (s0,s1) in [(0,1),(0,2),(2,1)]:
+            score += np.sum(np.abs(cdf[s0]-cdf[s1]))
+        return score / (3*max(len(self.fkeys),1))
+
+    def score_assignment(self, assignment):
+        '''
+        Compute score for a given assignment, using histograms.
+        @param:
+        assignment (array): assignment[n] is the split of contributor n
+        '''
+        return self.histogram_score(self.split_histograms(assignment))
+
+    def print_differences(self, a1, a2):
+        '''
+        Print differences between two assignments.
+        Differences = split:contributor_id that exists in a2 but not a1.
+        '''
+        return { s:[ self.ids[n] for n in np.flatnonzero((a2==i) & (a1!=i)) ]
+                 for i,s in enumerate(['train','dev','test']) }
+
+    def neighbor_search(self, original):
+        '''
+        Find the best score reachable by coordinate descent from initial assignment.
+        The split histograms are kept up to date as contributors are swapped,
+        so that each neighbor is scored by two O(levels) histogram updates.
+        @param:
+        original (array): original[n] is the split of contributor n
+        @return:
+        score (real): score of best assignment (average of L1 Wasserstein distances)
+        assignment (array): best assignment
+        pathlength (int): number of passes over the neighbors that improved the score
+        '''
+        assignment = original.copy()
+        members = [ np.flatnonzero((assignment==s) & self.movable) for s in range(3) ]
+        H = self.split_histograms(assignment)
+        prev_score = np.inf
+        score = self.histogram_score(H)
+        pathlength = -1
+        while score < prev_score:
+            pathlength += 1
+            prev_score = score
+            n = 0
+            for (s0,s1) in [(0,1),(0,2),(2,1)]:
+                for i0 in range(len(members[s0])):
+                    for i1 in range(len(members[s1])):
+                        c0, c1 = members[s0][i0], members[s1][i1]
+                        d = self.counts[c1] - self.counts[c0]
+                        H[s0] += d
+                        H[s1] -= d
+                        test_score = self.histogram_score(H)
+                        if n % 1000 == 0:
+                            print('Pathlength %d, neighbor %d: %g vs %g'%(pathlength,n,test_score,score))
+                        n += 1
+                        if test_score < score:
+                            score = test_score
+                            members[s0][i0], members[s1][i1] = c1, c0
+                            assignment[c0], assignment[c1] = s1, s0
+                        else:
+                            H[s0] -= d
+                            H[s1] += d
+        delta = self.print_differences(original, assignment)
+        print('Coordinate search changed:',delta)
+        return score, assignment, pathlength
 
-def search_with_restarts(feature, num_new, prev, unassigned, beamwidth, n_restarts):
+    def anneal_search(self, original, rng=random, max_seconds=None, max_evaluations=None,
+                      initial_temperature=None, final_ratio=1e-3):
+        '''
+        Simulated annealing over the same swap neighborhood as neighbor_search.
+        Each step swaps a random movable contributor of split s0 with a random movable
+        contributor of split s1, scored by two O(levels) histogram updates.
+        A worse score is accepted with probability exp(-increase/T).  The temperature T
+        decreases geometrically from initial_temperature to final_ratio*initial_temperature
+        as the budget is used up.
+        @param:
+        original (array): original[n] is the split of contributor n
+        rng (random.Random): random number generator
+        max_seconds, max_evaluations: budget of the search (see Search_Budget)
+        initial_temperature (real): if None, the mean absolute score change of 100 random swaps
+        final_ratio (real): ratio of the final to the initial temperature
+        @return:
+        score (real): score of the best assignment visited
+        assignment (array): best assignment visited
+        pathlength (int): number of swaps that were accepted
+        '''
+        budget = Search_Budget(max_seconds, max_evaluations)
+        assignment = original.copy()
+        members = [ np.flatnonzero((assignment==s) & self.movable) for s in range(3) ]
+        pairs = [ (s0,s1) for (s0,s1) in [(0,1),(0,2),(2,1)] if len(members[s0])*len(members[s1]) > 0 ]
+        weights = [ len(members[s0])*len(members[s1]) for (s0,s1) in pairs ]
+        H = self.split_histograms(assignment)
+        score = self.histogram_score(H)
+        best_score, best_assignment = score, assignment.copy()
+        pathlength = 0
+
+        def random_swap():
+            (s0,s1) = rng.choices(pairs, weights)[0]
+            i0, i1 = rng.randrange(len(members[s0])), rng.randrange(len(members[s1]))
+            d = self.counts[members[s1][i1]] - self.counts[members[s0][i0]]
+            H[s0] += d
+            H[s1] -= d
+            budget.spend()
+            return s0, s1, i0, i1, d, self.histogram_score(H)
+
+        if len(pairs) > 0 and initial_temperature == None:
+            changes = []
+            for n in range(100):
+                s0, s1, i0, i1, d, test_score = random_swap()
+                changes.append(abs(test_score-score))
+                H[s0] -= d
+                H[s1] += d
+            initial_temperature = max(np.mean(changes), 1e-12)
+
+        while len(pairs) > 0 and not budget.exhausted():
+            s0, s1, i0, i1, d, test_score = random_swap()
+            T = initial_temperature * final_ratio**min(budget.fraction(),1)
+            if test_score <= score or rng.random() < math.exp((score-test_score)/T):
+                c0, c1 = members[s0][i0], members[s1][i1]
+                members[s0][i0], members[s1][i1] = c1, c0
+                assignment[c0], assignment[c1] = s1, s0
+                score = test_score
+                pathlength += 1
+                if score < best_score:
+                    best_score, best_assignment = score, assignment.copy()
+            else:
+                H[s0] -= d
+                H[s1] += d
+        print('Annealing: %d evaluations, %d accepted swaps, best %g'%(budget.evaluations,pathlength,best_score))
+        delta = self.print_differences(original, best_assignment)
+        print('Annealing changed:',delta)
+        return best_score, best_assignment, pathlength
+
+    def create_output_dict(self, assignment, score):
+        '''
+        Create an output JSON object, in the same format as Score_Cache.create_output_dict.
+        '''
+        outputdict = {}
+        for split, contributors in zip(['train','dev','test'], self.to_tuples(assignment)):
+            outputdict[split] = list(contributors)
+        outputdict['score'] = score
+        H = self.split_histograms(assignment)
+        for i, f in enumerate(self.fkeys):
+            outputdict[f] = {}
+            for n, split in enumerate(['train','dev','test']):
+                nonzero = np.flatnonzero(H[n,i])
+                top = nonzero[-1]+1 if len(nonzero) > 0 else 0
+                outputdict[f][split] = [ int(x) for x in H[n,i,:top] ]
+        return outputdict
+
+class Batch_Score_Cache(Histogram_Score_Cache):
+    def __init__(self, feature, num_new, prev, unassigned, move='best', chunk_elements=2**22):
+        '''
+        A Histogram_Score_Cache whose neighbor_search scores every swap of a contributor in
+        split s0 with a contributor in split s1 at once, as numpy array operations on the
+        cumulative rating histograms of the contributors, then makes one move.
+
+        @param:
+        feature, num_new, prev, unassigned: same as Histogram_Score_Cache
+        move (str): 'best' to make the best improving swap, 'first' to make the first one found
+        chunk_elements (int): maximum size of the temporary arrays used to score a batch of swaps
+        '''
+        super().__init__(feature, num_new, prev, unassigned)
+        if move not in ['best','first']:
+            raise RuntimeError('move should be best or first, not %s'%(move))
+        self.move = move
+        self.chunk_elements = chunk_elements
+        self.cumcounts = np.cumsum(self.counts, axis=2, dtype='int64')
+
+    def swap_scores(self, CS, a, b, s0, s1):
+        '''
+        Score every assignment in which contributor a[i] of split s0 is swapped with
+        contributor b[j] of split s1.
+        @param:
+        CS (array): CS[split,feature,level] is the cumulative histogram of the current assignment
+        a (array): indices of contributors in split s0
+        b (array): indices of contributors in split s1
+        s0, s1 (int): the two splits
+        @return:
+        scores (array): scores[i,j] is the score after swapping a[i] with b[j]
+        '''
+        cdf2 = self._cdf(CS[3-s0-s1])
+        Cb = self.cumcounts[b]
+        rows = max(1, self.chunk_elements // max(1, Cb.size))
+        scores = np.empty((len(a), len(b)))
+        for start in range(0, len(a), rows):
+            D = Cb[None,:] - self.cumcounts[a[start:start+rows]][:,None]
+            cdf0 = self._cdf(CS[s0] + D)
+            cdf1 = self._cdf(CS[s1] - D)
+            total = np.abs(cdf0-cdf1) + np.abs(cdf0-cdf2) + np.abs(cdf1-cdf2)
+            scores[start:start+rows] = total.sum(axis=(2,3))
+        return scores / (3*max(len(self.fkeys),1))
+
+    def _cdf(self, C):
+        n = C[...,-1:]
+        return np.where(n > 0, C / np.maximum(n,1), 1.0)
+
+    def neighbor_search(self, original):
+        '''
+        Find the best score reachable by coordinate descent from initial assignment.
+        Each step scores all neighbors with swap_scores, then makes the best
+        (or first) improving swap.
+        @param:
+        original (array): original[n] is the split of contributor n
+        @return:
+        score (real): score of best assignment (average of L1 Wasserstein distances)
+        assignment (array): best assignment
+        pathlength (int): number of swaps that were made
+        '''
+        assignment = original.copy()
+        members = [ np.flatnonzero((assignment==s) & self.movable) for s in range(3) ]
+        H = self.split_histograms(assignment)
+        CS = np.cumsum(H, axis=2)
+        score = self.histogram_score(H)
+        pathlength = 0
+        while True:
+            best = None
+            for (s0,s1) in [(0,1),(0,2),(2,1)]:
+                if len(members[s0])==0 or len(members[s1])==0:
+                    continue
+                scores = self.swap_scores(CS, members[s0], members[s1], s0, s1)
+                if self.move == 'first':
+                    improving = np.flatnonzero(scores < score - 1e-12)
+                    if len(improving) > 0:
+                        i0, i1 = np.unravel_index(improving[0], scores.shape)
+                        best = (scores[i0,i1], s0, s1, i0, i1)
+                        break
+                else:
+                    i0, i1 = np.unravel_index(np.argmin(scores), scores.shape)
+                    if scores[i0,i1] < score - 1e-12 and (best is None or scores[i0,i1] < best[0]):
+                        best = (scores[i0,i1], s0, s1, i0, i1)
+            if best is None:
+                break
+            score, s0, s1, i0, i1 = best
+            c0, c1 = members[s0][i0], members[s1][i1]
+            d = self.cumcounts[c1] - self.cumcounts[c0]
+            CS[s0] += d
+            CS[s1] -= d
+            members[s0][i0], members[s1][i1] = c1, c0
+            assignment[c0], assignment[c1] = s1, s0
+            pathlength += 1
+            print('Pathlength %d: %g'%(pathlength,score))
+        delta = self.print_differences(original, assignment)
+        print('Coordinate search changed:',delta)
+        return score, assignment, pathlength
+
+    def tabu_search(self, original, rng=random, max_seconds=None, max_evaluations=None, tenure=10):
+        '''
+        Tabu search over the same swap neighborhood as neighbor_search.
+        Each step scores all swaps with swap_scores, and makes the best swap that does not
+        move a tabu contributor, even if it makes the score worse.  Both contributors of a swap
+        are tabu for the next tenure steps, unless moving them again gives a new best score.
+        @param:
+        original (array): original[n] is the split of contributor n
+        rng (random.Random): not used; accepted so that all searches have the same arguments
+        max_seconds, max_evaluations: budget of the search (see Search_Budget)
+        tenure (int): number of steps for which a moved contributor is tabu
+        @return:
+        score (real): score of the best assignment visited
+        assignment (array): best assignment visited
+        pathlength (int): number of swaps that were made
+        '''
+        budget = Search_Budget(max_seconds, max_evaluations)
+        assignment = original.copy()
+        members = [ np.flatnonzero((assignment==s) & self.movable) for s in range(3) ]
+        H = self.split_histograms(assignment)
+        CS = np.cumsum(H, axis=2)
+        score = self.histogram_score(H)
+        best_score, best_assignment = score, assignment.copy()
+        tabu_until = np.zeros(len(self.ids), dtype='int64')
+        pathlength = 0
+        while not budget.exhausted():
+            move = None
+            for (s0,s1) in [(0,1),(0,2),(2,1)]:
+                if len(members[s0])==0 or len(members[s1])==0:
+                    continue
+                scores = self.swap_scores(CS, members[s0], members[s1], s0, s1)
+                budget.spend(scores.size)
+                tabu = ((tabu_until[members[s0]] > pathlength)[:,None] |
+                        (tabu_until[members[s1]] > pathlength)[None,:])
+                scores[tabu & (scores >= best_score - 1e-12)] = np.inf
+                i0, i1 = np.unravel_index(np.argmin(scores), scores.shape)
+                if scores[i0,i1] < np.inf and (move is None or scores[i0,i1] < move[0]):
+                    move = (scores[i0,i1], s0, s1, i0, i1)
+            if move is None:
+                break
+            score, s0, s1, i0, i1 = move
+            c0, c1 = members[s0][i0], members[s1][i1]
+            d = self.cumcounts[c1] - self.cumcounts[c0]
+            CS[s0] += d
+            CS[s1] -= d
+            members[s0][i0], members[s1][i1] = c1, c0
+            assignment[c0], assignment[c1] = s1, s0
+            pathlength += 1
+            tabu_until[[c0,c1]] = pathlength + tenure
+            if score < best_score - 1e-12:
+                best_score, best_assignment = score, assignment.copy()
+                print('Tabu step %d: new best %g'%(pathlength,best_score))
+        print('Tabu: %d evaluations, %d swaps, best %g'%(budget.evaluations,pathlength,best_score))
+        delta = self.print_differences(original, best_assignment)
+        print('Tabu search changed:',delta)
+        return best_score, best_assignment, pathlength
+
+ENGINES = { 'sorted':Score_Cache, 'histogram':Histogram_Score_Cache, 'batch':Batch_Score_Cache }
+
+# Search methods: 'descent' is available in every engine, 'anneal' in histogram and batch,
+# 'tabu' in batch.  The budgeted searches are called as method(assignment, rng, **search_options).
+SEARCHES = { 'descent':'neighbor_search', 'anneal':'anneal_search', 'tabu':'tabu_search' }
+
+def restart_seed(seed, i_restart):
+    '''
+    Derive the seed of restart number i_restart from the seed of the whole search,
+    so that each restart is reproducible no matter which process runs it.
+    '''
+    return int(np.random.SeedSequence(seed, spawn_key=(i_restart,)).generate_state(1)[0])
+
+def run_restart(score_cache, seed, search='descent', search_options=None):
+    '''
+    Run one random restart: a random assignment followed by a search.
+    @param:
+    score_cache: one of the ENGINES
+    seed (int): seed of this restart
+    search (str): a key of SEARCHES
+    search_options (dict): keyword arguments of a budgeted search, e.g., max_seconds
+    @return:
+    score, assignment, pathlength: as returned by the search
+    report (str): score cache statistics for this restart, or None if the engine has no score cache
+    '''
+    rng = random.Random(seed)
+    assignment = score_cache.randomly_assign(rng)
+    method = getattr(score_cache, SEARCHES[search], None)
+    if method == None:
+        raise RuntimeError('%s does not support the %s search'%(type(score_cache).__name__, search))
+    if search == 'descent':
+        score, assignment, pathlength = method(assignment)
+    else:
+        score, assignment, pathlength = method(assignment, rng, **(search_options or {}))
+    report = None
+    if score_cache.cache is not None:
+        report = score_cache.cache.report()
+        score_cache.cache.reset_stats()
+    return score, assignment, pathlength, report
+
+# Each worker process of a parallel search builds its own score cache, once
+_worker_score_cache = None
+
+def _init_restart_worker(engine, args, engine_options):
+    global _worker_score_cache
+    _worker_score_cache = ENGINES[engine](*args, **engine_options)
+
+def _run_restart_in_worker(args):
+    return run_restart(_worker_score_cache, *args)
+
+def insert_in_beam(score_cache, best_scores, best_assignments, score, assignment):
+    '''
+    Insert a search result into the beam of best distinct results, if it is good enough.
+    @return:
+    changed (bool): True if the beam changed
+    '''
+    changed = False
+    for i_sc in range(len(best_scores)): 
+        if score_cache.same_assignment(assignment, best_assignments[i_sc]):
+            break # We already had this assignment - no need to store it again
+        if score < best_scores[i_sc]:  # Otherwise, if it's better than i'th best, store it
+            best_scores[i_sc], score = score, best_scores[i_sc]
+            best_assignments[i_sc], assignment = assignment, best_assignments[i_sc]
+            changed = True
+    return changed
+
+def write_json_atomically(filename, obj, indent=2):
+    '''
+    Write obj to a temporary file, then rename it to filename,
+    so that filename always contains either the old or the new content.
+    '''
+    with open(filename+'.tmp', 'w') as f:
+        json.dump(obj, f, indent=indent)
+    os.replace(filename+'.tmp', filename)
+
+def search_settings(feature, num_new, prev, unassigned, beamwidth, engine, engine_options, search, search_options):
+    '''
+    Everything, other than the seed, that determines the result of each restart of search_with_restarts.
+    The input data is represented by the sha1 of its JSON encoding.
+    @return:
+    settings (dict): as stored in a checkpoint (after a JSON round trip, so that it compares equal)
+    '''
+    data = json.dumps([ feature, num_new, prev, list(unassigned) ], sort_keys=True)
+    return json.loads(json.dumps({
+        'data_sha1': hashlib.sha1(data.encode('utf-8')).hexdigest(),
+        'beamwidth': beamwidth,
+        'engine': engine,
+        'engine_options': engine_options,
+        'search': search,
+        'search_options': search_options
+    }, sort_keys=True))
+
+def save_checkpoint(checkpoint, score_cache, seed, n_done, best_scores, best_assignments, settings):
+    '''
+    Save the state of search_with_restarts.  Restart i is seeded with restart_seed(seed, i),
+    so seed and n_done are the whole random number generator state of the search.
+    @param:
+    checkpoint (str): JSON file
+    score_cache: the engine, used to convert assignments to lists of contributor IDs
+    seed (int): seed of the whole search
+    n_done (int): number of restarts that have finished
+    best_scores, best_assignments (lists): the beam
+    settings (dict): as returned by search_settings
+    '''
+    write_json_atomically(checkpoint, {
+        'settings': settings,
+        'seed': seed,
+        'n_done': n_done,
+        'best_scores': [ float(x) for x in best_scores ],
+        'best_assignments': [ None if a is None else [ list(split) for split in score_cache.to_tuples(a) ]
+                              for a in best_assignments ]
+    })
+
+def load_checkpoint(checkpoint, score_cache, settings, seed=None):
+    '''
+    Raise RuntimeError if the checkpoint was saved by a search with different settings or seed.
+    @param:
+    settings (dict): settings of the search to be resumed, as returned by search_settings
+    seed (int): seed of the search to be resumed, or None to use the seed of the checkpoint
+    @return:
+    seed (int), n_done (int), best_scores (list), best_assignments (list): as saved by save_checkpoint
+    '''
+    with open(checkpoint) as f:
+        state = json.load(f)
+    saved = state.get('settings', {})
+    differences = sorted(k for k in set(settings) | set(saved) if settings.get(k) != saved.get(k))
+    if seed != None and seed != state['seed']:
+        differences.append('seed')
+    if len(differences) > 0:
+        raise RuntimeError('Cannot resume: %s was saved by a search with a different %s'%(
+            checkpoint, ', '.join(differences)))
+    best_assignments = [ None if a is None else score_cache.from_tuples(a) for a in state['best_assignments'] ]
+    return state['seed'], state['n_done'], state['best_scores'], best_assignments
+
+def search_with_restarts(feature, num_new, prev, unassigned, beamwidth, n_restarts, engine='batch',
+                         cache_size=100000, nworkers=1, seed=None, engine_options=None,
+                         search='descent', search_options=None, checkpoint=None, checkpoint_every=1,
+                         resume=False):
     '''
     Randomly restart the coordinate search <n_restarts> times.
     Return a list of the <beamdwidth> best distinct endpoints of those searches.
+    Restart number i is seeded with restart_seed(seed, i), so that the result is the same
+    whether the restarts are run serially or in parallel.
 
     @param:
     feature (dict) - feature[dimension_description][contributor_id] is an integer rating
@@ -227,34 +891,109 @@ def search_with_restarts(feature, num_new, prev, unassigned, beamwidth, n_restar
     unassigned (list) - a list of contributor IDs that exist in feature but not in prev
     beamwidth (int) - number of distinct search optima to store and return
     n_restarts (int) - number of times to restart the search
+    engine (str) - 'sorted' to use Score_Cache, 'histogram' to use Histogram_Score_Cache,
+      'batch' to use Batch_Score_Cache
+    cache_size (int) - capacity of the score cache of the 'sorted' engine; its statistics are printed
+      after each restart.  The histogram and batch engines have no score cache.
+    nworkers (int) - number of processes that run restarts concurrently
+    seed (int) - seed of the whole search; if None, a seed is chosen at random and printed
+    engine_options (dict) - extra keyword arguments of the engine, e.g., {'move':'first'} for 'batch'
+    search (str) - 'descent' (coordinate descent), 'anneal' or 'tabu'; see SEARCHES
+    search_options (dict) - budget and parameters of anneal or tabu, e.g., {'max_seconds':60};
+      the budget applies to each restart
+    checkpoint (str) - JSON file in which to save the seed, number of finished restarts, and beam,
+      or None for no checkpoints
+    checkpoint_every (int) - save the checkpoint after every checkpoint_every restarts, and at the end
+    resume (bool) - if True, continue the search saved in checkpoint, which must have been saved by a search
+      with the same data and settings; seed may be None, to use the seed of the checkpoint
 
-    @return:
+    @yield:
     outputdicts (list) - list of dictionaries of the type created by 
       score_cache.create_output_dict.  If fewer than beamwidth distinct endpoints are returned,
       then len(outputdicts) will equal the number of distinct endpoints.
+      A new list is yielded only after a restart that changed the beam.
     '''
-    best_scores = [np.inf]*beamwidth
-    best_assignments = [None]*beamwidth
-    score_cache = Score_Cache(feature, num_new, prev, unassigned)
-    for i_restart in range(n_restarts):
-        assignment = score_cache.randomly_assign()
-        score, assignment, pathlength = score_cache.neighbor_search(assignment)
-        for i_sc in range(len(best_scores)): 
-            if assignment == best_assignments[i_sc]:
-                break # We already had this assignment - no need to store it again
-            if score < best_scores[i_sc]:  # Otherwise, if it's better than i'th best, store it
-                best_scores[i_sc], score = score, best_scores[i_sc]
-                best_assignments[i_sc], assignment = assignment, best_assignments[i_sc]
-        print('Restart %d: %g after %d iterations'%(i_restart,best_scores[0],pathlength))
+    if engine_options == None:
+        engine_options = {}
+    settings = search_settings(feature, num_new, prev, unassigned, beamwidth, engine, engine_options,
+                               search, search_options)
+    if engine == 'sorted':
+        engine_options = dict(engine_options, cache_size=cache_size)
+    args = (feature, num_new, prev, unassigned)
+    score_cache = ENGINES[engine](*args, **engine_options)
+    if resume:
+        if checkpoint == None or not os.path.exists(checkpoint):
+            raise RuntimeError('Cannot resume: checkpoint %s does not exist'%(checkpoint))
+        seed, n_done, best_scores, best_assignments = load_checkpoint(checkpoint, score_cache, settings, seed)
+        print('Resuming from %s after %d restarts, best score %g'%(checkpoint, n_done, best_scores[0]))
+    else:
+        n_done = 0
+        best_scores = [np.inf]*beamwidth
+        best_assignments = [None]*beamwidth
+        if seed == None:
+            seed = random.randrange(2**32)
+    print('Search seed: %d'%(seed))
+    seeds = [ restart_seed(seed, i_restart) for i_restart in range(n_done, n_restarts) ]
+    if nworkers <= 1:
+        pool = None
+        results = (run_restart(score_cache, s, search, search_options) for s in seeds)
+    else:
+        pool = multiprocessing.Pool(nworkers, initializer=_init_restart_worker,
+                                    initargs=(engine, args, engine_options))
+        results = pool.imap(_run_restart_in_worker, [ (s, search, search_options) for s in seeds ])
+    try:
+        for i_restart, (score, assignment, pathlength, report) in enumerate(results, start=n_done):
+            changed = insert_in_beam(score_cache, best_scores, best_assignments, score, assignment)
+            print('Restart %d: %g after %d iterations'%(i_restart,best_scores[0],pathlength))
+            if report is not None:
+                print('Restart %d cache: %s'%(i_restart,report))
         
-        outputdicts = []
-        for i_b in range(beamwidth):
-            if best_assignments[i_b]:
-                outputdicts.append(score_cache.create_output_dict(best_assignments[i_b],best_scores[i_b]))
-        yield outputdicts
+            if changed:
+                outputdicts = []
+                for i_b in range(beamwidth):
+                    if best_assignments[i_b] is not None:
+                        outputdicts.append(score_cache.create_output_dict(best_assignments[i_b],best_scores[i_b]))
+                yield outputdicts
+
+            if checkpoint != None and ((i_restart+1-n_done) % checkpoint_every == 0 or i_restart+1 == n_restarts):
+                save_checkpoint(checkpoint, score_cache, seed, i_restart+1, best_scores, best_assignments, settings)
+    finally:
+        if pool != None:
+            pool.terminate()
 
 
-def main(datadir, prevsplitfile, beamwidth, n_restarts, outputfile):
+def contributor_ratings(contributor):
+    '''
+    Extract the ratings from one contributor's JSON data.
+    This is applied inside the corpusloader worker processes.
+    @param:
+    contributor (dict): content of one contributor JSON file
+    @return:
+    contributor_id (str): the contributor ID
+    ratings (list): list of (dimension_description, level) pairs, level is a str
+    '''
+    ratings = [ (rating['Dimension Description'], rating['Level'])
+                for utterance in contributor['Files'] if 'Ratings' in utterance
+                for rating in utterance['Ratings'] ]
+    return contributor['Contributor ID'], ratings
+
+def cached_ratings(columns):
+    '''
+    Extract the ratings of every contributor from the columns of a corpuscache.
+    @param:
+    columns (dict): as returned by corpuscache.update_cache
+    @return:
+    contributors (list): list of (contributor_id, ratings) pairs, as returned by contributor_ratings
+    '''
+    ratings = { c:[] for c in columns['contributor'] }
+    rating_contributors = columns['contributor'][columns['rating_utterance']]
+    for c, dimension, level in zip(rating_contributors, columns['rating_dimension'], columns['rating_level']):
+        ratings[c].append((dimension, level))
+    return list(ratings.items())
+
+def main(datadir, prevsplitfile, beamwidth, n_restarts, outputfile, nworkers=1, cachedir=None,
+         engine='batch', cache_size=100000, restart_workers=1, seed=None, move='best',
+         search='descent', search_options=None, checkpoint=None, checkpoint_every=1, resume=False):
     '''
     Create and return a new train/dev/test split based on previous splits.
     @param:
@@ -264,24 +1003,34 @@ def main(datadir, prevsplitfile, beamwidth, n_restarts, outputfile):
     n_restarts (int): number of times to randomly restart best-neighbor descent
     outputfile (str): output filenames are constructed from this by adding integers,
       e.g., 0 is added to best result, 1 is added to second-best, et cetera.
+    nworkers (int): number of processes used to read the contributor JSON files
+    cachedir (str): columnar cache of the ratings (see corpuscache), or None to parse every JSON file
+    engine (str): scoring engine, a key of ENGINES
+    cache_size (int): maximum number of assignment scores kept in the score cache ('sorted' engine only)
+    restart_workers (int): number of processes that run random restarts concurrently
+    seed (int): seed of the search, or None to choose one at random
+    move (str): with the batch engine, 'best' or 'first' improving swap at each step
+    search (str): 'descent', 'anneal' or 'tabu'
+    search_options (dict): budget and parameters of anneal or tabu (see search_with_restarts)
+    checkpoint (str): checkpoint file of the search, or None
+    checkpoint_every (int): number of restarts between checkpoints
+    resume (bool): continue the search saved in checkpoint
     '''
 
     # Read the ratings from speaker data files
     # feature[dimension_description][contributor_id] = list of integer scores
     jsonfiles = glob.glob(os.path.join(datadir, '*', '*.json'))
     feature = {}
-    for jsonfile in jsonfiles:
-        with open(jsonfile) as f:
-            contributor = json.load(f)
-            contributor_id = contributor['Contributor ID']
-            for utterance in contributor['Files']:
-                if 'Ratings' in utterance:
-                    for rating in utterance['Ratings']:
-                        dimension_description = rating['Dimension Description']
-                        if dimension_description not in feature:
-                            feature[dimension_description] = collections.defaultdict(list)
-                        if rating['Level'].isnumeric():
-                            feature[dimension_description][contributor_id].append(int(rating['Level']))
+    if cachedir is None:
+        contributors = corpusloader.load_jsonfiles(jsonfiles, nworkers, extract=contributor_ratings)
+    else:
+        contributors = cached_ratings(corpuscache.update_cache(cachedir, jsonfiles, nworkers))
+    for contributor_id, ratings in contributors:
+        for dimension_description, level in ratings:
+            if dimension_description not in feature:
+                feature[dimension_description] = collections.defaultdict(list)
+            if level.isnumeric():
+                feature[dimension_description][contributor_id].append(int(level))
                             
     #print('%d dimension descriptions found:'%(len(feature)))
     #print({x:len(y) for (x,y) in feature.items()})
@@ -323,13 +1072,16 @@ def main(datadir, prevsplitfile, beamwidth, n_restarts, outputfile):
 
     print('Will assign %d, %d, %d, for total of %d, %d, %d in train, dev, test'%(num_new['train'],num_new['dev'],num_new['test'],target_int[0],target_int[1],target_int[2]))
 
-    for outputdicts in search_with_restarts(feature, num_new, prev, unassigned, beamwidth, n_restarts):
+    for outputdicts in search_with_restarts(feature, num_new, prev, unassigned, beamwidth, n_restarts,
+                                            engine, cache_size, restart_workers, seed,
+                                            {'move':move} if engine=='batch' else {},
+                                            search, search_options, checkpoint, checkpoint_every,
+                                            resume):
         print('RESULT: %d restarts, beam=%d, %d distinct outputs'%(n_restarts,beamwidth,len(outputdicts)))
 
         (outputbase, outputext) = os.path.splitext(outputfile)
         for filenum in range(len(outputdicts)):
-            with open("%s%d%s"%(outputbase,filenum,outputext), 'w') as f:
-                json.dump(outputdicts[filenum], f, indent=2)
+            write_json_atomically("%s%d%s"%(outputbase,filenum,outputext), outputdicts[filenum])
               
 ################################################################################################
 # Command line arguments
@@ -353,6 +1105,39 @@ if __name__ == "__main__":
                         For example: newsplit0.json, newsplit1.json, newsplit2.json
                         will be JSON-encodings of the best, second, and third-best splits found.
                         ''')
+    parser.add_argument('-j','--nworkers', type=int, default=1,
+                        help = 'Number of processes used to read the contributor JSON files')
+    parser.add_argument('--cachedir', default=None,
+                        help = 'Columnar cache of the corpus; only changed JSON files are parsed')
+    parser.add_argument('-e','--engine', default='batch', choices=list(ENGINES.keys()),
+                        help = '''Scoring engine: sorted re-sorts every split for every neighbor,
+                        histogram updates per-split rating histograms in O(levels) per swap,
+                        batch scores all swaps at once with numpy array operations''')
+    parser.add_argument('--move', default='best', choices=['best','first'],
+                        help = 'With the batch engine: make the best, or the first, improving swap')
+    parser.add_argument('-S','--search', default='descent', choices=list(SEARCHES.keys()),
+                        help = '''descent: coordinate descent from each restart;
+                        anneal: simulated annealing (histogram or batch engine);
+                        tabu: tabu search (batch engine).  anneal and tabu need a budget''')
+    parser.add_argument('-t','--time_budget', type=float, default=None,
+                        help = 'anneal/tabu: wall-clock seconds per restart')
+    parser.add_argument('--eval_budget', type=int, default=None,
+                        help = 'anneal/tabu: number of assignments scored per restart')
+    parser.add_argument('--tenure', type=int, default=10,
+                        help = 'tabu: number of steps for which a moved contributor cannot move again')
+    parser.add_argument('--cache_size', type=int, default=100000,
+                        help = 'sorted engine: maximum number of assignment scores kept in the LRU score cache')
+    parser.add_argument('-w','--restart_workers', type=int, default=1,
+                        help = 'Number of processes that run random restarts concurrently')
+    parser.add_argument('-s','--seed', type=int, default=None,
+                        help = 'Seed of the search; each restart derives its own seed from it')
+    parser.add_argument('--checkpoint', default=None,
+                        help = '''Checkpoint file of the search (seed, finished restarts, beam).
+                        Default: the outputfile name with _checkpoint added before the extension''')
+    parser.add_argument('--checkpoint_every', type=int, default=1,
+                        help = 'Number of restarts between checkpoints')
+    parser.add_argument('--resume', action='store_true',
+                        help = 'Continue the search saved in the checkpoint file, which must come from the same data and settings')
 
     args   = parser.parse_args()
     if not args.datadir:
@@ -360,5 +1145,13 @@ if __name__ == "__main__":
     if not args.prevsplit:
         print('You did not specify any previous split, so I will design a split from scratch')
         
+    if args.checkpoint == None:
+        (outputbase, outputext) = os.path.splitext(args.outputfile)
+        args.checkpoint = outputbase + '_checkpoint' + outputext
+    search_options = { 'max_seconds':args.time_budget, 'max_evaluations':args.eval_budget }
+    if args.search == 'tabu':
+        search_options['tenure'] = args.tenure
     main(args.datadir, args.prevsplit, int(args.beamwidth),
-         int(args.n_restarts), args.outputfile)
+         int(args.n_restarts), args.outputfile, args.nworkers, args.cachedir,
+         args.engine, args.cache_size, args.restart_workers, args.seed, args.move,
+         args.search, search_options, args.checkpoint, args.checkpoint_every, args.resume)
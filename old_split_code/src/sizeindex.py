@@ -0,0 +1,127 @@
+import os, json, argparse, sys
+from concurrent.futures import ThreadPoolExecutor
+"""
+Index of the number of bytes and files in each contributor directory of a release
+(datadir/split/contributor_id/...), for archive planning and release reports.
+
+Directories are walked with os.scandir, using the stat data of each directory entry,
+by a pool of threads.  The index is cached in a JSON file with the mtime of each
+contributor directory and of every subdirectory under it; on later runs only contributors
+with a directory whose mtime changed are walked again.
+A directory's mtime changes when files are added, removed or renamed in it, but not when an
+existing file is rewritten in place, so use refresh=True after in-place edits.
+Symbolic links to files are followed, since the archives store the files they point to.
+"""
+
+def scan_contributor(idpath):
+    '''
+    @return:
+    nbytes (int): total size of the files under idpath, including subdirectories
+    nfiles (int): number of files under idpath
+    dirs (dict): dirs[relpath] = mtime_ns of each subdirectory under idpath
+    '''
+    nbytes, nfiles, dirs, stack = 0, 0, {}, [idpath]
+    while len(stack) > 0:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs[os.path.relpath(entry.path, idpath)] = entry.stat(follow_symlinks=False).st_mtime_ns
+                    stack.append(entry.path)
+                else:
+                    nbytes += entry.stat().st_size   # a symlinked file counts as the file it points to
+                    nfiles += 1
+    return nbytes, nfiles, dirs
+
+def is_unchanged(idpath, mtime_ns, cached):
+    '''
+    @return:
+    unchanged (bool): True if idpath and all of its subdirectories have the mtimes recorded in cached
+    '''
+    if cached is None or cached['mtime_ns'] != mtime_ns or 'dirs' not in cached:
+        return False
+    try:
+        return all(os.stat(os.path.join(idpath, x)).st_mtime_ns == m for x, m in cached['dirs'].items())
+    except FileNotFoundError:
+        return False
+
+def read_size_index(cachefile):
+    '''
+    @return:
+    index (dict): index[idpath] = { 'mtime_ns', 'bytes', 'files', 'dirs' }; empty if cachefile does not exist
+    '''
+    if cachefile is None or not os.path.exists(cachefile):
+        return {}
+    with open(cachefile) as f:
+        return json.load(f)
+
+def update_size_index(datadir, cachefile=None, nworkers=8, refresh=False):
+    '''
+    @param:
+    datadir (str): directory containing split subdirectories, each containing
+      one subdirectory per contributor
+    cachefile (str): JSON cache of the index; rewritten if not None
+    nworkers (int): number of threads walking contributor directories
+    refresh (bool): walk every directory, even if its mtime has not changed
+
+    @return:
+    index (dict): index[idpath] = { 'mtime_ns', 'bytes', 'files', 'dirs' }, for every contributor directory,
+      where dirs is as returned by scan_contributor
+    '''
+    cache = {} if refresh else read_size_index(cachefile)
+    index, stale = {}, []
+    with os.scandir(datadir) as splits:
+        splitpaths = sorted(entry.path for entry in splits if entry.is_dir())
+    for splitpath in splitpaths:
+        with os.scandir(splitpath) as it:
+            for entry in it:
+                if entry.is_dir():
+                    mtime_ns = entry.stat().st_mtime_ns
+                    cached = cache.get(entry.path)
+                    if is_unchanged(entry.path, mtime_ns, cached):
+                        index[entry.path] = cached
+                    else:
+                        stale.append((entry.path, mtime_ns))
+    with ThreadPoolExecutor(max_workers=max(1,nworkers)) as pool:
+        for (idpath, mtime_ns), (nbytes, nfiles, dirs) in zip(stale, pool.map(scan_contributor, [ x[0] for x in stale ])):
+            index[idpath] = { 'mtime_ns':mtime_ns, 'bytes':nbytes, 'files':nfiles, 'dirs':dirs }
+    print('%d contributor directories, %d walked, %d from cache'%(len(index), len(stale), len(index)-len(stale)))
+    index = { idpath:index[idpath] for idpath in sorted(index) }
+    if cachefile is not None:
+        tmpfile = cachefile + '.tmp'
+        with open(tmpfile, 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmpfile, cachefile)
+    return index
+
+def split_report(index, datadir):
+    '''
+    Print the number of contributors, files and GB in each split.
+    '''
+    totals = {}
+    for idpath, entry in index.items():
+        split = os.path.relpath(idpath, datadir).split(os.sep)[0]
+        t = totals.setdefault(split, [0, 0, 0])
+        t[0] += 1
+        t[1] += entry['files']
+        t[2] += entry['bytes']
+    for split in sorted(totals):
+        print('%-10s %6d contributors %9d files %10.2f GB'%(split, totals[split][0], totals[split][1], totals[split][2]/2**30))
+
+################################################################################################
+# Command line arguments
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description     = 'Report the size of each split and contributor directory of a release',
+        formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('datadir',help = 'Directory containing split subdirs, each containing contributor subdirs')
+    parser.add_argument('-c','--cache',default=None,
+                        help = 'JSON size index; only directories whose mtime changed are walked again')
+    parser.add_argument('-j','--nworkers',type=int,default=8,
+                        help = 'Number of threads walking contributor directories')
+    parser.add_argument('--refresh',action='store_true',
+                        help = 'Walk every directory, even if its mtime has not changed')
+
+    args   = parser.parse_args()
+    split_report(update_size_index(args.datadir, args.cache, args.nworkers, args.refresh), args.datadir)
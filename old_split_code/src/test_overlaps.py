@@ -76,6 +76,18 @@ def main(jsonfile1, jsonfile2, logfile):
                 if utt not in utt2subset1:
                     inserted[k].append(utt)
 
+    report_delta(inserted, deleted, substituted, logfile)
+
+def report_delta(inserted, deleted, substituted, logfile):
+    '''
+    Print a change summary to stdout, and save the changed file lists to logfile.
+
+    @param:
+    inserted (dict): inserted[subset] = list of utterances that are new in subset
+    deleted (dict): deleted[subset] = list of utterances that were in subset, and are now gone
+    substituted (dict): substituted[old_subset][new_subset] = list of utterances that moved
+    logfile (str): JSON file in which to save the lists
+    '''
     if len(deleted) > 0:
         print('DELETED:')
         for k in deleted:
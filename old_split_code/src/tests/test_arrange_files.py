@@ -0,0 +1,114 @@
+import unittest, tempfile, shutil, os, json, hashlib
+from unittest import mock
+import arrange_files, sizeindex, archivers
+
+class ContributorDirs(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmpdir, 'src')
+        self.tgt = os.path.join(self.tmpdir, 'tgt')
+        for contributor in ['A','B']:
+            os.makedirs(os.path.join(self.src, contributor))
+            for i in range(3):
+                with open(os.path.join(self.src, contributor, '%s_%d.wav'%(contributor,i)), 'wb') as f:
+                    f.write(os.urandom(1000+i))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertSameFiles(self, contributor):
+        for filename in os.listdir(os.path.join(self.src, contributor)):
+            with open(os.path.join(self.src, contributor, filename),'rb') as f:
+                expected = f.read()
+            with open(os.path.join(self.tgt, contributor, filename),'rb') as f:
+                self.assertEqual(f.read(), expected, msg=filename)
+
+class TestTransferManifest(ContributorDirs):
+    def test_partial_copy_is_resumed(self):
+        arrange_files.copy_contributors(['A','B'], self.src, self.tgt, 'x.json', nworkers=2)
+        manifestfile = os.path.join(self.tgt, 'transfer_manifest.jsonl')
+        self.assertEqual(sorted(arrange_files.read_transfer_manifest(manifestfile)), ['A','B'])
+        # simulate a crash in the middle of copying B
+        with open(manifestfile) as f:
+            lines = [ x for x in f if '"contributor": "B"' not in x ]
+        with open(manifestfile,'w') as f:
+            f.write(''.join(lines) + '{"contributor": "B", "fi')
+        with open(os.path.join(self.tgt,'B','B_2.wav'),'r+b') as f:
+            f.truncate(10)
+        os.remove(os.path.join(self.tgt,'B','B_0.wav'))
+        arrange_files.copy_contributors(['A','B'], self.src, self.tgt, 'x.json', nworkers=2)
+        self.assertSameFiles('B')
+        self.assertEqual(len(arrange_files.read_transfer_manifest(manifestfile)['B']), 3)
+
+    def test_hash_verification_of_complete_contributor(self):
+        arrange_files.copy_contributors(['A'], self.src, self.tgt, 'x.json')
+        path = os.path.join(self.tgt,'A','A_1.wav')
+        with open(path,'r+b') as f:
+            f.write(b'corrupt')   # same size, different content
+        arrange_files.copy_contributors(['A'], self.src, self.tgt, 'x.json', verify='size')
+        with open(path,'rb') as f:
+            self.assertEqual(f.read(7), b'corrupt')
+        arrange_files.copy_contributors(['A'], self.src, self.tgt, 'x.json', verify='hash')
+        self.assertSameFiles('A')
+
+    def test_files_are_hashed_while_copied(self):
+        with mock.patch.object(arrange_files, 'sha1', side_effect=AssertionError('file read twice')):
+            arrange_files.copy_contributors(['A'], self.src, self.tgt, 'x.json')
+            arrange_files.copy_contributors(['A'], self.src, self.tgt, 'x.json', verify='size')
+        self.assertSameFiles('A')
+        files = arrange_files.read_transfer_manifest(os.path.join(self.tgt, 'transfer_manifest.jsonl'))['A']
+        for relpath, (size, digest) in files.items():
+            with open(os.path.join(self.src, 'A', relpath),'rb') as f:
+                self.assertEqual(digest, hashlib.sha1(f.read()).hexdigest())
+            self.assertEqual(os.stat(os.path.join(self.src, 'A', relpath)).st_mtime_ns,
+                             os.stat(os.path.join(self.tgt, 'A', relpath)).st_mtime_ns)
+
+class TestLinkModes(ContributorDirs):
+    def test_hardlink(self):
+        arrange_files.copy_contributors(['A'], self.src, self.tgt, 'x.json', mode='hardlink')
+        self.assertSameFiles('A')
+        for filename in os.listdir(os.path.join(self.src,'A')):
+            self.assertTrue(os.path.samefile(os.path.join(self.src,'A',filename), os.path.join(self.tgt,'A',filename)))
+
+    def test_symlink(self):
+        arrange_files.copy_contributors(['A'], self.src, self.tgt, 'x.json', mode='symlink')
+        self.assertSameFiles('A')
+        for filename in os.listdir(os.path.join(self.src,'A')):
+            path = os.path.join(self.tgt,'A',filename)
+            self.assertTrue(os.path.islink(path))
+            self.assertEqual(os.readlink(path), os.path.abspath(os.path.join(self.src,'A',filename)))
+
+    def test_reflink(self):
+        # on filesystems without reflinks, this falls back to an ordinary copy
+        arrange_files.copy_contributors(['A'], self.src, self.tgt, 'x.json', mode='reflink')
+        self.assertSameFiles('A')
+        for filename in os.listdir(os.path.join(self.src,'A')):
+            path = os.path.join(self.tgt,'A',filename)
+            self.assertFalse(os.path.islink(path))
+            self.assertFalse(os.path.samefile(os.path.join(self.src,'A',filename), path))
+
+    def test_symlinked_release_is_archived_with_contents(self):
+        release = os.path.join(self.tmpdir, 'release')
+        arrange_files.copy_contributors(['A','B'], self.src, os.path.join(release,'Train'), 'x.json', mode='symlink')
+        os.remove(os.path.join(release,'Train','x.json'))
+        os.remove(os.path.join(release,'Train','transfer_manifest.jsonl'))
+        index = sizeindex.update_size_index(release)
+        self.assertEqual(index[os.path.join(release,'Train','A')]['bytes'], 3000+0+1+2)
+        expected = {}
+        for contributor in ['A','B']:
+            for filename in os.listdir(os.path.join(self.src, contributor)):
+                with open(os.path.join(self.src, contributor, filename),'rb') as f:
+                    expected['Train/%s/%s'%(contributor,filename)] = f.read()
+        for writer_class in archivers.BACKENDS.values():
+            path = os.path.join(self.tmpdir, 'release'+writer_class.extension)
+            writer = writer_class(path)
+            for contributor in ['A','B']:
+                writer.add(os.path.join(release,'Train',contributor), os.path.join('Train',contributor))
+            writer.close()
+            outdir = os.path.join(self.tmpdir, 'out'+writer_class.extension)
+            names = archivers.extract(path, outdir)
+            self.assertEqual(sorted(names), sorted(expected))
+            for name in names:
+                self.assertFalse(os.path.islink(os.path.join(outdir, name)), msg=name)
+                with open(os.path.join(outdir, name),'rb') as f:
+                    self.assertEqual(f.read(), expected[name], msg=name)
@@ -0,0 +1,132 @@
+import unittest, os, json, tempfile, shutil
+import corpusloader, corpuscache
+
+def write_fake_contributors(datadir, ncontributors, nfiles=5):
+    '''
+    Write ncontributors small contributor JSON files into datadir/contributor_id/
+    '''
+    for n in range(ncontributors):
+        contributor_id = 'C%04d'%(n)
+        os.makedirs(os.path.join(datadir,contributor_id), exist_ok=True)
+        contributor = {
+            'Contributor ID': contributor_id,
+            'Etiology': ['ALS','Stroke'][n % 2],
+            'Files': [ {
+                'Filename': '%s_%d.wav'%(contributor_id.lower(),i),
+                'Prompt': {
+                    'Prompt Text': 'prompt %d'%(i),
+                    'Transcript': 'prompt %d'%(i),
+                    'Category Description': 'Digital Assistant Commands',
+                    'Sub Category Description': ''
+                },
+                'Ratings': [ {'Level': str((n+i) % 5), 'Dimension Description': 'Intelligibility'} ]
+            } for i in range(nfiles) ]
+        }
+        with open(os.path.join(datadir,contributor_id,contributor_id+'.json'),'w') as f:
+            json.dump(contributor, f)
+
+class TestCorpusLoader(unittest.TestCase):
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        write_fake_contributors(self.datadir, 50)
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def test_parallel_matches_serial(self):
+        serial = corpusloader.load_corpus(self.datadir)
+        parallel = corpusloader.load_corpus(self.datadir, nworkers=3, chunksize=7)
+        self.assertEqual(len(serial), 50)
+        self.assertEqual(serial, parallel, msg='parallel and serial loaders disagree')
+
+    def test_extract(self):
+        jsonfiles = corpusloader.find_jsonfiles(self.datadir)
+        ids = corpusloader.load_jsonfiles(jsonfiles, nworkers=2, chunksize=5, extract=contributor_id)
+        self.assertEqual(ids, [ os.path.basename(os.path.dirname(x)) for x in jsonfiles ])
+
+def contributor_id(data):
+    return data['Contributor ID']
+
+class TestCorpusCache(unittest.TestCase):
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.datadir, 'cache')
+        write_fake_contributors(self.datadir, 20)
+        self.jsonfiles = corpusloader.find_jsonfiles(self.datadir)
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def test_roundtrip(self):
+        corpus = corpusloader.load_corpus(self.datadir)
+        columns = corpuscache.update_cache(self.cachedir, self.jsonfiles, nworkers=2, chunksize=4)
+        self.assertEqual(len(columns['filename']), 100)
+        self.assertEqual(corpuscache.columns_to_corpus(columns), corpus,
+                         msg='corpus reconstructed from the cache differs from the JSON files')
+
+    def test_cached_corpus_equals_parsed_corpus(self):
+        unusual = [
+            { 'Contributor ID':'E0', 'Etiology':'ALS', 'Files':[] },
+            { 'Contributor ID':'E1', 'Files':[ { 'Filename':'e1_0.wav' },
+                                              { 'Filename':'e1_1.wav', 'Prompt':{} } ] },
+            { 'Contributor ID':'E2', 'Etiology':None,
+              'Files':[ { 'Filename':'e2_0.wav', 'Prompt':{ 'Transcript':'', 'Prompt Text':None } } ] },
+            { 'Etiology':'', 'Files':[ { 'Filename':'e3_0.wav', 'Prompt':{ 'Transcript':'hello' } } ] },
+        ]
+        for n, contributor in enumerate(unusual):
+            os.makedirs(os.path.join(self.datadir, 'E%d'%(n)))
+            with open(os.path.join(self.datadir, 'E%d'%(n), 'E%d.json'%(n)), 'w') as f:
+                json.dump(contributor, f)
+        jsonfiles = corpusloader.find_jsonfiles(self.datadir)
+        parsed = corpusloader.load_jsonfiles(jsonfiles)
+        for rerun in range(2):
+            columns = corpuscache.update_cache(self.cachedir, jsonfiles)
+            bypath = corpuscache.columns_to_corpus(columns, key='jsonfile')
+            self.assertEqual([ bypath[os.path.abspath(x)] for x in jsonfiles ], parsed)
+        corpus = corpuscache.columns_to_corpus(columns)
+        self.assertEqual(corpus['E0'], unusual[0])
+        self.assertEqual(len(corpus), 24)
+
+    def test_old_cache_is_rebuilt(self):
+        os.makedirs(self.cachedir)
+        with open(os.path.join(self.cachedir, 'index.json'), 'w') as f:
+            json.dump({ os.path.abspath(self.jsonfiles[0]):{ 'shard':'0.npz', 'version':2 } }, f)
+        with open(os.path.join(self.cachedir, '0.npz'), 'wb') as f:
+            f.write(b'old shard')
+        columns = corpuscache.update_cache(self.cachedir, self.jsonfiles)
+        self.assertEqual(len(columns['filename']), 100)
+        self.assertEqual(sorted(os.listdir(self.cachedir)), ['index.json', 'store0'])
+
+    def test_only_changed_files_are_parsed(self):
+        corpuscache.update_cache(self.cachedir, self.jsonfiles)
+        old = corpuscache.load_columns(self.cachedir, self.jsonfiles[5:])
+        changed = self.jsonfiles[3]
+        with open(changed) as f:
+            data = json.load(f)
+        data['Files'] = data['Files'][:2]
+        with open(changed,'w') as f:
+            json.dump(data, f)
+        os.remove(self.jsonfiles[4])
+        index = corpuscache.read_index(self.cachedir)
+        stats, nparsed = corpuscache.index_jsonfiles(self.cachedir, self.jsonfiles[:4]+self.jsonfiles[5:], index)
+        self.assertEqual(nparsed, 1)
+        columns = corpuscache.update_cache(self.cachedir, self.jsonfiles[:4]+self.jsonfiles[5:])
+        self.assertEqual(len(columns['filename']), 100-3-5)
+        self.assertNotIn(os.path.abspath(self.jsonfiles[4]), corpuscache.read_index(self.cachedir)['row'])
+        self.assertEqual(sorted(os.listdir(self.cachedir)), ['index.json', 'store2'])
+        new = corpuscache.load_columns(self.cachedir, self.jsonfiles[5:])
+        for c in old:
+            self.assertEqual(list(old[c]), list(new[c]), msg='column %s of unchanged files differs'%(c))
+
+    def test_columns_of_a_selection(self):
+        corpuscache.update_cache(self.cachedir, self.jsonfiles)
+        selection = self.jsonfiles[7:2:-2]
+        columns = corpuscache.load_columns(self.cachedir, selection)
+        self.assertEqual(list(columns['json_path']), [ os.path.abspath(x) for x in selection ])
+        corpus = corpuscache.columns_to_corpus(columns, key='jsonfile')
+        self.assertEqual([ corpus[os.path.abspath(x)] for x in selection ], corpusloader.load_jsonfiles(selection))
+        fields = corpuscache.load_columns(self.cachedir, selection, fields=['transcript','json_etiology'])
+        self.assertNotIn('prompt', fields)
+        self.assertEqual(list(fields['transcript']), list(columns['transcript']))
+        self.assertEqual(list(fields['etiology']), list(columns['etiology']))
+        self.assertFalse(corpuscache.absent(fields['missing'], 'Transcript').any())
@@ -0,0 +1,57 @@
+import unittest, os, tempfile, shutil, random
+import pandas
+import SAPsplit
+
+def fake_contributor(contributor_id, listnum):
+    '''
+    Contributors on the same list read the same prompts, with some unique spontaneous speech.
+    '''
+    files = []
+    for i in range(12):
+        category = "Spontaneous Speech Prompts" if i >= 10 else "Digital Assistant Commands"
+        prompt = 'spontaneous %s %d'%(contributor_id,i) if i >= 10 else 'list %d prompt %d'%(listnum % 6,i)
+        files.append({ 'Filename':'%s_%d.wav'%(contributor_id.lower(),i),
+                       'Prompt':{ 'Prompt Text':prompt, 'Transcript':prompt,
+                                  'Category Description':category, 'Sub Category Description':'' } })
+    return { 'Contributor ID':contributor_id, 'Files':files }
+
+class TestIncremental(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.listfile = os.path.join(self.tmpdir, 'lists.xlsx')
+        random.seed(0)
+        self.lists = { 'C%03d'%(n):random.randint(1,10) for n in range(60) }
+        pandas.DataFrame({ 'ContributorId':list(self.lists.keys()),
+                           'ListName':[ 'List %d'%(n) for n in self.lists.values() ] }
+                         ).to_excel(self.listfile, index=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def full_split(self, corpus):
+        subset2contributors = SAPsplit.create_subset2contributors(self.listfile)
+        subset2wavfiles, wavfile2prompt = SAPsplit.assign_wavfiles(subset2contributors, corpus)
+        return SAPsplit.determine_sharing(subset2wavfiles, wavfile2prompt)
+
+    def test_update_matches_full_split(self):
+        old_ids = list(self.lists.keys())[:40]
+        old_corpus = { c:fake_contributor(c, self.lists[c]) for c in old_ids }
+        prev_files = self.full_split(old_corpus)
+        prev_contributors = { s:set(c for c in L if c in old_corpus)
+                              for s,L in SAPsplit.create_subset2contributors(self.listfile).items() }
+
+        corpus = { c:fake_contributor(c, self.lists[c]) for c in self.lists }
+        changed = corpus[old_ids[0]]
+        changed['Files'][0]['Prompt']['Transcript'] = 'a different transcript'
+        del corpus[old_ids[1]]['Files'][3]
+
+        subset2contributors, subset2files, delta = SAPsplit.update(corpus, prev_files,
+                                                                   prev_contributors, self.listfile)
+        self.assertEqual(subset2files, self.full_split(corpus))
+        self.assertEqual(delta['DELETED'], { SAPsplit.label_wavfiles(prev_files)[0][
+            old_ids[1].lower()+'_3.wav']:[old_ids[1].lower()+'_3.wav'] })
+        ninserted = sum(len(v) for v in delta['INSERTED'].values())
+        self.assertEqual(ninserted, 20*12)
+        for c in self.lists:
+            self.assertEqual(sum(c in L for L in subset2contributors.values()), 1,
+                             msg='%s should be in exactly one subset'%(c))
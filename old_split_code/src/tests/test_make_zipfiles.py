@@ -0,0 +1,89 @@
+import unittest, random, tempfile, shutil, os, tarfile, io, contextlib
+from unittest import mock
+import zstandard
+import make_zipfiles
+
+class TestPacking(unittest.TestCase):
+    def test_first_fit_decreasing(self):
+        rng = random.Random(0)
+        sizes = { 'C%03d'%(n):rng.randint(1,60) for n in range(200) }
+        ziplists = make_zipfiles.first_fit_decreasing(sizes, 100)
+        self.assertEqual(sorted(x for z in ziplists for x in z[1]), sorted(sizes))
+        for total, idpaths in ziplists:
+            self.assertLessEqual(total, 100)
+            self.assertEqual(total, sum(sizes[x] for x in idpaths))
+        lower_bound = -(-sum(sizes.values()) // 100)
+        self.assertLessEqual(len(ziplists), 11*lower_bound//9 + 1)
+
+    def test_oversized_directory_gets_its_own_archive(self):
+        ziplists = make_zipfiles.first_fit_decreasing({ 'big':150, 'a':60, 'b':40 }, 100)
+        self.assertEqual(ziplists, [ [150,['big']], [100,['a','b']] ])
+
+    def test_compression_threads_are_shared(self):
+        with mock.patch.object(os, 'cpu_count', return_value=16):
+            self.assertEqual(make_zipfiles.threads_per_archive(4), 4)
+            self.assertEqual(make_zipfiles.threads_per_archive(32), 1)
+            self.assertIsNone(make_zipfiles.threads_per_archive(1))
+            self.assertEqual(make_zipfiles.threads_per_archive(4, 8), 8)
+
+class TestPlan(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.planfile = os.path.join(self.tmpdir, 'release_archives.json')
+        self.zippattern = os.path.join(self.tmpdir, 'release%d.7z')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def plan(self, sizes):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return make_zipfiles.plan_archives(sizes, 100, self.planfile, '7z', self.zippattern)
+
+    def test_plan_follows_changed_sizes(self):
+        sizes = { 'a':60, 'b':40, 'c':50, 'd':30, 'e':20 }
+        self.assertEqual(self.plan(sizes), [ [100,['a','b']], [100,['c','d','e']] ])
+        open(self.zippattern%(0), 'w').close()  # archive 0 is already written
+        sizes = { 'a':60, 'b':45, 'c':80, 'd':30, 'f':25 }  # e was removed; b and c grew
+        ziplists = self.plan(sizes)
+        self.assertEqual(ziplists[0], [100,['a','b']])
+        for total, idpaths in ziplists[1:]:
+            self.assertLessEqual(total, 100)
+            self.assertEqual(total, sum(sizes[x] for x in idpaths))
+        self.assertEqual(ziplists[1:], [ [80,['c']], [55,['d','f']] ])
+        self.assertEqual(self.plan(sizes), ziplists)
+
+class TestResume(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.datadir = os.path.join(self.tmpdir, 'release')
+        self.idpaths = []
+        for n in range(4):
+            idpath = os.path.join(self.datadir, 'Train', 'C%d'%(n))
+            os.makedirs(idpath)
+            for i in range(3):
+                with open(os.path.join(idpath, 'f%d.wav'%(i)), 'wb') as f:
+                    f.write(os.urandom(1000*(n+1)))
+            self.idpaths.append(idpath)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def members(self, zipfilepath):
+        with open(zipfilepath, 'rb') as f:
+            data = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True).read()
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            return { m.name:tar.extractfile(m).read() for m in tar.getmembers() if m.isfile() }
+
+    def test_interrupted_tar_zst_resumes(self):
+        zipfilepath = os.path.join(self.tmpdir, 'release0.tar.zst')
+        with self.assertRaises(FileNotFoundError):  # interrupted after two contributors
+            make_zipfiles.write_archive(zipfilepath, self.idpaths[:2]+['missing'], self.datadir, 'tar.zst')
+        self.assertFalse(os.path.exists(zipfilepath))
+        with open(zipfilepath+'.tmp', 'ab') as f:   # bytes of an incomplete frame
+            f.write(b'partial')
+        self.assertEqual(make_zipfiles.write_archive(zipfilepath, self.idpaths, self.datadir, 'tar.zst'),
+                         (zipfilepath, 2))
+        fresh = os.path.join(self.tmpdir, 'fresh.tar.zst')
+        make_zipfiles.write_archive(fresh, self.idpaths, self.datadir, 'tar.zst')
+        self.assertEqual(self.members(zipfilepath), self.members(fresh))
+        self.assertEqual(len(self.members(zipfilepath)), 12)
@@ -0,0 +1,41 @@
+import unittest, random
+import numpy as np
+import near_duplicates, generate_fake_data, transcript_index
+
+def sentence(nwords):
+    return ' '.join(generate_fake_data.pseudoword() for i in range(nwords))
+
+class TestNearDuplicates(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.train = [ sentence(random.randint(6,12)) for i in range(500) ]
+        # transcripts corrupted the way a human reader's response is simulated
+        self.corrupted, self.source = [], []
+        while len(self.corrupted) < 50:
+            i = random.randrange(len(self.train))
+            transcript = generate_fake_data.type_dependent_corruption(['Novel Sentences','',self.train[i]])
+            if transcript != self.train[i]:
+                self.corrupted.append(transcript.upper()+'.')
+                self.source.append(i)
+        self.unrelated = [ sentence(random.randint(6,12)) for i in range(200) ]
+
+    def test_finds_corrupted_copies_only(self):
+        matches = near_duplicates.find_near_duplicates(self.corrupted+self.unrelated, self.train)
+        found = { q:r for q,r,s in matches }
+        for q in range(len(self.corrupted)):
+            self.assertIn(q, found, msg='missed near-copy %s'%(self.corrupted[q]))
+            self.assertEqual(self.train[found[q]], self.train[self.source[q]])
+        self.assertEqual([ q for q in found if q >= len(self.corrupted) ], [])
+
+    def test_signature_estimates_jaccard(self):
+        texts = [ near_duplicates.normalize_transcript(t) for t in [self.train[self.source[0]], self.corrupted[0]] ]
+        a, b = [ set(near_duplicates.shingle_hashes(t)) for t in texts ]
+        signatures = near_duplicates.minhash_signatures(texts, num_perm=512, chunk_elements=1000)
+        estimate = np.mean(signatures[0] == signatures[1])
+        self.assertAlmostEqual(estimate, len(a & b)/len(a | b), delta=0.1)
+
+    def test_same_normalization_as_exact_matches(self):
+        texts = [ "Don't stop\u2014now!", 'dont stop now', 'DON\'T  STOP...NOW', '\uff24on\'t stop now' ]
+        unique, inverse = near_duplicates.unique_texts(texts)
+        self.assertEqual(unique, [ 'dont stop now' ])
+        self.assertEqual(len(set(transcript_index.transcript_keys(texts))), 1)
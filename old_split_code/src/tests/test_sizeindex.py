@@ -0,0 +1,74 @@
+import unittest, tempfile, shutil, os, io, contextlib
+from unittest import mock
+import sizeindex
+
+class TestSizeIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.datadir = os.path.join(self.tmpdir, 'release')
+        self.cachefile = os.path.join(self.tmpdir, 'sizes.json')
+        for split, contributors in [ ('Train',['A','B']), ('Dev',['C']) ]:
+            for contributor in contributors:
+                os.makedirs(os.path.join(self.datadir, split, contributor, 'nested'))
+                self.write(os.path.join(split, contributor, contributor+'.json'), 10)
+                self.write(os.path.join(split, contributor, 'nested', contributor+'_0.wav'), 1000)
+        # old mtimes, so that any change is seen even on file systems with coarse timestamps
+        for dirpath, dirnames, filenames in os.walk(self.datadir):
+            os.utime(dirpath, ns=(0, 0))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, relpath, size):
+        with open(os.path.join(self.datadir, relpath), 'wb') as f:
+            f.write(b'x'*size)
+
+    def update(self, refresh=False):
+        '''
+        @return:
+        index (dict): as returned by update_size_index
+        walked (list): contributor directories that were walked
+        '''
+        with mock.patch.object(sizeindex, 'scan_contributor', wraps=sizeindex.scan_contributor) as scan:
+            with contextlib.redirect_stdout(io.StringIO()):
+                index = sizeindex.update_size_index(self.datadir, self.cachefile, 2, refresh)
+        return index, sorted(os.path.relpath(call.args[0], self.datadir) for call in scan.call_args_list)
+
+    def test_counts(self):
+        index, walked = self.update()
+        self.assertEqual(walked, [ os.path.join('Dev','C'), os.path.join('Train','A'), os.path.join('Train','B') ])
+        entry = index[os.path.join(self.datadir, 'Train', 'A')]
+        self.assertEqual((entry['files'], entry['bytes']), (2, 1010))
+        self.assertEqual(sizeindex.read_size_index(self.cachefile), index)
+
+    def test_unchanged_directories_are_not_walked(self):
+        first, walked = self.update()
+        second, walked = self.update()
+        self.assertEqual(walked, [])
+        self.assertEqual(first, second)
+
+    def test_added_file_is_seen(self):
+        self.update()
+        self.write(os.path.join('Train','B','B_1.wav'), 500)
+        index, walked = self.update()
+        self.assertEqual(walked, [ os.path.join('Train','B') ])
+        self.assertEqual(index[os.path.join(self.datadir, 'Train', 'B')]['bytes'], 1510)
+
+    def test_added_file_in_subdirectory_is_seen(self):
+        self.update()
+        self.write(os.path.join('Dev','C','nested','C_1.wav'), 500)
+        index, walked = self.update()
+        self.assertEqual(walked, [ os.path.join('Dev','C') ])
+        entry = index[os.path.join(self.datadir, 'Dev', 'C')]
+        self.assertEqual((entry['files'], entry['bytes']), (3, 1510))
+
+    def test_refresh_walks_everything(self):
+        self.update()
+        self.write(os.path.join('Train','A','A.json'), 20)   # rewritten in place: no mtime change
+        os.utime(os.path.join(self.datadir, 'Train', 'A'), ns=(0, 0))
+        index, walked = self.update()
+        self.assertEqual(walked, [])
+        self.assertEqual(index[os.path.join(self.datadir, 'Train', 'A')]['bytes'], 1010)
+        index, walked = self.update(refresh=True)
+        self.assertEqual(len(walked), 3)
+        self.assertEqual(index[os.path.join(self.datadir, 'Train', 'A')]['bytes'], 1020)
@@ -0,0 +1,213 @@
+import unittest, random, tempfile, shutil, os, json
+import numpy as np
+from old import update_train_test_split as ttsplit
+
+def fake_features(ncontributors, nratings=6, levels=5, seed=0):
+    '''
+    feature[dimension][contributor] = list of integer levels; every contributor has nratings per dimension
+    '''
+    rng = random.Random(seed)
+    feature = { f:{} for f in ['Intelligibility','Naturalness'] }
+    for n in range(ncontributors):
+        bias = rng.randint(0, levels-1)
+        for f in feature:
+            feature[f]['C%03d'%(n)] = [ min(levels-1, bias+rng.randint(0,1)) for i in range(nratings) ]
+    return feature
+
+class TestHistogramScore(unittest.TestCase):
+    def setUp(self):
+        self.feature = fake_features(30)
+        self.contributors = sorted(self.feature['Intelligibility'].keys())
+        self.prev = { 'train':self.contributors[:3], 'dev':[self.contributors[3]], 'test':[] }
+        self.unassigned = self.contributors[4:]
+        self.num_new = { 'train':20, 'dev':1, 'test':5 }
+
+    def test_matches_sorted_score_for_equal_sizes(self):
+        # With equal numbers of ratings per split, the sorted score is the exact Wasserstein distance
+        args = (self.feature, self.num_new, self.prev, self.unassigned)
+        sorted_cache, hist_cache = ttsplit.Score_Cache(*args), ttsplit.Histogram_Score_Cache(*args)
+        for i in range(10):
+            c = random.Random(i).sample(self.contributors, 6)
+            assignment = (tuple(sorted(c[:2])), tuple(sorted(c[2:4])), tuple(sorted(c[4:])))
+            labels = hist_cache.from_tuples(assignment)
+            self.assertEqual(hist_cache.to_tuples(labels), assignment)
+            self.assertAlmostEqual(sorted_cache.score_assignment(assignment),
+                                   hist_cache.score_assignment(labels))
+
+    def test_neighbor_search_is_local_optimum(self):
+        engine = ttsplit.Histogram_Score_Cache(self.feature, self.num_new, self.prev, self.unassigned)
+        random.seed(0)
+        score, assignment, pathlength = engine.neighbor_search(engine.randomly_assign())
+        splits = engine.to_tuples(assignment)
+        self.assertEqual([ len(s) for s in splits ], [23, 2, 5])
+        for n, split in enumerate(['train','dev','test']):
+            for c in self.prev[split]:
+                self.assertIn(c, splits[n], msg='%s moved out of %s'%(c, split))
+        self.assertAlmostEqual(score, engine.score_assignment(assignment))
+        for neighbor in engine.neighbors(assignment):
+            self.assertGreaterEqual(engine.score_assignment(neighbor), score - 1e-12)
+
+    def test_output_dict_matches_sorted_engine(self):
+        args = (self.feature, self.num_new, self.prev, self.unassigned)
+        sorted_cache, hist_cache = ttsplit.Score_Cache(*args), ttsplit.Histogram_Score_Cache(*args)
+        random.seed(1)
+        labels = hist_cache.randomly_assign()
+        self.assertEqual(hist_cache.create_output_dict(labels, 0.5),
+                         sorted_cache.create_output_dict(hist_cache.to_tuples(labels), 0.5))
+
+class TestBatchScore(unittest.TestCase):
+    def setUp(self):
+        self.feature = fake_features(20)
+        self.contributors = sorted(self.feature['Intelligibility'].keys())
+        self.args = (self.feature, {'train':14,'dev':2,'test':3},
+                     {'train':[self.contributors[0]],'dev':[],'test':[]}, self.contributors[1:])
+
+    def test_swap_scores_match_histogram_scores(self):
+        engine = ttsplit.Batch_Score_Cache(*self.args, chunk_elements=100)
+        random.seed(2)
+        assignment = engine.randomly_assign()
+        CS = np.cumsum(engine.split_histograms(assignment), axis=2)
+        for (s0,s1) in [(0,1),(0,2),(2,1)]:
+            a = np.flatnonzero((assignment==s0) & engine.movable)
+            b = np.flatnonzero((assignment==s1) & engine.movable)
+            scores = engine.swap_scores(CS, a, b, s0, s1)
+            for i in range(len(a)):
+                for j in range(len(b)):
+                    neighbor = assignment.copy()
+                    neighbor[a[i]], neighbor[b[j]] = s1, s0
+                    self.assertAlmostEqual(scores[i,j], engine.score_assignment(neighbor))
+
+    def test_neighbor_search_is_local_optimum(self):
+        for move in ['best','first']:
+            engine = ttsplit.Batch_Score_Cache(*self.args, move=move)
+            random.seed(3)
+            score, assignment, pathlength = engine.neighbor_search(engine.randomly_assign())
+            self.assertAlmostEqual(score, engine.score_assignment(assignment))
+            for neighbor in engine.neighbors(assignment):
+                self.assertGreaterEqual(engine.score_assignment(neighbor), score - 1e-12)
+
+class TestBudgetedSearch(unittest.TestCase):
+    def setUp(self):
+        self.feature = fake_features(20)
+        self.contributors = sorted(self.feature['Intelligibility'].keys())
+        self.args = (self.feature, {'train':15,'dev':2,'test':3},
+                     {'train':[],'dev':[],'test':[]}, self.contributors)
+
+    def test_anneal_and_tabu(self):
+        engine = ttsplit.Batch_Score_Cache(*self.args)
+        for search in [engine.anneal_search, engine.tabu_search]:
+            rng = random.Random(5)
+            original = engine.randomly_assign(rng)
+            initial_score = engine.score_assignment(original)
+            score, assignment, pathlength = search(original, rng, max_evaluations=2000)
+            self.assertLessEqual(score, initial_score)
+            self.assertEqual([ int(np.sum(assignment==s)) for s in range(3) ], [15, 2, 3])
+            self.assertAlmostEqual(score, engine.score_assignment(assignment))
+
+    def test_budget_is_required(self):
+        engine = ttsplit.Histogram_Score_Cache(*self.args)
+        with self.assertRaises(RuntimeError):
+            engine.anneal_search(engine.randomly_assign())
+        with self.assertRaises(RuntimeError):
+            ttsplit.run_restart(engine, 0, 'tabu', {'max_evaluations':10})
+
+class TestParallelRestarts(unittest.TestCase):
+    def test_parallel_matches_serial(self):
+        feature = fake_features(24)
+        contributors = sorted(feature['Intelligibility'].keys())
+        prev = { 'train':[], 'dev':[], 'test':[] }
+        num_new = { 'train':18, 'dev':2, 'test':4 }
+        results = []
+        for nworkers in [1, 3]:
+            outputs = list(ttsplit.search_with_restarts(feature, num_new, prev, contributors, 3, 5,
+                                                        nworkers=nworkers, seed=1234))
+            results.append(outputs[-1])
+        self.assertEqual(results[0], results[1])
+
+    def test_parallel_matches_serial_sorted_engine(self):
+        feature = fake_features(24)
+        contributors = sorted(feature['Intelligibility'].keys())
+        prev = { 'train':[], 'dev':[], 'test':[] }
+        num_new = { 'train':18, 'dev':2, 'test':4 }
+        results = []
+        for nworkers in [1, 3]:
+            outputs = list(ttsplit.search_with_restarts(feature, num_new, prev, contributors, 3, 6, 'sorted',
+                                                        nworkers=nworkers, seed=1234))
+            results.append(outputs[-1])
+        self.assertEqual(results[0], results[1])
+
+    def test_randomly_assign_depends_only_on_seed(self):
+        feature = fake_features(24)
+        contributors = sorted(feature['Intelligibility'].keys())
+        prev = { 'train':[], 'dev':[], 'test':[] }
+        num_new = { 'train':18, 'dev':2, 'test':4 }
+        for engine in ttsplit.ENGINES.values():
+            score_cache = engine(feature, num_new, prev, contributors)
+            first = score_cache.to_tuples(score_cache.randomly_assign(random.Random(5)))
+            score_cache.randomly_assign(random.Random(6))
+            self.assertEqual(score_cache.to_tuples(score_cache.randomly_assign(random.Random(5))), first)
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.feature = fake_features(24)
+        self.args = (self.feature, { 'train':18, 'dev':2, 'test':4 }, { 'train':[], 'dev':[], 'test':[] },
+                     sorted(self.feature['Intelligibility'].keys()), 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_resume_matches_uninterrupted_search(self):
+        checkpoint = os.path.join(self.tmpdir, 'checkpoint.json')
+        for engine in ['sorted','batch']:
+            uninterrupted = list(ttsplit.search_with_restarts(*self.args, 8, engine, seed=99))
+            list(ttsplit.search_with_restarts(*self.args, 4, engine, seed=99, checkpoint=checkpoint))
+            resumed = list(ttsplit.search_with_restarts(*self.args, 8, engine, checkpoint=checkpoint,
+                                                        resume=True))
+            final = resumed[-1] if len(resumed) > 0 else None
+            if final == None:  # the beam did not change after the checkpoint
+                final = list(ttsplit.search_with_restarts(*self.args, 4, engine, seed=99))[-1]
+            self.assertEqual(final, uninterrupted[-1])
+            self.assertLessEqual(len(uninterrupted), 8)
+
+    def test_mismatched_checkpoint_is_refused(self):
+        checkpoint = os.path.join(self.tmpdir, 'checkpoint.json')
+        list(ttsplit.search_with_restarts(*self.args, 2, 'batch', seed=99, checkpoint=checkpoint))
+        feature = fake_features(24)
+        feature['Intelligibility'][sorted(feature['Intelligibility'])[0]].append(4)
+        mismatches = [ (self.args, dict(engine='sorted')),
+                       (self.args[:4]+(2,), dict(engine='batch')),
+                       (self.args, dict(engine='batch', engine_options={'move':'first'})),
+                       (self.args, dict(engine='batch', seed=98)),
+                       ((feature,)+self.args[1:], dict(engine='batch')) ]
+        for args, options in mismatches:
+            with self.assertRaises(RuntimeError, msg=str(options)):
+                list(ttsplit.search_with_restarts(*args, 4, checkpoint=checkpoint, resume=True, **options))
+        resumed = list(ttsplit.search_with_restarts(*self.args, 4, 'batch', seed=99, checkpoint=checkpoint,
+                                                    resume=True))
+        with open(checkpoint) as f:
+            self.assertEqual(json.load(f)['n_done'], 4)
+
+class TestLRUCache(unittest.TestCase):
+    def test_cache_statistics_are_reported_only_for_sorted_engine(self):
+        feature = fake_features(12)
+        args = (feature, { 'train':8, 'dev':2, 'test':2 }, { 'train':[], 'dev':[], 'test':[] },
+                sorted(feature['Intelligibility'].keys()))
+        report = ttsplit.run_restart(ttsplit.Score_Cache(*args), 0)[3]
+        self.assertNotRegex(report, '^0 hits, 0 misses')
+        for engine in [ ttsplit.Histogram_Score_Cache, ttsplit.Batch_Score_Cache ]:
+            score_cache = engine(*args)
+            self.assertIsNone(score_cache.cache)
+            self.assertIsNone(ttsplit.run_restart(score_cache, 0)[3])
+
+    def test_eviction_and_stats(self):
+        cache = ttsplit.LRU_Cache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)   # a is now most recently used
+        cache.put('c', 3)                     # evicts b
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual((cache.hits, cache.misses, cache.evictions, len(cache)), (2, 1, 1, 2))
+        cache.reset_stats()
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (0, 0, 0))